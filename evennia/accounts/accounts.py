@@ -275,6 +275,10 @@ class DefaultAccount(with_metaclass(TypeclassBase, AccountDB)):
         obj.account = self
         session.puid = obj.id
         session.puppet = obj
+        global _SESSIONS
+        if not _SESSIONS:
+            from evennia.server.sessionhandler import SESSIONS as _SESSIONS
+        _SESSIONS.update_session_index(session)
         # validate/start persistent scripts on object
         obj.scripts.validate()
 
@@ -295,6 +299,9 @@ class DefaultAccount(with_metaclass(TypeclassBase, AccountDB)):
             RuntimeError With message about error.
 
         """
+        global _SESSIONS
+        if not _SESSIONS:
+            from evennia.server.sessionhandler import SESSIONS as _SESSIONS
         for session in make_iter(session):
             obj = session.puppet
             if obj:
@@ -307,6 +314,7 @@ class DefaultAccount(with_metaclass(TypeclassBase, AccountDB)):
             # Just to be sure we're always clear.
             session.puppet = None
             session.puid = None
+            _SESSIONS.update_session_index(session)
 
     def unpuppet_all(self):
         """
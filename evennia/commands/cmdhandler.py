@@ -41,7 +41,7 @@ from copy import copy
 import types
 from twisted.internet import reactor
 from twisted.internet.task import deferLater
-from twisted.internet.defer import inlineCallbacks, returnValue
+from twisted.internet.defer import Deferred, inlineCallbacks, returnValue
 from django.conf import settings
 from evennia.commands.command import InterruptCommand
 from evennia.comms.channelhandler import CHANNELHANDLER
@@ -514,6 +514,17 @@ def cmdhandler(called_by, raw_string, _testing=False, callertype="session", sess
         default Evennia.
 
     """
+    # if output to the session is being collected
+    output_buffered = [False]
+
+    def _flush_output():
+        """
+        Send the output collected while the command ran, once.
+
+        """
+        if output_buffered[0]:
+            output_buffered[0] = False
+            session.sessionhandler.flush_output(session)
 
     @inlineCallbacks
     def _run_command(cmd, cmdname, args, raw_cmdname, cmdset, session, account):
@@ -589,6 +600,9 @@ def cmdhandler(called_by, raw_string, _testing=False, callertype="session", sess
             # main command code
             # (return value is normally None)
             ret = cmd.func()
+            if isinstance(ret, (types.GeneratorType, Deferred)):
+                # the command goes on asynchronously; don't hold its output
+                _flush_output()
             if isinstance(ret, types.GeneratorType):
                 # cmd.func() is a generator, execute progressively
                 _progressive_cmd_run(cmd, ret)
@@ -640,6 +654,11 @@ def cmdhandler(called_by, raw_string, _testing=False, callertype="session", sess
     # does not get spammed for errors while preserving character mirroring.
     error_to = obj or session or account
 
+    if session:
+        # collect output to the session until the command is done
+        session.sessionhandler.buffer_output(session)
+        output_buffered[0] = True
+
     try:  # catch bugs in cmdhandler itself
         try:  # catch special-type commands
             if cmdobj:
@@ -758,3 +777,6 @@ def cmdhandler(called_by, raw_string, _testing=False, callertype="session", sess
     except Exception:
         # This catches exceptions in cmdhandler exceptions themselves
         _msg_err(error_to, _ERROR_CMDHANDLER)
+
+    finally:
+        _flush_output()
@@ -286,6 +286,11 @@ class TestAccount(CommandTest):
 
 
 class TestBuilding(CommandTest):
+    def tearDown(self):
+        # test_spawn stores prototypes, which the registry caches
+        protlib.PROTOTYPE_REGISTRY.reset()
+        super(TestBuilding, self).tearDown()
+
     def test_create(self):
         name = settings.BASE_OBJECT_TYPECLASS.rsplit('.', 1)[1]
         self.call(building.CmdCreate(), "/d TestObj1",   # /d switch is abbreviated form of /drop
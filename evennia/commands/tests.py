@@ -376,3 +376,55 @@ class TestGetAndMergeCmdSets(TwistedTestCase, EvenniaTest):
             self.assertEqual(len(cmdset.commands), 9)
         deferred.addCallback(_callback)
         return deferred
+
+
+from functools import partial
+from mock import patch
+from evennia.server.sessionhandler import ServerSessionHandler
+from twisted.internet.defer import Deferred
+
+
+class _CmdDeferred(Command):
+    "Sends some text, then returns a Deferred that is fired later."
+    key = "deferred"
+
+    def func(self):
+        self.session.msg("Started.")
+        deferred = self.session.ndb.deferred = Deferred()
+        deferred.addCallback(lambda _: self.session.msg("Done."))
+        return deferred
+
+
+class _CmdSetDeferred(CmdSet):
+    key = "deferred"
+
+    def at_cmdset_creation(self):
+        self.add(_CmdDeferred())
+
+
+class TestCmdHandlerOutputBuffering(EvenniaTest):
+    "Test the output buffering of commands run by the cmdhandler."
+
+    def setUp(self):
+        super(TestCmdHandlerOutputBuffering, self).setUp()
+        self.sessionhandler = self.session.sessionhandler
+        # the test sessionhandler's data_out is mocked; use the real one
+        patchers = [patch.object(self.sessionhandler, "data_out",
+                                 partial(ServerSessionHandler.data_out, self.sessionhandler)),
+                    patch.object(self.sessionhandler, "server")]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.send = self.sessionhandler.server.amp_protocol.send_MsgServer2Portal
+
+    def test_deferred_command(self):
+        self.session.cmdset.add(_CmdSetDeferred)
+        cmdhandler.cmdhandler(self.session, "deferred", callertype="session", session=self.session)
+        # the output so far is sent while the command waits
+        self.assertEqual(self.send.call_count, 1)
+        self.assertEqual(self.send.call_args[1]["text"][0], ["Started."])
+        self.assertFalse(self.sessionhandler.output_buffers)
+        self.session.ndb.deferred.callback(None)
+        self.assertEqual(self.send.call_count, 2)
+        self.assertEqual(self.send.call_args[1]["text"][0], ["Done."])
+        self.assertFalse(self.sessionhandler.output_buffers)
@@ -3,24 +3,53 @@ Custom manager for Objects.
 """
 import re
 from itertools import chain
+from twisted.internet import reactor
+from twisted.internet.task import deferLater
+from django.db import transaction
 from django.db.models import Q
 from django.conf import settings
 from django.db.models.fields import exceptions
+from django.utils.translation import ugettext as _
 from evennia.typeclasses.managers import TypedObjectManager, TypeclassManager
-from evennia.utils.utils import to_unicode, is_iter, make_iter, string_partial_matching
-from builtins import int
+from evennia.utils import logger
+from evennia.utils.utils import (to_unicode, is_iter, make_iter, string_partial_matching,
+                                 list_to_string)
+from builtins import int, object
 
 __all__ = ("ObjectManager",)
 _GA = object.__getattribute__
 
 # delayed import
 _ATTR = None
+_MONITOR_HANDLER = None
+_ScriptDB = None
+
+# max number of ids to put in a single `WHERE id IN (...)` clause. SQLite
+# limits the number of variables in a query to 999.
+_BULK_CHUNK_SIZE = 500
 
 _MULTIMATCH_REGEX = re.compile(settings.SEARCH_MULTIMATCH_REGEX, re.I + re.U)
 
 # Try to use a custom way to parse id-tagged multimatches.
 
 
+class _ObjectGroup(object):
+    """
+    Stand-in for a group of objects in a `msg_contents` mapping. Each
+    looker will see the display names of all objects in the group
+    as seen by them, as a comma-separated list.
+
+    """
+    def __init__(self, objs):
+        self.objs = objs
+
+    def get_display_name(self, looker, **kwargs):
+        return list_to_string([obj.get_display_name(looker, **kwargs) for obj in self.objs])
+
+    def __str__(self):
+        return list_to_string([obj.key for obj in self.objs])
+
+
 class ObjectDBManager(TypedObjectManager):
     """
     This ObjectManager implements methods for searching
@@ -46,6 +75,8 @@ class ObjectDBManager(TypedObjectManager):
     object_search (interface to many of the above methods,
                    equivalent to evennia.search_object)
     copy_object
+    bulk_move
+    bulk_delete
 
     """
 
@@ -508,6 +539,325 @@ class ObjectDBManager(TypedObjectManager):
     
         return new_object
 
+    #
+    # ObjectManager bulk operations
+
+    def bulk_move(self, objs, destination, quiet=False, hooks=True, use_destination=True,
+                  msg_from=None, msg_to=None, mapping=None):
+        """
+        Move many objects to the same destination in one go. This is
+        the bulk version of `DefaultObject.move_to`, useful for
+        evacuating areas or moving groups of NPCs.
+
+        Args:
+            objs (list): The objects to move.
+            destination (Object): Where to move the objects. If this is an
+                exit, its destination will be used (see `use_destination`).
+            quiet (bool, optional): If set, don't announce the move to the
+                source and destination locations.
+            hooks (bool, optional): If `False`, skip all move-related
+                hooks (`at_before_move`, `at_object_leave` etc).
+            use_destination (bool, optional): If `False`, don't
+                use the `destination` of `destination`, allowing for
+                moving objects into exit objects.
+            msg_from (str, optional): Replacement message to show in the
+                source location(s). This can use the same mapping keys as
+                `DefaultObject.announce_move_from`, but with `{objects}`
+                replacing `{object}`.
+            msg_to (str, optional): Replacement message to show in the
+                destination, with the same mappings as `msg_from`.
+            mapping (dict, optional): Additional mapping objects for the
+                announcement messages.
+
+        Returns:
+            moved (list): The objects that were actually moved. Objects whose
+                `at_before_move` returned `False`, or whose `at_before_move` or
+                `at_object_leave` raised errors, are not moved.
+
+        Raises:
+            RuntimeError: If the destination is (inside) one of the objects
+                being moved.
+
+        Notes:
+            The location of all objects is updated with a single database
+            update (chunked for very large groups), after which the in-memory
+            instances and contents caches are patched directly. The hooks are
+            called in the same order as for `move_to`, but with all objects
+            being handled for each step before moving on to the next one.
+
+            Announcements are aggregated so that each source location gets one
+            message about all objects leaving it and the destination gets one
+            message per source location. This means the per-object
+            `announce_move_from`/`announce_move_to` hooks are *not* called. Use
+            `move_to` for objects that need their custom announcements.
+
+        """
+        global _MONITOR_HANDLER
+        if not _MONITOR_HANDLER:
+            from evennia.scripts.monitorhandler import MONITOR_HANDLER as _MONITOR_HANDLER
+
+        objs = [obj for obj in make_iter(objs) if obj and obj.pk]
+        if not objs or not destination:
+            return []
+        if use_destination and destination.destination:
+            # traverse exits
+            destination = destination.destination
+
+        # we can't move something into itself
+        moving = set(obj.pk for obj in objs)
+        location, depth = destination, 0
+        while location and depth <= 10:
+            if location.pk in moving:
+                raise RuntimeError("Error: bulk_move to %s creates a location loop." % destination.key)
+            location, depth = location.db_location, depth + 1
+
+        failed = object()
+
+        def _call_hook(obj, hookname, *args):
+            """Call a hook, returning `failed` on error"""
+            try:
+                return getattr(obj, hookname)(*args)
+            except Exception:
+                logger.log_trace("bulk_move: %s.%s() failed." % (obj, hookname))
+                return failed
+
+        def _before_move(obj):
+            """As in move_to, only at_before_move can veto the move"""
+            allowed = _call_hook(obj, "at_before_move", destination)
+            return bool(allowed) and allowed is not failed
+
+        if hooks:
+            objs = [obj for obj in objs if _before_move(obj)]
+
+        # group the objects by where they are coming from
+        sources = []
+        groups = {}
+        for obj in objs:
+            source_location = obj.db_location
+            if source_location not in groups:
+                sources.append(source_location)
+                groups[source_location] = []
+            groups[source_location].append(obj)
+
+        if hooks:
+            for source_location in sources:
+                if source_location:
+                    groups[source_location] = [
+                        obj for obj in groups[source_location]
+                        if _call_hook(source_location, "at_object_leave", obj, destination) is not failed]
+        objs = [obj for source_location in sources for obj in groups[source_location]]
+        if not objs:
+            return []
+
+        def _announce(location, string, group, origin):
+            """Aggregate the move into one msg_contents call"""
+            # the exit leading to the other end of the move, if any
+            target = origin if location == destination else destination
+            exits = [exi for exi in location.contents if target and exi.destination == target]
+            msgmapping = dict(mapping or {})
+            msgmapping.update({
+                "objects": _ObjectGroup(group),
+                "exit": exits[0] if exits else "somewhere",
+                "origin": origin or "nowhere",
+                "destination": destination})
+            location.msg_contents(string, exclude=objs, mapping=msgmapping)
+
+        if not quiet:
+            for source_location in sources:
+                if source_location and groups[source_location]:
+                    _announce(source_location,
+                              msg_from or "{objects} are leaving {origin}, heading for {destination}.",
+                              groups[source_location], source_location)
+
+        # perform the move
+        with transaction.atomic():
+            for ichunk in range(0, len(objs), _BULK_CHUNK_SIZE):
+                chunk = objs[ichunk:ichunk + _BULK_CHUNK_SIZE]
+                self.filter(id__in=[obj.id for obj in chunk]).update(db_location=destination)
+        for source_location in sources:
+            for obj in groups[source_location]:
+                # no save() was called so we must update instances and caches manually
+                obj.db_location = destination
+                if source_location:
+                    source_location.contents_cache.remove(obj)
+                destination.contents_cache.add(obj)
+                _MONITOR_HANDLER.at_update(obj, "db_location")
+
+        if not quiet:
+            for source_location in sources:
+                if groups[source_location]:
+                    if msg_to:
+                        string = msg_to
+                    elif source_location:
+                        string = "{objects} arrive to {destination} from {origin}."
+                    else:
+                        string = "{objects} arrive to {destination}."
+                    _announce(destination, string, groups[source_location], source_location)
+
+        if hooks:
+            for source_location in sources:
+                for obj in groups[source_location]:
+                    _call_hook(destination, "at_object_receive", obj, source_location)
+                    _call_hook(obj, "at_after_move", source_location)
+        return objs
+
+    def bulk_delete(self, objs, hooks=True, chunk_size=_BULK_CHUNK_SIZE, yield_chunks=False):
+        """
+        Delete many objects in one go. This is the bulk version of
+        `DefaultObject.delete`, useful for cleaning up instanced areas and
+        other large groups of objects.
+
+        Args:
+            objs (list): The objects to delete.
+            hooks (bool, optional): If `False`, don't call the
+                `at_object_delete` hook of the objects, nor the stop-hooks of
+                their scripts and the move-hooks of contents sent home.
+            chunk_size (int, optional): How many objects to delete with
+                each set of database queries.
+            yield_chunks (bool, optional): Return control to the reactor
+                between every chunk, so as to not block the server while
+                deleting very large groups. Each chunk will then be deleted
+                in its own transaction.
+
+        Returns:
+            deleted (int or Deferred): The number of deleted objects. If
+                `yield_chunks` is set, this is a Deferred that will fire with
+                the number when all chunks have been deleted.
+
+        Notes:
+            All exits leading to or from the deleted objects will be deleted
+            along with them. Contents that are not themselves deleted are moved
+            to their homes (or to the default home if their home is also
+            deleted), grouped with `bulk_move`. Scripts are stopped, and
+            Attributes, Nicks and Tag-links are removed with set-based queries
+            instead of per-object. Unless `yield_chunks` is set, all database
+            changes happen within one transaction.
+
+            Objects for which `at_object_delete` returns `False` are not
+            deleted.
+
+        """
+        global _ScriptDB, _ATTR
+        if not _ScriptDB:
+            from evennia.scripts.models import ScriptDB as _ScriptDB
+        if not _ATTR:
+            from evennia.typeclasses.models import Attribute as _ATTR
+
+        def _deletable(objs):
+            """Filter out objects refusing to be deleted"""
+            if not hooks:
+                return objs
+            deletable = []
+            for obj in objs:
+                try:
+                    if obj.at_object_delete():
+                        deletable.append(obj)
+                except Exception:
+                    logger.log_trace("bulk_delete: %s.at_object_delete() failed." % obj)
+            return deletable
+
+        def _chunked(objs):
+            """Split a list of objects into chunks"""
+            return [objs[ichunk:ichunk + chunk_size] for ichunk in range(0, len(objs), chunk_size)]
+
+        objs = _deletable([obj for obj in make_iter(objs) if obj and obj.pk])
+        pks = set(obj.pk for obj in objs)
+
+        # exits to/from a deleted object are deleted along with it
+        new_objs = objs
+        while new_objs:
+            exits = []
+            for chunk in _chunked([obj.id for obj in new_objs]):
+                exits.extend(self.filter(Q(db_destination__id__in=chunk) |
+                                         Q(db_location__id__in=chunk, db_destination__isnull=False)))
+            new_objs = _deletable([exi for exi in set(exits) if exi.pk not in pks])
+            pks.update(exi.pk for exi in new_objs)
+            objs.extend(new_objs)
+
+        try:
+            default_home = self.get(id=int(settings.DEFAULT_HOME.lstrip("#")))
+            if default_home.id in pks:
+                default_home = None
+        except Exception:
+            logger.log_err("Could not find default home '%s'." % settings.DEFAULT_HOME)
+            default_home = None
+
+        def _clear_contents(chunk_ids):
+            """Move contents not being deleted to their homes"""
+            homes = {}
+            for obj in self.filter(db_location__id__in=chunk_ids):
+                if obj.pk in pks:
+                    continue
+                home = obj.db_home
+                if not home or home.pk in pks:
+                    home = default_home
+                    obj.home = home
+                if obj.has_account:
+                    if home:
+                        obj.msg(_("Your current location has ceased to exist,"
+                                  " moving you to %s(#%d).") % (home.name, home.dbid))
+                    else:
+                        obj.msg(_("Something went wrong! You are dumped into nowhere. Contact an admin."))
+                homes.setdefault(home, []).append(obj)
+            for home, group in homes.items():
+                if home:
+                    self.bulk_move(group, home, quiet=not hooks, hooks=hooks, use_destination=False)
+                else:
+                    for obj in group:
+                        obj.location = None
+
+        def _delete_chunk(chunk):
+            """Delete one chunk of objects"""
+            chunk_ids = [obj.id for obj in chunk]
+            for obj in chunk:
+                if obj.db_account:
+                    # sever the connection to the account (it goes OOC)
+                    for session in obj.sessions.all():
+                        session.msg(_("Your character %s has been destroyed.") % obj.key)
+                        obj.account.unpuppet_object(session)
+                    obj.account = None
+            for script in _ScriptDB.objects.filter(db_obj__id__in=chunk_ids):
+                script.stop(kill=not hooks)
+            _clear_contents(chunk_ids)
+
+            _ATTR.objects.filter(objectdb__id__in=chunk_ids).delete()
+            self.model.db_tags.through.objects.filter(objectdb__id__in=chunk_ids).delete()
+            self.filter(id__in=chunk_ids).delete()
+
+            for obj in chunk:
+                location = obj.db_location
+                if location and location.pk not in pks:
+                    location.contents_cache.remove(obj)
+                obj.flush_from_cache(force=True)
+                obj._is_deleted = True
+                obj.delete = obj._deleted
+            return len(chunk)
+
+        def _cleanup(ndeleted):
+            """Remove references to deleted objects from the cached instances"""
+            for obj in self.model.get_all_cached_instances():
+                if obj.db_home_id in pks:
+                    obj.db_home = None
+                if obj.db_destination_id in pks:
+                    obj.db_destination = None
+            return ndeleted
+
+        chunks = _chunked(objs)
+
+        if yield_chunks:
+            def _delete_next(ichunk, ndeleted):
+                """Delete one chunk and schedule the next one"""
+                if ichunk >= len(chunks):
+                    return _cleanup(ndeleted)
+                with transaction.atomic():
+                    ndeleted += _delete_chunk(chunks[ichunk])
+                return deferLater(reactor, 0, _delete_next, ichunk + 1, ndeleted)
+            return deferLater(reactor, 0, _delete_next, 0, 0)
+
+        with transaction.atomic():
+            ndeleted = sum(_delete_chunk(chunk) for chunk in chunks)
+        return _cleanup(ndeleted)
+
     def clear_all_sessids(self):
         """
         Clear the db_sessid field of all objects having also the
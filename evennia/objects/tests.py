@@ -0,0 +1,88 @@
+"""
+Unit tests for the Object system.
+
+"""
+from mock import Mock
+from django.core.exceptions import ObjectDoesNotExist
+from evennia.utils.test_resources import EvenniaTest
+from evennia.utils import create
+from evennia.objects.models import ObjectDB
+from evennia.typeclasses.models import Attribute
+
+
+class TestBulkMove(EvenniaTest):
+
+    def test_bulk_move(self):
+        moved = ObjectDB.objects.bulk_move([self.obj1, self.obj2], self.room2, quiet=True)
+        self.assertEqual(moved, [self.obj1, self.obj2])
+        self.assertEqual(self.obj1.location, self.room2)
+        self.assertEqual(self.obj2.location, self.room2)
+        self.assertTrue(self.obj1 in self.room2.contents)
+        self.assertFalse(self.obj2 in self.room1.contents)
+        # the database was updated too
+        self.assertEqual(set(ObjectDB.objects.filter(db_location=self.room2)),
+                         set([self.obj1, self.obj2]))
+
+    def test_bulk_move_exit(self):
+        ObjectDB.objects.bulk_move([self.obj1], self.exit, quiet=True)
+        self.assertEqual(self.obj1.location, self.room2)
+
+    def test_bulk_move_loop(self):
+        self.assertRaises(RuntimeError, ObjectDB.objects.bulk_move,
+                          [self.obj1, self.room2], self.room2)
+        self.assertEqual(self.obj1.location, self.room1)
+
+    def test_bulk_move_hooks(self):
+        self.obj1.at_before_move = Mock(return_value=False)
+        self.obj2.at_after_move = Mock()
+        moved = ObjectDB.objects.bulk_move([self.obj1, self.obj2], self.room2, quiet=True)
+        self.assertEqual(moved, [self.obj2])
+        self.assertEqual(self.obj1.location, self.room1)
+        self.obj2.at_after_move.assert_called_with(self.room1)
+
+    def test_bulk_move_leave_hook(self):
+        # like move_to, the return value of at_object_leave is ignored
+        self.room1.at_object_leave = Mock(side_effect=[False, RuntimeError])
+        moved = ObjectDB.objects.bulk_move([self.obj1, self.obj2], self.room2, quiet=True)
+        self.assertEqual(moved, [self.obj1])
+        self.assertEqual(self.obj2.location, self.room1)
+
+    def test_bulk_move_announce(self):
+        self.char2.msg = Mock()
+        ObjectDB.objects.bulk_move([self.obj1, self.obj2], self.room2)
+        self.char2.msg.assert_called_once_with(
+            text=("Obj and Obj2 are leaving Room, heading for Room2.", {}), from_obj=None)
+
+
+class TestBulkDelete(EvenniaTest):
+
+    def setUp(self):
+        super(TestBulkDelete, self).setUp()
+        self.room3 = create.create_object(self.room_typeclass, key="Room3")
+        self.exit2 = create.create_object(self.exit_typeclass, key="in",
+                                          location=self.room2, destination=self.room3)
+        self.obj3 = create.create_object(self.object_typeclass, key="Obj3",
+                                         location=self.room3, home=self.room2)
+        self.obj3.db.testattr = 5
+        self.obj3.tags.add("testtag")
+
+    def test_bulk_delete(self):
+        obj3 = self.obj3
+        self.assertEqual(ObjectDB.objects.bulk_delete([self.room3, self.obj3]), 3)
+        self.assertFalse(ObjectDB.objects.filter(id__in=(self.room3.id, self.exit2.id)))
+        self.assertFalse(Attribute.objects.filter(db_key="testattr"))
+        self.assertFalse(ObjectDB.objects.get_by_tag("testtag"))
+        self.assertFalse(self.exit2 in self.room2.contents)
+        self.assertRaises(ObjectDoesNotExist, obj3.delete)
+
+    def test_bulk_delete_contents(self):
+        ObjectDB.objects.bulk_delete([self.room3], hooks=False)
+        self.assertEqual(self.obj3.location, self.room2)
+        self.assertTrue(self.obj3 in self.room2.contents)
+        self.assertEqual(self.obj3.db.testattr, 5)
+
+    def test_bulk_delete_hooks(self):
+        self.room3.at_object_delete = Mock(return_value=False)
+        self.assertEqual(ObjectDB.objects.bulk_delete([self.room3, self.obj2]), 1)
+        self.assertTrue(ObjectDB.objects.filter(id=self.room3.id))
+        self.assertFalse(ObjectDB.objects.filter(id=self.obj2.id))
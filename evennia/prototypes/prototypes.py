@@ -6,9 +6,11 @@ Handling storage of prototypes, both database-based ones (DBPrototypes) and thos
 """
 
 import re
+import copy
 import hashlib
 import time
 from ast import literal_eval
+from collections import OrderedDict
 from django.conf import settings
 from evennia.scripts.scripts import DefaultScript
 from evennia.objects.models import ObjectDB
@@ -33,6 +35,8 @@ _PROTOTYPE_TAG_CATEGORY = "from_prototype"
 _PROTOTYPE_TAG_META_CATEGORY = "db_prototype"
 PROT_FUNCS = {}
 
+_SCRIPTDB = None
+
 _RE_DBREF = re.compile(r"(?<!\$obj\()(#[0-9]+)")
 
 
@@ -145,6 +149,147 @@ class DbPrototype(DefaultScript):
     @prototype.setter
     def prototype(self, prototype):
         self.attributes.add('prototype', prototype)
+        PROTOTYPE_REGISTRY.reset()
+
+    def delete(self):
+        "Make sure the registry doesn't keep the deleted prototype around."
+        super(DbPrototype, self).delete()
+        PROTOTYPE_REGISTRY.reset()
+
+
+def _copy_prototype(value):
+    """
+    Copy the mutable containers of a prototype without deep-copying the
+    values they contain (they may be database objects).
+
+    """
+    if isinstance(value, dict):
+        return {key: _copy_prototype(val) for key, val in value.items()}
+    elif isinstance(value, (list, tuple, set)):
+        return type(value)(_copy_prototype(val) for val in value)
+    return value
+
+
+class PrototypeRegistry(object):
+    """
+    In-memory cache of all database-stored prototypes, indexed by
+    `prototype_key`, tag and `prototype_parent`. Loading the DbPrototypes
+    means unpickling the `prototype` Attribute of every one of them, so
+    this is only done once and then again only after the registry was
+    reset (this happens whenever a prototype is saved or deleted).
+
+    """
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        """
+        Invalidate the cache, forcing it to re-load from the database the
+        next time it's used.
+
+        """
+        self._prototypes = None
+        self._tags = {}
+        self._children = {}
+
+    def _load(self):
+        """
+        Load all prototypes and build the indexes, using one query for the
+        prototypes and one for their tags.
+
+        """
+        global _SCRIPTDB
+        if not _SCRIPTDB:
+            from evennia.scripts.models import ScriptDB as _SCRIPTDB
+        prototypes = OrderedDict()
+        keys = {}
+        attrlinks = _SCRIPTDB.db_attributes.through.objects.filter(
+            scriptdb__db_typeclass_path=DbPrototype.path,
+            attribute__db_key="prototype", attribute__db_category=None).select_related(
+            "scriptdb", "attribute").order_by("scriptdb__id")
+        for attrlink in attrlinks:
+            prototype = dbserialize.deserialize(attrlink.attribute.value)
+            prototypes[attrlink.scriptdb.db_key] = prototype
+            keys[attrlink.scriptdb_id] = attrlink.scriptdb.db_key
+            for parent in make_iter(prototype.get("prototype_parent", [])):
+                self._children.setdefault(parent.lower(), []).append(attrlink.scriptdb.db_key)
+
+        taglinks = _SCRIPTDB.db_tags.through.objects.filter(
+            scriptdb__db_typeclass_path=DbPrototype.path,
+            tag__db_category=_PROTOTYPE_TAG_META_CATEGORY).values_list("scriptdb_id", "tag__db_key")
+        for scriptid, tagkey in taglinks:
+            if scriptid in keys:
+                self._tags.setdefault(tagkey, set()).add(keys[scriptid])
+        self._prototypes = prototypes
+
+    @property
+    def prototypes(self):
+        """All cached prototypes, as an ordered mapping `{prototype_key: prototype}`."""
+        if self._prototypes is None:
+            self._load()
+        return self._prototypes
+
+    def get(self, prototype_key):
+        """
+        Get a prototype by its exact `prototype_key`.
+
+        Args:
+            prototype_key (str): The key to look for.
+
+        Returns:
+            prototype (dict or None): A copy of the prototype, if found.
+
+        """
+        prototype = self.prototypes.get(prototype_key)
+        return _copy_prototype(prototype) if prototype is not None else None
+
+    def get_children(self, prototype_key):
+        """
+        Get all prototypes directly inheriting from a given prototype.
+
+        Args:
+            prototype_key (str): The parent's `prototype_key`.
+
+        Returns:
+            children (list): Copies of all prototypes having `prototype_key`
+                among their `prototype_parent`s.
+
+        """
+        prototypes = self.prototypes
+        return [_copy_prototype(prototypes[key])
+                for key in self._children.get(prototype_key.lower(), [])]
+
+    def search(self, key=None, tags=None):
+        """
+        Search the cached prototypes. This mimics a database search for the
+        DbPrototype scripts.
+
+        Args:
+            key (str, optional): An exact key or a case-insensitive part of a key. If an exact
+                match is found, only that is returned.
+            tags (str or list, optional): Tags the prototypes must have (all of them) in the
+                `db_prototype` tag category.
+
+        Returns:
+            matches (list): Copies of the matching prototypes, in creation order.
+
+        """
+        prototypes = self.prototypes
+        keys = prototypes.keys()
+        if tags:
+            tagged = set.intersection(*[self._tags.get(tag.strip().lower(), set())
+                                        for tag in make_iter(tags)])
+            keys = [prototype_key for prototype_key in keys if prototype_key in tagged]
+        if key:
+            if key in keys:
+                keys = [key]
+            else:
+                lkey = key.lower()
+                keys = [prototype_key for prototype_key in keys if lkey in prototype_key.lower()]
+        return [_copy_prototype(prototypes[prototype_key]) for prototype_key in keys]
+
+
+PROTOTYPE_REGISTRY = PrototypeRegistry()
 
 
 # Prototype manager functions
@@ -226,6 +371,7 @@ def save_prototype(**kwargs):
             DbPrototype, key=prototype_key, desc=prototype['prototype_desc'], persistent=True,
             locks=prototype_locks, tags=prototype['prototype_tags'],
             attributes=[("prototype", prototype)])
+    PROTOTYPE_REGISTRY.reset()
     return stored_prototype.prototype
 
 create_prototype = save_prototype   # alias
@@ -307,20 +453,9 @@ def search_prototype(key=None, tags=None):
     else:
         module_prototypes = [match for match in mod_matches.values()]
 
-    # search db-stored prototypes
+    # search db-stored prototypes (cached in the registry)
 
-    if tags:
-        # exact match on tag(s)
-        tags = make_iter(tags)
-        tag_categories = ["db_prototype" for _ in tags]
-        db_matches = DbPrototype.objects.get_by_tag(tags, tag_categories)
-    else:
-        db_matches = DbPrototype.objects.all()
-    if key:
-        # exact or partial match on key
-        db_matches = db_matches.filter(db_key=key) or db_matches.filter(db_key__icontains=key)
-        # return prototype
-    db_prototypes = [dbprot.prototype for dbprot in db_matches]
+    db_prototypes = PROTOTYPE_REGISTRY.search(key=key, tags=tags)
 
     matches = db_prototypes + module_prototypes
     nmatches = len(matches)
@@ -745,6 +880,47 @@ def init_spawn_value(value, validator=None):
         return validator(value)
 
 
+def compile_spawn_value(value, validator=None):
+    """
+    Pre-process a prototype value for repeated use. This does the same as
+    `init_spawn_value` but only the parts that would give a different result
+    every time are left to do when the returned callable is called.
+
+    Args:
+        value (any): The prototype value, as for `init_spawn_value`.
+        validator (callable, optional): Called with the value every time it is
+            produced, as for `init_spawn_value`.
+
+    Returns:
+        producer (callable): A callable taking no arguments, returning the
+            same as `init_spawn_value(value, validator)` would.
+
+    Notes:
+        Values containing protfuncs (including `#dbref`s, which are converted to `$obj`
+        protfuncs) are dynamic and will be fully parsed every time. All other values
+        are parsed only once here.
+
+    """
+    validator = validator if validator else lambda o: o
+    string = value
+    if not isinstance(string, basestring):
+        try:
+            string = string.dbref
+        except AttributeError:
+            pass
+        string = to_str(string, force_string=True)
+    if inlinefuncs._RE_STARTTOKEN.search(_RE_DBREF.sub("$obj(\\1)", string)):
+        # a dynamic value
+        return lambda: init_spawn_value(value, validator)
+
+    # a static value. This can't be callable after having been through
+    # protfunc_parser, but the result may be a mutable container.
+    result = protfunc_parser(value)
+    if isinstance(result, (list, dict, set)):
+        return lambda: validator(copy.deepcopy(result))
+    return lambda: validator(result)
+
+
 def value_to_obj_or_any(value):
     "Convert value(s) to Object if possible, otherwise keep original value"
     stype = type(value)
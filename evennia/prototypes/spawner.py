@@ -133,15 +133,21 @@ from __future__ import print_function
 import copy
 import hashlib
 import time
+from collections import OrderedDict
 
 from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import AutoField
 
 import evennia
 from evennia.objects.models import ObjectDB
+from evennia.typeclasses.attributes import Attribute
+from evennia.utils.dbserialize import to_pickle
 from evennia.utils.utils import make_iter, is_iter
 from evennia.prototypes import prototypes as protlib
 from evennia.prototypes.prototypes import (
-    value_to_obj, value_to_obj_or_any, init_spawn_value, _PROTOTYPE_TAG_CATEGORY)
+    value_to_obj, value_to_obj_or_any, init_spawn_value, compile_spawn_value,
+    _PROTOTYPE_TAG_CATEGORY)
 
 
 _CREATE_OBJECT_KWARGS = ("key", "location", "home", "destination")
@@ -149,6 +155,11 @@ _PROTOTYPE_META_NAMES = ("prototype_key", "prototype_desc", "prototype_tags", "p
 _PROTOTYPE_ROOT_NAMES = ('typeclass', 'key', 'aliases', 'attrs', 'tags', 'locks', 'permissions',
                          'location', 'home', 'destination')
 _NON_CREATE_KWARGS = _CREATE_OBJECT_KWARGS + _PROTOTYPE_META_NAMES
+# compiled spawn plans, keyed by prototype content
+_SPAWN_PLAN_CACHE = OrderedDict()
+_SPAWN_PLAN_CACHE_SIZE = 500
+# max number of ids in a `WHERE id IN (...)` (SQLite allows 999 variables per query)
+_BULK_CHUNK_SIZE = 500
 
 
 # Helper
@@ -598,12 +609,8 @@ def batch_create_object(*objparams):
 
     """
 
-    # bulk create all objects in one go
-
-    # unfortunately this doesn't work since bulk_create doesn't creates pks;
-    # the result would be duplicate objects at the next stage, so we comment
-    # it out for now:
-    #  dbobjs = _ObjectDB.objects.bulk_create(dbobjs)
+    # this creates the objects one by one, with the full at_first_save
+    # path for each - see bulk_create_object for the bulk version.
 
     dbobjs = [ObjectDB(**objparam[0]) for objparam in objparams]
     objs = []
@@ -627,8 +634,355 @@ def batch_create_object(*objparams):
     return objs
 
 
+def _bulk_insert(model, instances):
+    """
+    Insert new database rows for all given model instances, making sure
+    their primary keys are set afterwards. No save hooks or signals are
+    triggered.
+
+    Args:
+        model (Model): The database model to insert into.
+        instances (list): Unsaved instances of `model`.
+
+    Notes:
+        Only some database backends (like PostgreSQL) can return the ids of
+        rows created with a bulk insert. For others, this falls back to one
+        INSERT per instance, still bypassing the save machinery.
+
+    """
+    if not instances:
+        return
+    if connection.features.can_return_ids_from_bulk_insert:
+        model.objects.bulk_create(instances)
+    else:
+        fields = [field for field in model._meta.concrete_fields
+                  if not isinstance(field, AutoField)]
+        manager = model._base_manager
+        for instance in instances:
+            instance.pk = manager._insert([instance], fields=fields, return_id=True)
+            instance._state.adding = False
+            instance._state.db = manager.db
+
+
+def _chunked(seq):
+    """Yield chunks of `seq` small enough to use in a `__in` query"""
+    for ichunk in range(0, len(seq), _BULK_CHUNK_SIZE):
+        yield seq[ichunk:ichunk + _BULK_CHUNK_SIZE]
+
+
+def bulk_create_object(*objparams):
+    """
+    Bulk version of `batch_create_object`, taking the same arguments. This
+    creates all objects, Attributes and Tag-relations using as few database
+    queries as possible, all within a single transaction.
+
+    Args:
+        objsparams (tuple): Each parameter tuple will create one object instance. See
+            `batch_create_object` for the parameters in each tuple.
+
+    Returns:
+        objects (list): A list of created objects.
+
+    Notes:
+        The typeclass creation hooks `basetype_setup`, `at_object_creation`
+        and `basetype_posthook_setup` are called for every object, but a
+        custom `at_first_save` will *not* be called - this replaces it. Values
+        set by the hooks are overridden by those of the `objparams`, just as
+        with a normal `create_object`.
+
+        On database backends that can't return ids from a bulk insert (like
+        SQLite), the object and Attribute rows are inserted one at a time,
+        which is still much faster than creating them normally.
+
+    """
+    if not objparams:
+        return []
+
+    dbobjs = [ObjectDB(**objparam[0]) for objparam in objparams]
+
+    with transaction.atomic():
+        _bulk_insert(ObjectDB, dbobjs)
+
+        # register with the idmapper and location caches like a normal save would
+        for obj in dbobjs:
+            obj.cache_instance(obj)
+            if obj.db_location:
+                obj.db_location.contents_cache.add(obj)
+
+        for obj, objparam in zip(dbobjs, objparams):
+            obj.basetype_setup()
+            obj.at_object_creation()
+
+        # re-apply the creation kwargs since the hooks may have changed them
+        for obj, objparam in zip(dbobjs, objparams):
+            updates = []
+            for fieldname in ("db_key", "db_location", "db_home", "db_destination"):
+                value = objparam[0].get(fieldname)
+                if fieldname == "db_key" and not (value or obj.db_key):
+                    value = "#%i" % obj.id
+                if value and getattr(obj, fieldname) != value:
+                    if fieldname == "db_location":
+                        # the location handler keeps the contents caches updated
+                        obj.location = value
+                        continue
+                    setattr(obj, fieldname, value)
+                    updates.append(fieldname)
+            if updates:
+                obj.save(update_fields=updates)
+            if objparam[2]:
+                obj.locks.add(objparam[2])
+
+        # collect all Tags (tags, aliases and permissions) to link to
+        tagobjs = {}
+        taglinks = []
+        for obj, objparam in zip(dbobjs, objparams):
+            tagtuples = ([(perm, None, None, "permission") for perm in make_iter(objparam[1])] +
+                         [(alias, None, None, "alias") for alias in make_iter(objparam[3])])
+            for tag in make_iter(objparam[6]):
+                # tags are given as key, (key, category) or (key, category, data)
+                tagtuples.append(tuple((list(make_iter(tag)) + [None, None])[:3]) + (None, ))
+            for key, category, data, tagtype in tagtuples:
+                if not key:
+                    continue
+                key = key.strip().lower()
+                category = category.strip().lower() if category else None
+                data = str(data) if data is not None else None
+                tagid = (key, category, data, tagtype)
+                if tagid not in tagobjs:
+                    tagobjs[tagid] = ObjectDB.objects.create_tag(
+                        key=key, category=category, data=data, tagtype=tagtype)
+                taglinks.append((obj.id, tagobjs[tagid].id))
+
+        # all Attributes to create, keyed on (objid, key, category)
+        attrs = {}
+        for obj, objparam in zip(dbobjs, objparams):
+            for tup in objparam[5]:
+                keystr = str(tup[0]).strip().lower()
+                category = str(tup[2]).strip().lower() if len(tup) > 2 and tup[2] is not None else None
+                attrs[(obj.id, keystr, category)] = (obj, tup)
+
+        # don't re-add what the creation hooks already created
+        ids = [obj.id for obj in dbobjs]
+        tagthrough = ObjectDB.db_tags.through
+        attrthrough = ObjectDB.db_attributes.through
+        existing_taglinks = set()
+        existing_attrs = set()
+        for chunk in _chunked(ids):
+            existing_taglinks.update(
+                tagthrough.objects.filter(objectdb__id__in=chunk).values_list("objectdb_id", "tag_id"))
+            existing_attrs.update(
+                (objid, key.lower(), category.lower() if category else None) for objid, key, category
+                in attrthrough.objects.filter(
+                    objectdb__id__in=chunk, attribute__db_attrtype=None).values_list(
+                    "objectdb_id", "attribute__db_key", "attribute__db_category"))
+
+        tagthrough.objects.bulk_create(
+            [tagthrough(objectdb_id=objid, tag_id=tagid)
+             for objid, tagid in set(taglinks) if (objid, tagid) not in existing_taglinks])
+
+        new_attrs = []
+        for attrid, (obj, tup) in attrs.items():
+            if attrid in existing_attrs:
+                # overload the value set by the hook
+                obj.attributes.batch_add(tup)
+            else:
+                new_attrs.append((attrid[0], Attribute(db_key=attrid[1], db_category=attrid[2],
+                                                       db_model="objectdb", db_attrtype=None,
+                                                       db_value=to_pickle(tup[1]),
+                                                       db_lock_storage=tup[3] if len(tup) > 3 else "")))
+        _bulk_insert(Attribute, [attr for _, attr in new_attrs])
+        attrthrough.objects.bulk_create(
+            [attrthrough(objectdb_id=objid, attribute_id=attr.id) for objid, attr in new_attrs])
+
+        for obj, objparam in zip(dbobjs, objparams):
+            # the handlers may have cached data from before the bulk inserts
+            obj.attributes.reset_cache()
+            obj.tags.reset_cache()
+            obj.aliases.reset_cache()
+            obj.permissions.reset_cache()
+            nattributes = objparam[4]
+            for key, value in (nattributes.items() if isinstance(nattributes, dict) else nattributes):
+                obj.nattributes.add(key, value)
+            if obj.db_location:
+                obj.db_location.at_object_receive(obj, None)
+                obj.at_after_move(None)
+            obj.basetype_posthook_setup()
+
+    for obj, objparam in zip(dbobjs, objparams):
+        # run eventual extra code
+        for code in objparam[7]:
+            if code:
+                exec(code, {}, {"evennia": evennia, "obj": obj})
+    return dbobjs
+
+
 # Spawner mechanism
 
+class SpawnPlan(object):
+    """
+    A prototype compiled for spawning. This does all the inheritance,
+    validation and parsing of the prototype once, so that spawning many
+    objects from the same prototype only needs to produce the values that
+    are different for every spawned object (like those using protfuncs).
+
+    """
+    def __init__(self, prototype, protparents):
+        """
+        Compile the plan.
+
+        Args:
+            prototype (dict): The (homogenized) prototype to spawn from.
+            protparents (dict): All available prototype parents, keyed by `prototype_key`.
+
+        Raises:
+            RuntimeError: If the prototype does not validate.
+
+        """
+        protlib.validate_prototype(prototype, None, protparents, is_prototype_base=True)
+        prot = _get_prototype(prototype, protparents,
+                              uninherited={"prototype_key": prototype.get("prototype_key")})
+        self.is_empty = not prot
+        self.prototype_key = prototype.get('prototype_key', None)
+
+        self.key = compile_spawn_value(prot.pop("key"), str) if "key" in prot else None
+        self.location = compile_spawn_value(prot.pop("location", None), value_to_obj)
+        self.home = compile_spawn_value(prot.pop("home", settings.DEFAULT_HOME), value_to_obj)
+        self.destination = compile_spawn_value(prot.pop("destination", None), value_to_obj)
+        self.typeclass = compile_spawn_value(
+            prot.pop("typeclass", settings.BASE_OBJECT_TYPECLASS), str)
+
+        self.permissions = compile_spawn_value(prot.pop("permissions", []), make_iter)
+        self.locks = compile_spawn_value(prot.pop("locks", ""), str)
+        self.aliases = compile_spawn_value(prot.pop("aliases", []), make_iter)
+        self.tags = [(compile_spawn_value(tag, str), category, data)
+                     for (tag, category, data) in prot.pop("tags", [])]
+        self.execs = compile_spawn_value(prot.pop("exec", ""), make_iter)
+
+        self.nattributes = [(key.split("_", 1)[1], compile_spawn_value(val, value_to_obj))
+                            for key, val in prot.items() if key.startswith("ndb_")]
+
+        # the rest are attribute tuples (attrname, value, category, locks)
+        attributes = [(attrname, compile_spawn_value(value), category, locks)
+                      for (attrname, value, category, locks) in make_iter(prot.pop("attrs", []))]
+        # we don't support categories, nor locks for simple attributes
+        attributes.extend((key, compile_spawn_value(value, value_to_obj_or_any), None, None)
+                          for key, value in prot.items()
+                          if not key.startswith("ndb_") and key not in _PROTOTYPE_META_NAMES)
+        self.attributes = [tup for tup in attributes if not tup[0] in _NON_CREATE_KWARGS]
+
+    def get_objparams(self):
+        """
+        Produce the parameters for creating one object from this plan.
+
+        Returns:
+            objparams (tuple): Parameters on the form used by `batch_create_object`.
+
+        """
+        create_kwargs = {}
+        # we must always add a key, so if not given we use a shortened md5 hash. There is a (small)
+        # chance this is not unique but it should usually not be a problem.
+        create_kwargs["db_key"] = self.key() if self.key else "Spawned-{}".format(
+            hashlib.md5(str(time.time())).hexdigest()[:6])
+        create_kwargs["db_location"] = self.location()
+        create_kwargs["db_home"] = self.home()
+        create_kwargs["db_destination"] = self.destination()
+        create_kwargs["db_typeclass_path"] = self.typeclass()
+
+        tags = [(tag(), category, data) for tag, category, data in self.tags]
+        if self.prototype_key:
+            # we make sure to add a tag identifying which prototype created this object
+            tags.append((self.prototype_key, _PROTOTYPE_TAG_CATEGORY))
+
+        return (create_kwargs, self.permissions(), self.locks(), self.aliases(),
+                dict((key, val()) for key, val in self.nattributes),
+                [(attrname, value(), category, locks)
+                 for attrname, value, category, locks in self.attributes],
+                tags, self.execs())
+
+
+def _plan_cache_key(prototype, protparents, homogenize):
+    """
+    Build a hashable key representing the full content of a prototype and
+    the parents it inherits from, for caching spawn plans.
+
+    Returns:
+        key (tuple or None): The key, or `None` if the prototype or its
+            parents hold unhashable values, so their plan can't be cached.
+
+    """
+    def _hashable(value):
+        if isinstance(value, dict):
+            return ("dict", tuple(sorted((_hashable(key), _hashable(val))
+                                         for key, val in value.items())))
+        elif isinstance(value, (list, tuple, set, frozenset)):
+            items = tuple(_hashable(val) for val in value)
+            return (type(value).__name__, tuple(sorted(items)) if isinstance(
+                value, (set, frozenset)) else items)
+        elif isinstance(value, (bool, int, long, float)):
+            # 1, 1.0 and True are equal but give different prototype values
+            return (type(value).__name__, value)
+        # raises TypeError if unhashable
+        hash(value)
+        return value
+
+    parents = []
+    visited = set()
+    queue = list(make_iter(prototype.get("prototype_parent", [])))
+    try:
+        while queue:
+            parent_key = str(queue.pop(0)).lower()
+            if parent_key in visited:
+                continue
+            visited.add(parent_key)
+            parent = protparents.get(parent_key, {})
+            parents.append((parent_key, _hashable(parent)))
+            queue.extend(make_iter(parent.get("prototype_parent", [])))
+        return (_hashable(prototype), tuple(parents), homogenize)
+    except TypeError:
+        return None
+
+
+def get_spawn_plan(prototype, protparents, homogenize=True):
+    """
+    Get the compiled `SpawnPlan` for a prototype. Plans are cached based on the
+    content of the prototype and its parents, so the same prototype will only
+    be compiled once.
+
+    Args:
+        prototype (dict): The prototype to spawn.
+        protparents (dict): All available prototype parents, keyed by `prototype_key`.
+        homogenize (bool, optional): Homogenize the prototype before compiling it.
+
+    Returns:
+        plan (SpawnPlan): The compiled plan.
+
+    Raises:
+        RuntimeError: If the prototype does not validate.
+
+    Notes:
+        A prototype without a `prototype_key` will be assigned a random one when
+        it's homogenized. The same key will then be re-used for every spawn using the
+        cached plan.
+
+        Prototypes holding unhashable values (other than dicts, lists and sets)
+        are compiled anew every time.
+
+    """
+    cache_key = _plan_cache_key(prototype, protparents, homogenize)
+    plan = _SPAWN_PLAN_CACHE.pop(cache_key, None) if cache_key is not None else None
+    if plan is None:
+        if homogenize:
+            prototype = protlib.homogenize_prototype(prototype)
+        plan = SpawnPlan(prototype, protparents)
+        if cache_key is None:
+            return plan
+        if len(_SPAWN_PLAN_CACHE) >= _SPAWN_PLAN_CACHE_SIZE:
+            _SPAWN_PLAN_CACHE.popitem(last=False)
+    # (re-)insert last, so the least recently used plan is dropped first
+    _SPAWN_PLAN_CACHE[cache_key] = plan
+    return plan
+
+
 def spawn(*prototypes, **kwargs):
     """
     Spawn a number of prototyped objects.
@@ -649,6 +1003,8 @@ def spawn(*prototypes, **kwargs):
             prototype-parents (no object creation happens)
         only_validate (bool): Only run validation of prototype/parents
             (no object creation) and return the create-kwargs.
+        bulk (bool): Create all objects using `bulk_create_object`. This
+            is much faster when spawning many objects at once.
 
     Returns:
         object (Object, dict or list): Spawned object(s). If `only_validate` is given, return
@@ -659,10 +1015,6 @@ def spawn(*prototypes, **kwargs):
     # get available protparents
     protparents = {prot['prototype_key'].lower(): prot for prot in protlib.search_prototype()}
 
-    if not kwargs.get("only_validate"):
-        # homogenization to be more lenient about prototype format when entering the prototype manually
-        prototypes = [protlib.homogenize_prototype(prot) for prot in prototypes]
-
     # overload module's protparents with specifically given protparents
     # we allow prototype_key to be the key of the protparent dict, to allow for module-level
     # prototype imports. We need to insert prototype_key in this case
@@ -677,82 +1029,14 @@ def spawn(*prototypes, **kwargs):
 
     objsparams = []
     for prototype in prototypes:
-
-        protlib.validate_prototype(prototype, None, protparents, is_prototype_base=True)
-        prot = _get_prototype(prototype, protparents,
-                              uninherited={"prototype_key": prototype.get("prototype_key")})
-        if not prot:
+        plan = get_spawn_plan(prototype, protparents,
+                              homogenize=not kwargs.get("only_validate"))
+        if plan.is_empty:
             continue
-
-        # extract the keyword args we need to create the object itself. If we get a callable,
-        # call that to get the value (don't catch errors)
-        create_kwargs = {}
-        # we must always add a key, so if not given we use a shortened md5 hash. There is a (small)
-        # chance this is not unique but it should usually not be a problem.
-        val = prot.pop("key", "Spawned-{}".format(
-            hashlib.md5(str(time.time())).hexdigest()[:6]))
-        create_kwargs["db_key"] = init_spawn_value(val, str)
-
-        val = prot.pop("location", None)
-        create_kwargs["db_location"] = init_spawn_value(val, value_to_obj)
-
-        val = prot.pop("home", settings.DEFAULT_HOME)
-        create_kwargs["db_home"] = init_spawn_value(val, value_to_obj)
-
-        val = prot.pop("destination", None)
-        create_kwargs["db_destination"] = init_spawn_value(val, value_to_obj)
-
-        val = prot.pop("typeclass", settings.BASE_OBJECT_TYPECLASS)
-        create_kwargs["db_typeclass_path"] = init_spawn_value(val, str)
-
-        # extract calls to handlers
-        val = prot.pop("permissions", [])
-        permission_string = init_spawn_value(val, make_iter)
-        val = prot.pop("locks", "")
-        lock_string = init_spawn_value(val, str)
-        val = prot.pop("aliases", [])
-        alias_string = init_spawn_value(val, make_iter)
-
-        val = prot.pop("tags", [])
-        tags = []
-        for (tag, category, data) in val:
-            tags.append((init_spawn_value(tag, str), category, data))
-
-        prototype_key = prototype.get('prototype_key', None)
-        if prototype_key:
-            # we make sure to add a tag identifying which prototype created this object
-            tags.append((prototype_key, _PROTOTYPE_TAG_CATEGORY))
-
-        val = prot.pop("exec", "")
-        execs = init_spawn_value(val, make_iter)
-
-        # extract ndb assignments
-        nattributes = dict((key.split("_", 1)[1], init_spawn_value(val, value_to_obj))
-                           for key, val in prot.items() if key.startswith("ndb_"))
-
-        # the rest are attribute tuples (attrname, value, category, locks)
-        val = make_iter(prot.pop("attrs", []))
-        attributes = []
-        for (attrname, value, category, locks) in val:
-            attributes.append((attrname, init_spawn_value(value), category, locks))
-
-        simple_attributes = []
-        for key, value in ((key, value) for key, value in prot.items()
-                           if not (key.startswith("ndb_"))):
-            # we don't support categories, nor locks for simple attributes
-            if key in _PROTOTYPE_META_NAMES:
-                continue
-            else:
-                simple_attributes.append(
-                    (key, init_spawn_value(value, value_to_obj_or_any), None, None))
-
-        attributes = attributes + simple_attributes
-        attributes = [tup for tup in attributes if not tup[0] in _NON_CREATE_KWARGS]
-
-        # pack for call into _batch_create_object
-        objsparams.append((create_kwargs, permission_string, lock_string,
-                           alias_string, nattributes, attributes, tags, execs))
+        objsparams.append(plan.get_objparams())
 
     if kwargs.get("only_validate"):
         return objsparams
+    if kwargs.get("bulk"):
+        return bulk_create_object(*objsparams)
     return batch_create_object(*objsparams)
@@ -61,6 +61,77 @@ class TestSpawner(EvenniaTest):
                           _PROTPARENTS["GOBLIN"], _PROTPARENTS["GOBLIN_ARCHWIZARD"],
                           prototype_parents=_PROTPARENTS)], ['goblin grunt', 'goblin archwizard'])
 
+    def test_spawn_bulk(self):
+        prot = {"prototype_key": "testbulk",
+                "typeclass": "evennia.objects.objects.DefaultObject",
+                "key": "bulkobj",
+                "location": self.room1,
+                "aliases": ["bulkalias"],
+                "permissions": ["Builder"],
+                "tags": [("bulktag", "bulkcat", None)],
+                "attrs": [("bulkattr", 5, "bulkcat", "attrread:false()")],
+                "health": 10}
+        objs = spawner.spawn(*[prot] * 5, bulk=True)
+        self.assertEqual(len(objs), 5)
+        self.assertEqual(len(set(obj.id for obj in objs)), 5)
+        self.assertEqual(set(protlib.search_objects_with_prototype("testbulk")), set(objs))
+        for obj in objs:
+            self.assertEqual(obj.key, "bulkobj")
+            self.assertTrue(obj in self.room1.contents)
+            self.assertEqual(obj.aliases.all(), ["bulkalias"])
+            self.assertEqual(obj.permissions.all(), ["builder"])
+            self.assertEqual(obj.tags.get(category="bulkcat"), "bulktag")
+            self.assertEqual(obj.attributes.get("bulkattr", category="bulkcat"), 5)
+            self.assertEqual(obj.db.health, 10)
+            # set by basetype_setup
+            self.assertTrue(obj.locks.get("puppet"))
+
+    @override_settings(PROT_FUNC_MODULES=['evennia.prototypes.protfuncs'])
+    def test_spawn_plan(self):
+        prot = {"prototype_key": "testplan",
+                "typeclass": "evennia.objects.objects.DefaultObject",
+                "key": "planobj",
+                "location": self.room1,
+                "tags": ["plantag"],
+                "counter": "$add(1, 2)"}
+        plan = spawner.get_spawn_plan(prot, {})
+        # the same prototype content re-uses the compiled plan
+        self.assertTrue(spawner.get_spawn_plan(dict(prot), {}) is plan)
+        self.assertFalse(spawner.get_spawn_plan(dict(prot, key="other"), {}) is plan)
+        # prototypes with unhashable values are not cached
+        unhashable = dict(prot, unhashable=bytearray("value"))
+        self.assertFalse(spawner.get_spawn_plan(unhashable, {}) is
+                         spawner.get_spawn_plan(unhashable, {}))
+        # the least recently used plan is dropped first
+        with mock.patch("evennia.prototypes.spawner._SPAWN_PLAN_CACHE_SIZE", 2):
+            spawner._SPAWN_PLAN_CACHE.clear()
+            plan = spawner.get_spawn_plan(prot, {})
+            other = spawner.get_spawn_plan(dict(prot, key="other"), {})
+            self.assertTrue(spawner.get_spawn_plan(prot, {}) is plan)
+            spawner.get_spawn_plan(dict(prot, key="third"), {})
+            self.assertTrue(spawner.get_spawn_plan(prot, {}) is plan)
+            self.assertFalse(spawner.get_spawn_plan(dict(prot, key="other"), {}) is other)
+        params1, params2 = plan.get_objparams(), plan.get_objparams()
+        self.assertEqual(params1, params2)
+        self.assertFalse(params1[5] is params2[5])
+        self.assertEqual(params1[0]["db_location"], self.room1)
+        self.assertEqual(params1[5], [("counter", 3, None, "")])
+        objs = spawner.spawn(prot, prot)
+        self.assertEqual([obj.key for obj in objs], ["planobj", "planobj"])
+        self.assertEqual([obj.db.counter for obj in objs], [3, 3])
+        self.assertEqual([obj.location for obj in objs], [self.room1, self.room1])
+
+    def test_spawn_plan_dynamic(self):
+        prot = {"prototype_key": "testdynamic",
+                "typeclass": "evennia.objects.objects.DefaultObject",
+                "key": "$random()"}
+        with mock.patch("evennia.prototypes.protfuncs.base_random",
+                        new=mock.MagicMock(side_effect=[0.1, 0.2])):
+            with override_settings(PROT_FUNC_MODULES=['evennia.prototypes.protfuncs']):
+                objs = spawner.spawn(prot, prot)
+        # protfuncs are still evaluated for every spawned object
+        self.assertEqual([obj.key for obj in objs], ["0.1", "0.2"])
+
 
 class TestUtils(EvenniaTest):
 
@@ -348,6 +419,11 @@ class TestPrototypeStorage(EvenniaTest):
         self.prot3['prototype_desc'] = 'testdesc3'
         self.prot3['prototype_tags'] = [('foo1', _PROTOTYPE_TAG_META_CATEGORY)]
 
+    def tearDown(self):
+        # the database is rolled back, but the registry cache is not
+        protlib.PROTOTYPE_REGISTRY.reset()
+        super(TestPrototypeStorage, self).tearDown()
+
     def test_prototype_storage(self):
 
         # from evennia import set_trace;set_trace(term_size=(180, 50))
@@ -393,6 +469,26 @@ class TestPrototypeStorage(EvenniaTest):
 
         self.assertTrue(str(unicode(protlib.list_prototypes(self.char1))))
 
+    def test_prototype_registry(self):
+        prot1 = protlib.create_prototype(**self.prot1)
+        prot2 = protlib.create_prototype(**self.prot2)
+        self.prot3['prototype_parent'] = 'testprototype1'
+        prot3 = protlib.create_prototype(**self.prot3)
+
+        protlib.PROTOTYPE_REGISTRY.search()
+        with self.assertNumQueries(0):
+            self.assertEqual(protlib.PROTOTYPE_REGISTRY.search("testprototype2"), [prot2])
+            self.assertEqual(protlib.PROTOTYPE_REGISTRY.search("PROTOTYPE"), [prot1, prot2, prot3])
+            self.assertEqual(protlib.PROTOTYPE_REGISTRY.search(tags="foo1"), [prot1, prot2, prot3])
+            self.assertEqual(protlib.PROTOTYPE_REGISTRY.search(tags=["foo1", "foo2"]), [])
+            self.assertEqual(protlib.PROTOTYPE_REGISTRY.get_children("testprototype1"), [prot3])
+            # we get copies back
+            protlib.PROTOTYPE_REGISTRY.get("testprototype1")["key"] = "foo"
+            self.assertEqual(protlib.PROTOTYPE_REGISTRY.get("testprototype1"), prot1)
+
+        protlib.delete_prototype("testprototype2")
+        self.assertEqual(protlib.PROTOTYPE_REGISTRY.search(tags="foo1"), [prot1, prot3])
+
 
 class _MockMenu(object):
     pass
@@ -412,6 +508,10 @@ class TestMenuModule(EvenniaTest):
                           "typeclass": "evennia.objects.objects.DefaultObject",
                           "prototype_locks": "edit:all();spawn:all()"}
 
+    def tearDown(self):
+        protlib.PROTOTYPE_REGISTRY.reset()
+        super(TestMenuModule, self).tearDown()
+
     def test_helpers(self):
 
         caller = self.caller
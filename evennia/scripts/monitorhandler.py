@@ -59,7 +59,8 @@ class MonitorHandler(object):
     def restore(self, server_reload=True):
         """
         Restore our monitors after a reload. This is called
-        by the server process.
+        by the server process. Monitors added since the server
+        started are kept.
 
         Args:
             server_reload (bool, optional): If this is False, it means
@@ -67,7 +68,6 @@ class MonitorHandler(object):
                 non-persistent tickers must be killed.
 
         """
-        self.monitors = defaultdict(lambda: defaultdict(dict))
         restored_monitors = ServerConfig.objects.conf(key=self.savekey)
         if restored_monitors:
             restored_monitors = dbunserialize(restored_monitors)
@@ -84,7 +84,9 @@ class MonitorHandler(object):
                     callback = variable_from_module(modname, varname)
 
                     if obj and hasattr(obj, fieldname):
-                        self.monitors[obj][fieldname][idstring] = (callback, persistent, kwargs)
+                        # a monitor added since the server started takes precedence
+                        self.monitors[obj][fieldname].setdefault(
+                            idstring, (callback, persistent, kwargs))
                 except Exception:
                     continue
         # make sure to clean data from database
@@ -105,7 +107,21 @@ class MonitorHandler(object):
                     logger.log_trace("Monitor callback was removed.")
         # we cleanup non-found monitors (has to be done after loop)
         for (obj, fieldname, idstring) in to_delete:
-            del self.monitors[obj][fieldname][idstring]
+            self._remove(obj, fieldname, idstring)
+
+    def _remove(self, obj, fieldname, idstring):
+        """
+        Remove a monitor, and the object from the monitors once it has
+        no monitors left, so saving it skips the monitor checks.
+
+        """
+        fieldmonitors = self.monitors.get(obj)
+        if fieldmonitors and idstring in fieldmonitors.get(fieldname, ()):
+            del fieldmonitors[fieldname][idstring]
+            if not fieldmonitors[fieldname]:
+                del fieldmonitors[fieldname]
+            if not fieldmonitors:
+                del self.monitors[obj]
 
     def add(self, obj, fieldname, callback, idstring="", persistent=False, **kwargs):
         """
@@ -162,9 +178,7 @@ class MonitorHandler(object):
                 return
             fieldname = "db_value"
 
-        idstring_dict = self.monitors[obj][fieldname]
-        if idstring in idstring_dict:
-            del self.monitors[obj][fieldname][idstring]
+        self._remove(obj, fieldname, idstring)
 
     def clear(self):
         """
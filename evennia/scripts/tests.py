@@ -1,8 +1,14 @@
 # this is an optimized version only available in later Django versions
 from unittest import TestCase
+from mock import patch
+from twisted.internet.defer import Deferred
+from twisted.internet.task import Clock
 from evennia.scripts.models import ScriptDB, ObjectDoesNotExist
 from evennia.utils.create import create_script
-from evennia.scripts.scripts import DoNothing
+from evennia.scripts.scripts import DoNothing, DefaultScript, SCRIPT_FLUSH_TIMERS
+from evennia.scripts.timerwheel import TimerWheel, WheelTask
+from evennia.scripts.monitorhandler import MONITOR_HANDLER
+from evennia.utils.test_resources import EvenniaTest
 
 
 class TestScriptDB(TestCase):
@@ -41,3 +47,183 @@ class TestScriptDB(TestCase):
         "Can deleted scripts be said to be valid?"
         self.scr.delete()
         self.assertFalse(self.scr.is_valid())  # assertRaises? See issue #509
+
+
+_MONITOR_CALLS = []
+
+
+def _monitor_callback(**kwargs):
+    _MONITOR_CALLS.append((kwargs["obj"], kwargs["fieldname"]))
+
+
+class TestMonitorHandler(EvenniaTest):
+    "Check that saving objects triggers their monitors"
+
+    def setUp(self):
+        super(TestMonitorHandler, self).setUp()
+        del _MONITOR_CALLS[:]
+        self.addCleanup(MONITOR_HANDLER.clear)
+
+    def test_field(self):
+        MONITOR_HANDLER.add(self.obj1, "db_key", _monitor_callback, idstring="test")
+        self.obj1.key = "New name"
+        self.obj2.key = "Other name"
+        self.assertEqual(_MONITOR_CALLS, [(self.obj1, "db_key")])
+        MONITOR_HANDLER.remove(self.obj1, "db_key", idstring="test")
+        # an object without monitors is not kept around in the handler
+        self.assertFalse(self.obj1 in MONITOR_HANDLER.monitors)
+        self.obj1.key = "Newer name"
+        self.assertEqual(len(_MONITOR_CALLS), 1)
+
+    def test_attribute(self):
+        self.obj1.db.hp = 10
+        MONITOR_HANDLER.add(self.obj1, "hp", _monitor_callback)
+        self.obj1.db.hp = 8
+        self.obj1.db.mp = 5
+        attr = self.obj1.attributes.get("hp", return_obj=True)
+        self.assertEqual(_MONITOR_CALLS, [(attr, "db_value")])
+        self.assertEqual(MONITOR_HANDLER.all(), [(attr, "db_value", "", False, {})])
+
+
+class TestTimerWheel(TestCase):
+    "Check that the timer wheel fires tasks in batches"
+
+    def setUp(self):
+        self.clock = Clock()
+        self.wheel = TimerWheel(resolution=0.5, clock=self.clock)
+        patcher = patch("evennia.scripts.timerwheel.TIMER_WHEEL", self.wheel)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.calls = []
+
+    def _task(self, name):
+        return WheelTask(self.calls.append, name)
+
+    def test_batch(self):
+        tasks = [self._task(num) for num in range(3)]
+        tasks[0].start(2, now=False)
+        tasks[1].start(2, now=False)
+        tasks[2].start(3, now=False)
+        # one reactor timer for all tasks
+        self.assertEqual(len(self.clock.calls), 1)
+        self.clock.advance(1.9)
+        self.assertEqual(self.calls, [])
+        self.clock.advance(0.1)
+        self.assertEqual(self.calls, [0, 1])
+        self.clock.advance(1)
+        self.assertEqual(self.calls, [0, 1, 2])
+        self.assertEqual(tasks[0].next_call_time(), 1)
+        self.assertEqual(len(self.clock.calls), 1)
+        self.assertEqual(len(self.wheel), 3)
+
+    def test_resolution(self):
+        task = self._task("a")
+        task.start(1.2, now=False)
+        # fired at the end of the bucket the task is due in
+        self.clock.advance(1.49)
+        self.assertEqual(self.calls, [])
+        self.clock.advance(0.01)
+        self.assertEqual(self.calls, ["a"])
+        self.assertAlmostEqual(task.next_call_time(), 0.9)
+        self.clock.advance(1)
+        self.assertEqual(task.callcount, 2)
+
+    def test_stop_and_force(self):
+        task = self._task("a")
+        stopped = []
+        task.start(10).addCallback(stopped.append)
+        self.assertEqual((self.calls, task.callcount), (["a"], 1))
+        self.clock.advance(4)
+        task.force_repeat()
+        self.assertEqual(task.callcount, 2)
+        self.assertEqual(task.next_call_time(), 10)
+        self.clock.advance(10)
+        self.assertEqual(task.callcount, 3)
+        task.stop()
+        self.assertEqual(stopped, [task])
+        self.assertIsNone(task.next_call_time())
+        self.clock.advance(20)
+        self.assertEqual(task.callcount, 3)
+        self.assertEqual(len(self.wheel), 0)
+        self.assertEqual(self.clock.calls, [])
+
+    def test_start_delay(self):
+        task = self._task("a")
+        task.start(10, now=False, start_delay=3, count_start=2)
+        self.clock.advance(3)
+        self.assertEqual(task.callcount, 3)
+        self.assertEqual(task.next_call_time(), 10)
+
+    def test_stop_in_batch(self):
+        second = self._task("second")
+        first = WheelTask(lambda: second.stop())
+        first.start(1, now=False)
+        second.start(1, now=False)
+        self.clock.advance(1)
+        self.assertEqual(self.calls, [])
+        self.assertEqual(first.callcount, 1)
+
+    def test_deferred(self):
+        deferreds = []
+        task = WheelTask(lambda: deferreds.append(Deferred()) or deferreds[-1])
+        errors = []
+        task.start(5, now=False).addErrback(errors.append)
+        self.clock.advance(5)
+        self.assertEqual(task.callcount, 1)
+        # the next call waits for the Deferred
+        self.clock.advance(10)
+        self.assertEqual(task.callcount, 1)
+        self.assertEqual(len(self.wheel), 0)
+        deferreds[0].callback(None)
+        self.assertEqual(task.next_call_time(), 5)
+        self.clock.advance(5)
+        self.assertEqual(task.callcount, 2)
+        # a failed Deferred stops the task
+        deferreds[1].errback(RuntimeError("fail"))
+        self.assertFalse(task.running)
+        self.assertEqual(len(errors), 1)
+        self.assertEqual(len(self.wheel), 0)
+
+
+@patch("evennia.scripts.scripts._SCRIPT_TIMER_RESOLUTION", 1)
+class TestScriptTimerWheel(TestCase):
+    "Check that Scripts keep their timer features on the timer wheel"
+
+    def setUp(self):
+        self.clock = Clock()
+        self.wheel = TimerWheel(resolution=1, clock=self.clock)
+        patcher = patch("evennia.scripts.timerwheel.TIMER_WHEEL", self.wheel)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_script(self):
+        script = create_script(DefaultScript, key="timed", interval=10, repeats=3,
+                               start_delay=True)
+        self.assertIsInstance(script.ndb._task, WheelTask)
+        self.assertEqual((script.time_until_next_repeat(), script.remaining_repeats()), (10, 3))
+        self.clock.advance(10)
+        self.assertEqual((script.time_until_next_repeat(), script.remaining_repeats()), (10, 2))
+        self.clock.advance(4)
+        script.pause()
+        self.assertEqual(script.db._paused_time, 6)
+        self.clock.advance(100)
+        self.assertEqual(script.remaining_repeats(), 2)
+        script.unpause()
+        self.assertEqual((script.time_until_next_repeat(), script.remaining_repeats()), (6, 2))
+        script.force_repeat()
+        self.assertEqual((script.time_until_next_repeat(), script.remaining_repeats()), (10, 1))
+        self.clock.advance(10)
+        # out of repeats
+        self.assertFalse(ScriptDB.objects.filter(db_key="timed").exists())
+        self.assertEqual(len(self.wheel), 0)
+
+    @patch("evennia.scripts.scripts.FLUSHING_INSTANCES", False)
+    def test_flush_paused(self):
+        script = create_script(DefaultScript, key="paused", interval=10)
+        script.pause()
+        with patch("twisted.internet.reactor.callLater") as mock_call_later:
+            self.assertTrue(script.at_idmapper_flush())
+        # there is no timer to restart after the flush
+        self.assertNotIn(script.id, SCRIPT_FLUSH_TIMERS)
+        self.assertFalse(mock_call_later.called)
+        script.delete()
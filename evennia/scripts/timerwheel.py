@@ -0,0 +1,307 @@
+"""
+Shared timer for Scripts.
+
+Normally every running Script has an `ExtendedLoopingCall` of its own,
+which means one reactor timer per Script. With many thousands of
+timed Scripts, the reactor's heap of timers is rescheduled constantly.
+
+If `settings.SCRIPT_TIMER_RESOLUTION` is set, Scripts instead use a
+`WheelTask`, which works like an `ExtendedLoopingCall` but is run by
+the `TIMER_WHEEL` singleton of this module. The wheel groups its
+timers into buckets `resolution` seconds wide and keeps a heap of the
+buckets only. A single reactor timer waits for the earliest bucket,
+and all tasks in it are fired in one batch. A task fires at most
+`resolution` seconds late, never early.
+
+"""
+from builtins import object
+
+from heapq import heappush, heappop
+from math import ceil
+from django.conf import settings
+from twisted.internet import reactor
+from twisted.internet.defer import Deferred
+from twisted.python.failure import Failure
+from evennia.utils import logger
+
+_DEFAULT_RESOLUTION = 0.1
+
+
+class TimerWheel(object):
+    """
+    Fires the `WheelTask`s due within the same `resolution` seconds
+    together, using one reactor timer.
+
+    """
+
+    def __init__(self, resolution=_DEFAULT_RESOLUTION, clock=None):
+        """
+        Initialize the wheel.
+
+        Args:
+            resolution (float, optional): The width of a bucket, in seconds.
+            clock (IReactorTime, optional): What to get the time and
+                schedule calls from. Defaults to the reactor.
+
+        """
+        self.resolution = resolution
+        self.clock = clock or reactor
+        # {tick: [entry, ...]}, where the entry of a removed task is [None]
+        self.buckets = {}
+        self.ticks = []
+        self._call = None
+        self._calltick = None
+        self._firing = False
+
+    def add(self, task, due):
+        """
+        Schedule a task, replacing its earlier schedule if any.
+
+        Args:
+            task (WheelTask): The task to fire.
+            due (float): The time (as given by the clock) to fire at.
+
+        """
+        self.remove(task)
+        tick = int(ceil(due / self.resolution))
+        entry = task._entry = [task]
+        bucket = self.buckets.get(tick)
+        if bucket is None:
+            self.buckets[tick] = [entry]
+            heappush(self.ticks, tick)
+            if not self._firing and (self._calltick is None or tick < self._calltick):
+                self._reschedule()
+        else:
+            bucket.append(entry)
+
+    def remove(self, task):
+        """
+        Unschedule a task.
+
+        Args:
+            task (WheelTask): The task to remove.
+
+        """
+        entry = task._entry
+        if entry:
+            entry[0] = None
+            task._entry = None
+
+    def _reschedule(self):
+        """
+        Make the reactor call us at the earliest bucket.
+
+        """
+        if self._call and self._call.active():
+            self._call.cancel()
+        self._call = self._calltick = None
+        if self.ticks:
+            self._calltick = self.ticks[0]
+            delay = max(0, self._calltick * self.resolution - self.clock.seconds())
+            self._call = self.clock.callLater(delay, self._fire)
+
+    def _fire(self):
+        """
+        Fire all tasks that are due.
+
+        """
+        self._call = self._calltick = None
+        # the tolerance makes up for rounding in the delay given to the reactor
+        current = self.clock.seconds() / self.resolution + 1e-6
+        ticks, buckets = self.ticks, self.buckets
+        due = []
+        while ticks and ticks[0] <= current:
+            due.append(buckets.pop(heappop(ticks)))
+        self._firing = True
+        try:
+            for bucket in due:
+                for entry in bucket:
+                    # tasks may be stopped or moved by the tasks fired before them
+                    task = entry[0]
+                    if task:
+                        try:
+                            task()
+                        except Exception:
+                            logger.log_trace()
+        finally:
+            self._firing = False
+            self._reschedule()
+
+    def __len__(self):
+        """
+        The number of scheduled tasks.
+
+        """
+        return sum(1 for bucket in self.buckets.itervalues() for entry in bucket if entry[0])
+
+
+class WheelTask(object):
+    """
+    Calls a function every `interval` seconds, using the `TimerWheel`.
+    This has the same interface and counting as `ExtendedLoopingCall`.
+    Like it, if the function returns a Deferred, the next call is only
+    scheduled once the Deferred has fired.
+
+    """
+
+    def __init__(self, f, *args, **kwargs):
+        """
+        Args:
+            f (callable): The function to call.
+            args, kwargs (any): Arguments to call it with.
+
+        """
+        self.f = f
+        self.args = args
+        self.kwargs = kwargs
+        self.wheel = TIMER_WHEEL
+        self.clock = self.wheel.clock
+        self.running = False
+        self.interval = None
+        self.starttime = None
+        self.start_delay = None
+        self.callcount = 0
+        self.due = None
+        self._entry = None
+        self._deferred = None
+
+    def start(self, interval, now=True, start_delay=None, count_start=0):
+        """
+        Start running function every interval seconds.
+
+        Args:
+            interval (int): Repeat interval in seconds.
+            now (bool, optional): Whether to start immediately or after
+                `start_delay` seconds.
+            start_delay (int): The number of seconds before starting.
+                If None, wait interval seconds. Only valid if `now` is `False`.
+            count_start (int): Number of repeats to start at.
+
+        Returns:
+            deferred (Deferred): Fires with the task when it's stopped.
+
+        Raises:
+            AssertError: if trying to start a task which is already running.
+            ValueError: If interval is set to an invalid value < 0.
+
+        """
+        assert not self.running, ("Tried to start an already running WheelTask.")
+        if interval < 0:
+            raise ValueError("interval must be >= 0")
+        self.running = True
+        deferred = self._deferred = Deferred()
+        self.starttime = self.clock.seconds()
+        self.interval = interval
+        self.callcount = max(0, count_start)
+        self.start_delay = start_delay if start_delay is None else max(0, start_delay)
+
+        if now:
+            self()
+        elif self.start_delay is not None:
+            self._schedule(self.starttime + self.start_delay)
+        else:
+            self._schedule(self.starttime + interval)
+        return deferred
+
+    def _schedule(self, due):
+        """
+        Schedule the next call.
+
+        """
+        self.due = due
+        self.wheel.add(self, due)
+
+    def __call__(self):
+        """
+        Tick one step and schedule the next one.
+
+        """
+        self.callcount += 1
+        if self.start_delay:
+            self.start_delay = None
+            self.starttime = self.clock.seconds()
+        try:
+            result = self.f(*self.args, **self.kwargs)
+        except Exception:
+            self._failed(Failure())
+            return
+        if isinstance(result, Deferred):
+            # wait for it before scheduling the next call
+            result.addCallbacks(self._succeeded, self._failed)
+        else:
+            self._succeeded(result)
+
+    def _succeeded(self, result):
+        """
+        Schedule the next call after the function has returned.
+
+        """
+        if not self.running:
+            return
+        now = self.clock.seconds()
+        if self.interval:
+            # the next whole interval since the start, skipping missed ones
+            # (the wheel's tolerance may fire us a hair before the due time)
+            nintervals = int((now - self.starttime) / self.interval + 1e-6) + 1
+            self._schedule(self.starttime + nintervals * self.interval)
+        else:
+            self._schedule(now)
+
+    def _failed(self, failure):
+        """
+        Stop the task when the function raised an error.
+
+        Args:
+            failure (Failure): The error.
+
+        """
+        if self.running:
+            self.wheel.remove(self)
+            self.running = False
+            deferred, self._deferred = self._deferred, None
+            deferred.errback(failure)
+
+    def stop(self):
+        """
+        Stop running the function.
+
+        Raises:
+            AssertionError: When trying to stop a task that is not running.
+
+        """
+        assert self.running, ("Tried to stop a WheelTask that was not running.")
+        self.running = False
+        self.wheel.remove(self)
+        deferred, self._deferred = self._deferred, None
+        deferred.callback(self)
+
+    def force_repeat(self):
+        """
+        Force-fire the callback, restarting the interval from now.
+
+        Raises:
+            AssertionError: When trying to force a task that is not
+                running.
+
+        """
+        assert self.running, ("Tried to fire a WheelTask that was not running.")
+        self.wheel.remove(self)
+        self.starttime = self.clock.seconds()
+        self()
+
+    def next_call_time(self):
+        """
+        Get the time until the next call.
+
+        Returns:
+            next (float or None): The time in seconds until the next call.
+                Returns `None` if the task is not running.
+
+        """
+        if self.running:
+            return max(0, self.due - self.clock.seconds())
+        return None
+
+
+# access object
+TIMER_WHEEL = TimerWheel(settings.SCRIPT_TIMER_RESOLUTION or _DEFAULT_RESOLUTION)
@@ -5,10 +5,14 @@ Portal. This module sets up the Client-side communication.
 """
 
 import os
+from django.conf import settings
 from evennia.server.portal import amp
-from twisted.internet import protocol
+from twisted.internet import protocol, reactor
 from evennia.utils import logger
 
+_BATCH_SIZE = settings.AMP_BATCH_SIZE
+_BATCH_LATENCY = settings.AMP_BATCH_LATENCY
+
 
 class AMPClientFactory(protocol.ReconnectingClientFactory):
     """
@@ -95,6 +99,15 @@ class AMPServerClientProtocol(amp.AMPMultiConnectionProtocol):
     Portal (which acts as the AMP-server)
 
     """
+    def __init__(self, *args, **kwargs):
+        """
+        Initialize the outgoing message buffer.
+
+        """
+        super(AMPServerClientProtocol, self).__init__(*args, **kwargs)
+        self.send_buffer = []
+        self.send_flush_task = None
+
     # sending AMP data
 
     def connectionMade(self):
@@ -111,6 +124,18 @@ class AMPServerClientProtocol(amp.AMPMultiConnectionProtocol):
         # run the intial setup if needed
         self.factory.server.run_initial_setup()
 
+    def connectionLost(self, reason):
+        """
+        Called when the connection to the Portal is lost. Messages still
+        waiting to be sent are dropped.
+
+        """
+        if self.send_flush_task and self.send_flush_task.active():
+            self.send_flush_task.cancel()
+        self.send_flush_task = None
+        self.send_buffer = []
+        super(AMPServerClientProtocol, self).connectionLost(reason)
+
     def data_to_portal(self, command, sessid, **kwargs):
         """
         Send data across the wire to the Portal
@@ -124,11 +149,11 @@ class AMPServerClientProtocol(amp.AMPMultiConnectionProtocol):
             deferred (deferred or None): A deferred with an errback.
 
         Notes:
-            Data will be sent across the wire pickled as a tuple
+            Data will be sent across the wire packed as a tuple
             (sessid, kwargs).
 
         """
-        return self.callRemote(command, packed_data=amp.dumps((sessid, kwargs))).addErrback(
+        return self.callRemote(command, packed_data=amp.pack_data((sessid, kwargs))).addErrback(
                 self.errback, command.key)
 
     def send_MsgServer2Portal(self, session, **kwargs):
@@ -140,8 +165,42 @@ class AMPServerClientProtocol(amp.AMPMultiConnectionProtocol):
             session (Session): Unique Session.
             kwargs (any, optiona): Extra data.
 
+        Notes:
+            The message is not sent immediately but is buffered together
+            with other outgoing messages and sent as one batch at the end
+            of the current reactor iteration (or after
+            `settings.AMP_BATCH_LATENCY` seconds). The batch is sent
+            right away if it reaches `settings.AMP_BATCH_SIZE` messages.
+
+        """
+        if _BATCH_SIZE <= 1:
+            # batching is turned off
+            return self.data_to_portal(amp.MsgServer2Portal, session.sessid, **kwargs)
+        self.send_buffer.append((session.sessid, kwargs))
+        if len(self.send_buffer) >= _BATCH_SIZE:
+            self.flush_MsgServer2Portal()
+        elif not self.send_flush_task:
+            self.send_flush_task = reactor.callLater(_BATCH_LATENCY, self.flush_MsgServer2Portal)
+
+    def flush_MsgServer2Portal(self):
+        """
+        Send all buffered messages to the Portal as one batch. This is
+        executed on the Server.
+
+        Returns:
+            deferred (deferred or None): A deferred with an errback, or
+                `None` if there was nothing to send.
+
         """
-        return self.data_to_portal(amp.MsgServer2Portal, session.sessid, **kwargs)
+        if self.send_flush_task and self.send_flush_task.active():
+            self.send_flush_task.cancel()
+        self.send_flush_task = None
+        if not self.send_buffer:
+            return None
+        batch, self.send_buffer = self.send_buffer, []
+        return self.callRemote(amp.MsgServer2PortalBatch,
+                               packed_data=amp.pack_data(batch)).addErrback(
+                self.errback, amp.MsgServer2PortalBatch.key)
 
     def send_AdminServer2Portal(self, session, operation="", **kwargs):
         """
@@ -156,6 +215,9 @@ class AMPServerClientProtocol(amp.AMPMultiConnectionProtocol):
             kwargs (dict, optional): Data going into the adminstrative.
 
         """
+        # make sure messages sent before this (like a goodbye message before
+        # a disconnect) get to the Portal first
+        self.flush_MsgServer2Portal()
         return self.data_to_portal(amp.AdminServer2Portal, session.sessid,
                                    operation=operation, **kwargs)
 
@@ -220,7 +282,15 @@ class AMPServerClientProtocol(amp.AMPMultiConnectionProtocol):
             # first server-connect.
             server_restart_mode = kwargs.get("server_restart_mode", "shutdown")
             self.factory.server.run_init_hooks(server_restart_mode)
-            server_sessionhandler.portal_sessions_sync(kwargs.get("sessiondata"))
+            server_sessionhandler.portal_sessions_sync(kwargs.get("sessiondata"),
+                                                       last=kwargs.get("sync_last", True),
+                                                       stop_time=kwargs.get("stop_time"))
+
+        elif operation == amp.PSYNCCHUNK:  # portal_session_sync, continued
+            # further session data, when the portal sync is split into chunks
+            server_sessionhandler.portal_sessions_sync(kwargs.get("sessiondata"),
+                                                       first=False,
+                                                       last=kwargs.get("sync_last", True))
 
         elif operation == amp.SRELOAD:  # server reload
             # shut down in reload mode
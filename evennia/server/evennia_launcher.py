@@ -83,6 +83,7 @@ NO_REACTOR_STOP = False
 AMP_PORT = None
 AMP_HOST = None
 AMP_INTERFACE = None
+AMP_SOCKET_FILE = None
 AMP_CONNECTION = None
 
 SRELOAD = chr(14)      # server reloading (have portal start a new server)
@@ -453,6 +454,7 @@ PORTAL_INFO = \
     external ports:
         {telnet}
         {telnet_ssl}
+        {mccp}
         {ssh}
         {webserver_proxy}
         {webclient}
@@ -692,7 +694,10 @@ def send_instruction(operation, arguments, callback=None, errback=None):
         _send()
     else:
         # we must connect first, send once connected
-        point = endpoints.TCP4ClientEndpoint(reactor, AMP_HOST, AMP_PORT)
+        if AMP_SOCKET_FILE:
+            point = endpoints.UNIXClientEndpoint(reactor, AMP_SOCKET_FILE)
+        else:
+            point = endpoints.TCP4ClientEndpoint(reactor, AMP_HOST, AMP_PORT)
         deferred = endpoints.connectProtocol(point, AMPLauncherProtocol())
         deferred.addCallbacks(_on_connect, _on_connect_fail)
         REACTOR_RUN = True
@@ -1686,7 +1691,7 @@ def init_game_directory(path, check_db=True):
         check_database()
 
     # set up the Evennia executables and log file locations
-    global AMP_PORT, AMP_HOST, AMP_INTERFACE
+    global AMP_PORT, AMP_HOST, AMP_INTERFACE, AMP_SOCKET_FILE
     global SERVER_PY_FILE, PORTAL_PY_FILE
     global SERVER_LOGFILE, PORTAL_LOGFILE, HTTP_LOGFILE
     global SERVER_PIDFILE, PORTAL_PIDFILE
@@ -1696,6 +1701,8 @@ def init_game_directory(path, check_db=True):
     AMP_PORT = settings.AMP_PORT
     AMP_HOST = settings.AMP_HOST
     AMP_INTERFACE = settings.AMP_INTERFACE
+    from evennia.server.portal.amp import get_amp_socket_file
+    AMP_SOCKET_FILE = get_amp_socket_file()
 
     SERVER_PY_FILE = os.path.join(EVENNIA_LIB, "server", "server.py")
     PORTAL_PY_FILE = os.path.join(EVENNIA_LIB, "server", "portal", "portal.py")
@@ -6,17 +6,21 @@ This module acts as a central place for AMP-servers and -clients to get commands
 """
 from __future__ import print_function
 from functools import wraps
+import os
+import socket
 import time
 from twisted.protocols import amp
 from collections import defaultdict, namedtuple
 from cStringIO import StringIO
 from itertools import count
+import marshal
 import zlib  # Used in Compressed class
 try:
     import cPickle as pickle
 except ImportError:
     import pickle
 
+from django.conf import settings
 from twisted.internet.defer import DeferredList, Deferred
 from evennia.utils.utils import to_str, variable_from_module
 
@@ -43,12 +47,30 @@ PSHUTD = chr(16)       # portal (+server) shutdown
 SSHUTD = chr(17)       # server shutdown
 PSTATUS = chr(18)      # ping server or portal status
 SRESET = chr(19)       # server shutdown in reset mode
+PSYNCCHUNK = chr(20)   # portal session sync, continued
 
 NUL = b'\0'
 NULNUL = '\0\0'
 
 AMP_MAXLEN = amp.MAX_VALUE_LENGTH    # max allowed data length in AMP protocol (cannot be changed)
 
+# compression flags, put first in every Compressed value. A legacy zlib stream
+# (without a flag) always starts with 'x', so they can't be confused.
+ZLIB_NONE = b'\x01'   # value is not compressed
+ZLIB_FAST = b'\x02'   # value is zlib-compressed
+
+# serialization flag for packed data. Pickles always start with \x80, so
+# data without the flag is a pickle.
+MARSHALLED = b'M'
+# the exact types that marshal handles faithfully (besides list, tuple, dict)
+_MARSHAL_SCALARS = (str, unicode, int, long, float, bool, type(None))
+
+_COMPRESSION_THRESHOLD = settings.AMP_COMPRESSION_THRESHOLD
+_COMPRESSION_LEVEL = settings.AMP_COMPRESSION_LEVEL
+
+# max length of a unix socket path (the OS limit is usually 104 or 108)
+_UNIX_SOCKET_MAXLEN = 100
+
 # buffers
 _SENDBATCH = defaultdict(list)
 _MSGBUFFER = defaultdict(list)
@@ -73,6 +95,28 @@ Content-Type: text/html
 </html>""".strip()
 
 
+def get_amp_socket_file():
+    """
+    Get the Unix domain socket file to use for the AMP connection.
+
+    Returns:
+        socket_file (str or None): The path to the socket file, or `None` if
+            AMP should use TCP on `settings.AMP_HOST`/`settings.AMP_PORT`.
+
+    Notes:
+        This falls back to TCP if Unix domain sockets are not supported on
+        this platform or if the path to the socket file is too long for the
+        OS to handle.
+
+    """
+    if settings.AMP_TRANSPORT != "unix" or not hasattr(socket, "AF_UNIX"):
+        return None
+    socket_file = settings.AMP_SOCKET_FILE or os.path.join(settings.GAME_DIR, "server", "amp.sock")
+    if len(socket_file) > _UNIX_SOCKET_MAXLEN:
+        return None
+    return socket_file
+
+
 # Helper functions for pickling.
 
 def dumps(data):
@@ -83,6 +127,73 @@ def loads(data):
     return pickle.loads(to_str(data))
 
 
+def _is_marshallable(data):
+    """
+    Check if data is made up only of the exact types `marshal` can
+    round-trip. Subclasses don't count; `marshal` writes them as their
+    base type.
+
+    Args:
+        data (any): The data to check.
+
+    Returns:
+        marshallable (bool): If `data` can be marshalled.
+
+    """
+    dtype = type(data)
+    if dtype in _MARSHAL_SCALARS:
+        return True
+    if dtype in (list, tuple):
+        return all(_is_marshallable(value) for value in data)
+    if dtype is dict:
+        return all(_is_marshallable(key) and _is_marshallable(value)
+                   for key, value in data.iteritems())
+    return False
+
+
+def pack_data(data):
+    """
+    Serialize data for sending over the wire. This is used for the
+    Portal<->Server messages, which are usually on the form
+    `(sessid, {cmdname: [[args], {kwargs}]})`.
+
+    Args:
+        data (any): The data to pack.
+
+    Returns:
+        packed (bytes): The serialized data.
+
+    Notes:
+        Data made up only of basic Python types (strings, numbers,
+        lists, tuples, dicts etc) are serialized with the much faster
+        `marshal`. Everything else falls back to being pickled. This
+        includes subclasses of the basic types (like ANSIString or the
+        `future` library's `newstr`), which `marshal` would otherwise
+        mangle.
+
+    """
+    if _is_marshallable(data):
+        return MARSHALLED + marshal.dumps(data)
+    return dumps(data)
+
+
+def unpack_data(packed):
+    """
+    Deserialize data packed by `pack_data` (or pickled with `dumps`).
+
+    Args:
+        packed (bytes): The packed data.
+
+    Returns:
+        data (any): The unpacked data.
+
+    """
+    packed = to_str(packed)
+    if packed[:1] == MARSHALLED:
+        return marshal.loads(packed[1:])
+    return pickle.loads(packed)
+
+
 @wraps
 def catch_traceback(func):
     "Helper decorator"
@@ -108,6 +219,11 @@ class Compressed(amp.String):
     batch-grouping of too-long sends is borrowed from the "mediumbox"
     recipy at twisted-hacks's ~glyph/+junk/amphacks/mediumbox.
 
+    Compression is adaptive - values shorter than
+    `settings.AMP_COMPRESSION_THRESHOLD` are sent as-is, since compressing
+    them costs more time than it saves in bandwidth. Each value starts with a
+    flag telling the other side if it's compressed or not.
+
     """
 
     def fromBox(self, name, strings, objects, proto):
@@ -133,9 +249,10 @@ class Compressed(amp.String):
 
         """
         value = StringIO(objects[name])
-        strings[name] = self.toStringProto(value.read(AMP_MAXLEN), proto)
+        # leave room for the compression flag
+        strings[name] = self.toStringProto(value.read(AMP_MAXLEN - 1), proto)
         for counter in count(2):
-            chunk = value.read(AMP_MAXLEN)
+            chunk = value.read(AMP_MAXLEN - 1)
             if not chunk:
                 break
             strings["%s.%d" % (name, counter)] = self.toStringProto(chunk, proto)
@@ -144,13 +261,27 @@ class Compressed(amp.String):
         """
         Convert to send as a string on the wire, with compression.
         """
-        return zlib.compress(super(Compressed, self).toString(inObject), 9)
+        string = super(Compressed, self).toString(inObject)
+        if len(string) >= _COMPRESSION_THRESHOLD:
+            compressed = zlib.compress(string, _COMPRESSION_LEVEL)
+            # incompressible data may grow, then we send it as-is
+            if len(compressed) < len(string):
+                return ZLIB_FAST + compressed
+        return ZLIB_NONE + string
 
     def fromString(self, inString):
         """
         Convert (decompress) from the string-representation on the wire to Python.
         """
-        return super(Compressed, self).fromString(zlib.decompress(inString))
+        flag = inString[:1]
+        if flag == ZLIB_NONE:
+            string = inString[1:]
+        elif flag == ZLIB_FAST:
+            string = zlib.decompress(inString[1:])
+        else:
+            # an un-flagged zlib stream from an older process
+            string = zlib.decompress(inString)
+        return super(Compressed, self).fromString(string)
 
 
 class MsgLauncher2Portal(amp.Command):
@@ -187,6 +318,21 @@ class MsgServer2Portal(amp.Command):
     response = []
 
 
+class MsgServer2PortalBatch(amp.Command):
+    """
+    Message Server -> Portal
+
+    Many messages, possibly to many sessions, sent as one batch. The
+    data is a list of (sessid, kwargs) tuples, in the order they were
+    sent on the Server.
+
+    """
+    key = "MsgServer2PortalBatch"
+    arguments = [('packed_data', Compressed())]
+    errors = {Exception: 'EXCEPTION'}
+    response = []
+
+
 class AdminPortal2Server(amp.Command):
     """
     Administration Portal -> Server
@@ -356,7 +502,7 @@ class AMPMultiConnectionProtocol(amp.AMP):
             unpaced_data (any): Unpacked package
 
         """
-        return loads(packed_data)
+        return unpack_data(packed_data)
 
     def broadcast(self, command, sessid, **kwargs):
         """
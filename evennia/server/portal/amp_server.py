@@ -6,6 +6,7 @@ these are the Evennia Server and the evennia launcher).
 """
 import os
 import sys
+import time
 from twisted.internet import protocol
 from evennia.server.portal import amp
 from django.conf import settings
@@ -132,17 +133,17 @@ class AMPServerProtocol(amp.AMPMultiConnectionProtocol):
             deferred (deferred or None): A deferred with an errback.
 
         Notes:
-            Data will be sent across the wire pickled as a tuple
+            Data will be sent across the wire packed as a tuple
             (sessid, kwargs).
 
         """
         if self.factory.server_connection:
             return self.factory.server_connection.callRemote(
-                        command, packed_data=amp.dumps((sessid, kwargs))).addErrback(
+                        command, packed_data=amp.pack_data((sessid, kwargs))).addErrback(
                             self.errback, command.key)
         else:
             # if no server connection is available, broadcast
-            return self.broadcast(command, sessid, packed_data=amp.dumps((sessid, kwargs)))
+            return self.broadcast(command, sessid, packed_data=amp.pack_data((sessid, kwargs)))
 
     def start_server(self, server_twistd_cmd):
         """
@@ -217,6 +218,7 @@ class AMPServerProtocol(amp.AMPMultiConnectionProtocol):
         elif mode == 'shutdown':
             self.send_AdminPortal2Server(amp.DUMMYSESSION, operation=amp.SSHUTD)
         self.factory.portal.server_restart_mode = mode
+        self.factory.portal.server_stop_time = time.time()
 
     # sending amp data
 
@@ -365,6 +367,33 @@ class AMPServerProtocol(amp.AMPMultiConnectionProtocol):
             logger.log_trace("packed_data len {}".format(len(packed_data)))
         return {}
 
+    @amp.MsgServer2PortalBatch.responder
+    @amp.catch_traceback
+    def portal_receive_server2portal_batch(self, packed_data):
+        """
+        Receives a batch of messages arriving to Portal from Server.
+        This method is executed on the Portal.
+
+        Args:
+            packed_data (str): Packed list of (sessid, kwargs) tuples coming over the wire.
+
+        """
+        try:
+            batch = self.data_in(packed_data)
+        except Exception:
+            logger.log_trace("packed_data len {}".format(len(packed_data)))
+            return {}
+        sessions = self.factory.portal.sessions
+        for sessid, kwargs in batch:
+            session = sessions.get(sessid, None)
+            if session:
+                try:
+                    sessions.data_out(session, **kwargs)
+                except Exception:
+                    # don't let one bad message stop the rest of the batch
+                    logger.log_trace()
+        return {}
+
     @amp.AdminServer2Portal.responder
     @amp.catch_traceback
     def portal_receive_adminserver2portal(self, packed_data):
@@ -424,11 +453,10 @@ class AMPServerProtocol(amp.AMPMultiConnectionProtocol):
             # this defaults to 'shutdown' or whatever value set in server_stop
             server_restart_mode = self.factory.portal.server_restart_mode
 
-            sessdata = self.factory.portal.sessions.get_all_sync_data()
-            self.send_AdminPortal2Server(amp.DUMMYSESSION,
-                                         amp.PSYNC,
-                                         server_restart_mode=server_restart_mode,
-                                         sessiondata=sessdata)
+            # the session data is streamed to the Server in chunks
+            self.factory.portal.sessions.server_sessions_sync(
+                server_restart_mode, stop_time=self.factory.portal.server_stop_time)
+            self.factory.portal.server_stop_time = None
             self.factory.portal.sessions.at_server_connection()
 
             if self.factory.server_connection:
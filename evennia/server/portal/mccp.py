@@ -12,15 +12,47 @@ effect of MCCP unless you have extremely heavy traffic or sits on a
 terribly slow connection.
 
 This protocol is implemented by the telnet protocol importing
-mccp_compress and calling it from its write methods.
+mccp_write and calling it from its write methods. When MCCP is
+active, everything written to a session during one reactor iteration
+is compressed and flushed together.
+
+The memory used per session and the compression level are set by the
+MCCP_WBITS, MCCP_MEMLEVEL and MCCP_LEVEL settings. A session can use
+another compression level by setting its `MCCP_LEVEL` protocol flag
+before MCCP is negotiated.
 """
 from builtins import object
 import zlib
+from django.conf import settings
+from twisted.internet import reactor
 
 # negotiations for v1 and v2 of the protocol
 MCCP = chr(86)
 FLUSH = zlib.Z_SYNC_FLUSH
 
+_MCCP_WBITS = settings.MCCP_WBITS
+_MCCP_MEMLEVEL = settings.MCCP_MEMLEVEL
+_MCCP_LEVEL = settings.MCCP_LEVEL
+
+
+def mccp_memory(wbits=_MCCP_WBITS, memlevel=_MCCP_MEMLEVEL):
+    """
+    Estimate the memory used by the compression of one MCCP session.
+
+    Args:
+        wbits (int, optional): The zlib window size (base-two logarithm).
+        memlevel (int, optional): The zlib memory level.
+
+    Returns:
+        size (int): The memory used, in bytes.
+
+    Notes:
+        This uses the formula from zlib's documentation, plus a few KB
+        for zlib's own state.
+
+    """
+    return (1 << (wbits + 2)) + (1 << (memlevel + 9)) + 6 * 1024
+
 
 def mccp_compress(protocol, data):
     """
@@ -38,6 +70,41 @@ def mccp_compress(protocol, data):
     return data
 
 
+def mccp_write(protocol, data):
+    """
+    Write data to the protocol's transport. If MCCP is active, the
+    data is collected and compressed together with everything else
+    written during this reactor iteration.
+
+    Args:
+        protocol (Protocol): The protocol to write to.
+        data (str): The data to write.
+
+    """
+    if hasattr(protocol, 'zlib'):
+        outbuffer = protocol.mccp_buffer
+        outbuffer.append(data)
+        if len(outbuffer) == 1:
+            reactor.callLater(0, mccp_flush, protocol)
+    else:
+        protocol.transport.write(data)
+
+
+def mccp_flush(protocol):
+    """
+    Compress and write all collected data.
+
+    Args:
+        protocol (Protocol): The protocol to flush.
+
+    """
+    outbuffer = getattr(protocol, 'mccp_buffer', None)
+    if outbuffer and hasattr(protocol, 'zlib'):
+        data = "".join(outbuffer)
+        del outbuffer[:]
+        protocol.transport.write(protocol.zlib.compress(data) + protocol.zlib.flush(FLUSH))
+
+
 class Mccp(object):
     """
     Implements the MCCP protocol. Add this to a
@@ -71,6 +138,7 @@ class Mccp(object):
 
         """
         if hasattr(self.protocol, 'zlib'):
+            mccp_flush(self.protocol)
             del self.protocol.zlib
         self.protocol.protocol_flags['MCCP'] = False
         self.protocol.handshake_done()
@@ -86,5 +154,7 @@ class Mccp(object):
         """
         self.protocol.protocol_flags['MCCP'] = True
         self.protocol.requestNegotiation(MCCP, '')
-        self.protocol.zlib = zlib.compressobj(9)
+        level = self.protocol.protocol_flags.get('MCCP_LEVEL', _MCCP_LEVEL)
+        self.protocol.mccp_buffer = []
+        self.protocol.zlib = zlib.compressobj(level, zlib.DEFLATED, _MCCP_WBITS, _MCCP_MEMLEVEL)
         self.protocol.handshake_done()
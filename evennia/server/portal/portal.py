@@ -26,6 +26,7 @@ evennia._init()
 
 from evennia.utils.utils import get_evennia_version, mod_import, make_iter
 from evennia.server.portal.portalsessionhandler import PORTAL_SESSIONS
+from evennia.server.portal.mccp import mccp_memory
 from evennia.utils import logger
 from evennia.server.webserver import EvenniaReverseProxyResource
 from django.db import connection
@@ -76,7 +77,7 @@ AMP_INTERFACE = settings.AMP_INTERFACE
 AMP_ENABLED = AMP_HOST and AMP_PORT and AMP_INTERFACE
 
 INFO_DICT = {"servername": SERVERNAME, "version": VERSION, "errors": "", "info": "",
-             "lockdown_mode": "", "amp": "", "telnet": [], "telnet_ssl": [], "ssh": [],
+             "lockdown_mode": "", "amp": "", "telnet": [], "telnet_ssl": [], "mccp": "", "ssh": [],
              "webclient": [], "webserver_proxy": [], "webserver_internal": []}
 
 # -------------------------------------------------------------
@@ -112,6 +113,7 @@ class Portal(object):
 
         self.server_process_id = None
         self.server_restart_mode = "shutdown"
+        self.server_stop_time = None
         self.server_info_dict = {}
 
         # in non-interactive portal mode, this gets overwritten by
@@ -142,6 +144,9 @@ class Portal(object):
 
     def get_info_dict(self):
         "Return the Portal info, for display."
+        if TELNET_ENABLED or SSL_ENABLED:
+            nmccp = len([sess for sess in self.sessions.values() if hasattr(sess, "zlib")])
+            INFO_DICT["mccp"] = "mccp: %i session(s), ~%iKB each" % (nmccp, mccp_memory() // 1024)
         return INFO_DICT
 
     def shutdown(self, _reactor_stopping=False, _stop_server=False):
@@ -208,11 +213,17 @@ if AMP_ENABLED:
     # it would be during testing and debugging.
 
     from evennia.server.portal import amp_server
-
-    INFO_DICT["amp"] = 'amp: %s' % AMP_PORT
+    from evennia.server.portal.amp import get_amp_socket_file
 
     factory = amp_server.AMPServerFactory(PORTAL)
-    amp_service = internet.TCPServer(AMP_PORT, factory, interface=AMP_INTERFACE)
+    amp_socket_file = get_amp_socket_file()
+    if amp_socket_file:
+        INFO_DICT["amp"] = 'amp: %s' % amp_socket_file
+        # only the user running the Portal may connect to the socket
+        amp_service = internet.UNIXServer(amp_socket_file, factory, mode=0o600, wantPID=True)
+    else:
+        INFO_DICT["amp"] = 'amp: %s' % AMP_PORT
+        amp_service = internet.TCPServer(AMP_PORT, factory, interface=AMP_INTERFACE)
     amp_service.setName("PortalAMPServer")
     PORTAL.services.addService(amp_service)
 
@@ -341,7 +352,11 @@ if WEBSERVER_ENABLED:
                     factory.noisy = False
                     factory.protocol = webclient.WebSocketClient
                     factory.sessionhandler = PORTAL_SESSIONS
-                    websocket_service = internet.TCPServer(port, WebSocketFactory(factory),
+                    ws_factory = WebSocketFactory(
+                        factory, deflate=settings.WEBSOCKET_CLIENT_DEFLATE,
+                        deflate_max_wbits=settings.WEBSOCKET_CLIENT_DEFLATE_WBITS,
+                        deflate_memlevel=settings.WEBSOCKET_CLIENT_DEFLATE_MEMLEVEL)
+                    websocket_service = internet.TCPServer(port, ws_factory,
                                                            interface=w_interface)
                     websocket_service.setName('EvenniaWebSocket%s:%s' % (w_ifacestr, port))
                     PORTAL.services.addService(websocket_service)
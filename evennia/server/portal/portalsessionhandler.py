@@ -9,7 +9,7 @@ from collections import deque, namedtuple
 from twisted.internet import reactor
 from django.conf import settings
 from evennia.server.sessionhandler import SessionHandler, PCONN, PDISCONN, \
-    PCONNSYNC, PDISCONNALL
+    PCONNSYNC, PDISCONNALL, PSYNC, PSYNCCHUNK
 from evennia.utils.logger import log_trace
 
 # module import
@@ -20,6 +20,8 @@ _MAX_CONNECTION_RATE = float(settings.MAX_CONNECTION_RATE)
 # per-session throttles
 _MAX_COMMAND_RATE = float(settings.MAX_COMMAND_RATE)
 _MAX_CHAR_LIMIT = int(settings.MAX_CHAR_LIMIT)
+# sessions to send per chunk when syncing with a (re)connecting Server
+_SYNC_CHUNK_SIZE = settings.AMP_SESSION_SYNC_CHUNK_SIZE
 
 _MIN_TIME_BETWEEN_CONNECTS = 1.0 / float(_MAX_CONNECTION_RATE)
 _MIN_TIME_BETWEEN_COMMANDS = 1.0 / float(_MAX_COMMAND_RATE)
@@ -62,6 +64,11 @@ class PortalSessionHandler(SessionHandler):
         self.connection_last = self.uptime
         self.connection_task = None
 
+        # sessids not yet synced with the Server and their waiting input
+        self.sync_pending = set()
+        self.sync_input = {}
+        self.sync_count = 0
+
     def at_server_connection(self):
         """
         Called when the Portal establishes connection with the Server.
@@ -70,6 +77,62 @@ class PortalSessionHandler(SessionHandler):
         """
         self.connection_time = time.time()
 
+    def server_sessions_sync(self, server_restart_mode, stop_time=None):
+        """
+        Send the sync data of all sessions to a newly (re)connected Server.
+        The data is sent in chunks, one per reactor iteration, so the Server
+        can start handling a session as soon as its chunk arrives. Input from
+        sessions not yet sent is held until their chunk has gone out.
+
+        Args:
+            server_restart_mode (str): One of 'shutdown', 'reload' or 'reset'.
+            stop_time (float, optional): When the Server was last stopped, so
+                it can measure how long the restart took.
+
+        """
+        sessids = sorted(self.keys())
+        size = _SYNC_CHUNK_SIZE if _SYNC_CHUNK_SIZE > 0 else max(1, len(sessids))
+        chunks = [sessids[ichunk:ichunk + size]
+                  for ichunk in range(0, len(sessids), size)] or [[]]
+        # a new sync makes any still-running one obsolete
+        self.sync_count += 1
+        self.sync_pending = set(sessids)
+        self.sync_input = {}
+        self._send_sync_chunk(self.sync_count, chunks, 0,
+                              server_restart_mode=server_restart_mode,
+                              stop_time=stop_time)
+
+    def _send_sync_chunk(self, sync_count, chunks, ichunk, **kwargs):
+        """
+        Send one chunk of session sync data to the Server and schedule the next.
+
+        Args:
+            sync_count (int): The sync this chunk belongs to.
+            chunks (list): Lists of sessids to send.
+            ichunk (int): The index of the chunk to send.
+
+        Kwargs:
+            kwargs (any): Sent along with the chunk.
+
+        """
+        if sync_count != self.sync_count or not self.portal.amp_protocol:
+            return
+        sessdata = dict((sessid, self[sessid].get_sync_data())
+                        for sessid in chunks[ichunk] if sessid in self)
+        last = ichunk == len(chunks) - 1
+        self.portal.amp_protocol.send_AdminPortal2Server(
+            DUMMYSESSION, operation=PSYNCCHUNK if ichunk else PSYNC,
+            sessiondata=sessdata, sync_last=last, **kwargs)
+        # these sessions are now known to the Server; release their input
+        for sessid in chunks[ichunk]:
+            self.sync_pending.discard(sessid)
+            session = self.get(sessid)
+            for data in self.sync_input.pop(sessid, ()):
+                if session:
+                    self.portal.amp_protocol.send_MsgPortal2Server(session, **data)
+        if not last:
+            reactor.callLater(0, self._send_sync_chunk, sync_count, chunks, ichunk + 1)
+
     def connect(self, session):
         """
         Called by protocol at first connect. This adds a not-yet
@@ -172,6 +235,9 @@ class PortalSessionHandler(SessionHandler):
             _CONNECTION_QUEUE.remove(session)
             return
 
+        self.sync_pending.discard(session.sessid)
+        self.sync_input.pop(session.sessid, None)
+
         if session.sessid in self and not hasattr(self, "_disconnect_all"):
             # if this was called directly from the protocol, the
             # connection is already dead and we just need to cleanup
@@ -393,8 +459,13 @@ class PortalSessionHandler(SessionHandler):
             # scrub data
             kwargs = self.clean_senddata(session, kwargs)
 
-            # relay data to Server
             session.cmd_last = now
+            if session.sessid in self.sync_pending:
+                # the Server doesn't know this session yet
+                self.sync_input.setdefault(session.sessid, []).append(kwargs)
+                return
+
+            # relay data to Server
             self.portal.amp_protocol.send_MsgPortal2Server(session,
                                                            **kwargs)
 
@@ -15,7 +15,7 @@ from twisted.conch.telnet import IAC, NOP, LINEMODE, GA, WILL, WONT, ECHO, NULL
 from django.conf import settings
 from evennia.server.session import Session
 from evennia.server.portal import ttype, mssp, telnet_oob, naws, suppress_ga
-from evennia.server.portal.mccp import Mccp, mccp_compress, MCCP
+from evennia.server.portal.mccp import Mccp, mccp_write, mccp_flush, MCCP
 from evennia.server.portal.mxp import Mxp, mxp_parse
 from evennia.utils import ansi
 from evennia.utils.utils import to_str
@@ -195,6 +195,10 @@ class TelnetProtocol(Telnet, StatefulTelnetProtocol, Session):
 
         """
         self.sessionhandler.disconnect(self)
+        # send any OOB updates and output still waiting to be compressed
+        if hasattr(self, "oob"):
+            self.oob.flush_batch()
+        mccp_flush(self)
         self.transport.loseConnection()
 
     def applicationDataReceived(self, data):
@@ -233,7 +237,7 @@ class TelnetProtocol(Telnet, StatefulTelnetProtocol, Session):
     def _write(self, data):
         """hook overloading the one used in plain telnet"""
         data = data.replace('\n', '\r\n').replace('\r\r\n', '\r\n')
-        super(TelnetProtocol, self)._write(mccp_compress(self, data))
+        mccp_write(self, data)
 
     def sendLine(self, line):
         """
@@ -250,7 +254,7 @@ class TelnetProtocol(Telnet, StatefulTelnetProtocol, Session):
             line += "\r\n"
         if not self.protocol_flags.get("NOGOAHEAD", True):
             line += IAC + GA
-        return self.transport.write(mccp_compress(self, line))
+        mccp_write(self, line)
 
     # Session hooks
 
@@ -344,7 +348,7 @@ class TelnetProtocol(Telnet, StatefulTelnetProtocol, Session):
                     prompt = mxp_parse(prompt)
             prompt = prompt.replace(IAC, IAC + IAC).replace('\n', '\r\n')
             prompt += IAC + GA
-            self.transport.write(mccp_compress(self, prompt))
+            mccp_write(self, prompt)
         else:
             if echo is not None:
                 # turn on/off echo. Note that this is a bit turned around since we use
@@ -354,11 +358,11 @@ class TelnetProtocol(Telnet, StatefulTelnetProtocol, Session):
                     # by telling the client that WE WON'T echo, the client knows
                     # that IT should echo. This is the expected behavior from
                     # our perspective.
-                    self.transport.write(mccp_compress(self, IAC + WONT + ECHO))
+                    mccp_write(self, IAC + WONT + ECHO)
                 else:
                     # by telling the client that WE WILL echo, the client can
                     # safely turn OFF its OWN echo.
-                    self.transport.write(mccp_compress(self, IAC + WILL + ECHO))
+                    mccp_write(self, IAC + WILL + ECHO)
             if raw:
                 # no processing
                 self.sendLine(text)
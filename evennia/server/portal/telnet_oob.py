@@ -24,10 +24,19 @@ Following the lead of KaVir's protocol snippet, we first check if
 client supports MSDP and if not, we fallback to GMCP with a MSDP
 header where applicable.
 
+If `settings.TELNET_OOB_BATCH_INTERVAL` is set, updates of monitored
+values (the `monitor` command) are not sent one by one. They are
+collected per session, superseded values and values the client already
+has are dropped, and what remains is sent as one `monitor_batch` command
+(GMCP `Char.Monitor.Batch {name: value, ...}`, an MSDP table) at most
+once every that many seconds. Clients must know to expect this.
+
 """
 from builtins import object
 import re
 import json
+from django.conf import settings
+from twisted.internet import reactor
 from evennia.utils.utils import to_str
 
 # MSDP-relevant telnet cmd/opt-codes
@@ -71,7 +80,14 @@ EVENNIA_TO_GMCP = {"client_options": "Core.Supports.Get",
                    "get_inputfuncs": "Core.Commands.Get",
                    "get_value": "Char.Value.Get",
                    "repeat": "Char.Repeat.Update",
-                   "monitor": "Char.Monitor.Update"}
+                   "monitor": "Char.Monitor.Update",
+                   "monitor_batch": "Char.Monitor.Batch"}
+
+# OOB commands sending a changing value as `name` and `value` kwargs,
+# mapped to the command their collected updates are sent with
+OOB_BATCHED = {"monitor": "monitor_batch"}
+
+_OOB_BATCH_INTERVAL = settings.TELNET_OOB_BATCH_INTERVAL
 
 
 # MSDP/GMCP communication handler
@@ -100,7 +116,11 @@ class TelnetOOB(object):
         self.protocol.negotiationMap[GMCP] = self.decode_gmcp
         self.protocol.will(MSDP).addCallbacks(self.do_msdp, self.no_msdp)
         self.protocol.will(GMCP).addCallbacks(self.do_gmcp, self.no_gmcp)
+        # the last values sent and the updates waiting to be sent, per batched command
         self.oob_reported = {}
+        self.oob_batch = {}
+        self._batch_call = None
+        self._batch_time = 0
 
     def no_msdp(self, option):
         """
@@ -245,6 +265,7 @@ class TelnetOOB(object):
                 get_value      -> Char.Value.Get
                 repeat         -> Char.Repeat.Update
                 monitor        -> Char.Monitor.Update
+                monitor_batch  -> Char.Monitor.Batch
 
         """
 
@@ -353,6 +374,7 @@ class TelnetOOB(object):
             cmds[key] = [[var], {}]
 
         # print("msdp data in:", cmds)  # DEBUG
+        self.reset_reported(cmds)
         self.protocol.data_in(**cmds)
 
     def decode_gmcp(self, data):
@@ -401,13 +423,34 @@ class TelnetOOB(object):
             if cmdname.lower().startswith("core_"):
                 # if Core.cmdname, then use cmdname
                 cmdname = cmdname[5:]
-            self.protocol.data_in(**{cmdname.lower(): [args, kwargs]})
+            cmds = {cmdname.lower(): [args, kwargs]}
+            self.reset_reported(cmds)
+            self.protocol.data_in(**cmds)
+
+    def reset_reported(self, cmds):
+        """
+        Forget the last values sent for the names the client starts or
+        stops monitoring, so the first update after (re)monitoring is
+        always sent, even if the value didn't change.
+
+        Args:
+            cmds (dict): Incoming commands on the form `{cmdname: [args, kwargs]}`.
+
+        """
+        for cmdname, (args, kwargs) in cmds.iteritems():
+            cmdname = cmdname.lower()
+            if cmdname.startswith("un"):
+                cmdname = cmdname[2:]
+            reported = self.oob_reported.get(cmdname)
+            if reported and kwargs.get("name") is not None:
+                reported.pop(kwargs["name"], None)
 
     # access methods
 
     def data_out(self, cmdname, *args, **kwargs):
         """
         Return a MSDP- or GMCP-valid subnegotiation across the protocol.
+        Updates of batched commands are collected and sent later.
 
         Args:
             cmdname (str): OOB-command name.
@@ -416,6 +459,59 @@ class TelnetOOB(object):
         """
         kwargs.pop("options", None)
 
+        if (_OOB_BATCH_INTERVAL > 0 and cmdname in OOB_BATCHED and not args and
+                len(kwargs) == 2 and "name" in kwargs and "value" in kwargs):
+            self.batch_out(cmdname, kwargs["name"], kwargs["value"])
+        else:
+            self.send_oob(cmdname, *args, **kwargs)
+
+    def batch_out(self, cmdname, name, value):
+        """
+        Collect an update of a batched command. A later update of the
+        same name replaces this one if it comes before the batch is sent.
+
+        Args:
+            cmdname (str): OOB-command name.
+            name (str): The name of the updated value.
+            value (any): The new value.
+
+        """
+        self.oob_batch.setdefault(cmdname, {})[name] = value
+        if not self._batch_call:
+            # send with the next reactor iteration, but not more often
+            # than once every interval
+            delay = max(0, self._batch_time + _OOB_BATCH_INTERVAL - reactor.seconds())
+            self._batch_call = reactor.callLater(delay, self.flush_batch)
+
+    def flush_batch(self):
+        """
+        Send all collected updates, one command per batched command.
+        Values not changed since they were last sent are left out.
+
+        """
+        if self._batch_call:
+            if self._batch_call.active():
+                self._batch_call.cancel()
+            self._batch_call = None
+        self._batch_time = reactor.seconds()
+        batch, self.oob_batch = self.oob_batch, {}
+        for cmdname, updates in batch.iteritems():
+            reported = self.oob_reported.setdefault(cmdname, {})
+            changed = {name: value for name, value in updates.iteritems()
+                       if name not in reported or reported[name] != value}
+            if changed:
+                reported.update(changed)
+                self.send_oob(OOB_BATCHED[cmdname], **changed)
+
+    def send_oob(self, cmdname, *args, **kwargs):
+        """
+        Encode and send an OOB command right away.
+
+        Args:
+            cmdname (str): OOB-command name.
+            args, kwargs (any): Arguments to OOB command.
+
+        """
         if self.MSDP:
             encoded_oob = self.encode_msdp(cmdname, *args, **kwargs)
             self.protocol._write(IAC + SB + MSDP + encoded_oob + IAC + SE)
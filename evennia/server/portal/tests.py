@@ -8,9 +8,13 @@ try:
 except ImportError:
     import unittest
 
-from mock import Mock
+from mock import Mock, patch
+from django.test.utils import override_settings
+import json
 import string
-from evennia.server.portal import irc
+import zlib
+from collections import OrderedDict
+from evennia.server.portal import irc, amp
 
 from twisted.conch.telnet import IAC, WILL, DONT, SB, SE, NAWS, DO
 from twisted.test import proto_helpers
@@ -18,13 +22,16 @@ from twisted.trial.unittest import TestCase as TwistedTestCase
 
 from .telnet import TelnetServerFactory, TelnetProtocol
 from .portal import PORTAL_SESSIONS
+from .portalsessionhandler import PortalSessionHandler
+from .webclient_ajax import AjaxWebClient
 from .suppress_ga import SUPPRESS_GA
 from .naws import DEFAULT_HEIGHT, DEFAULT_WIDTH
 from .ttype import TTYPE, IS
-from .mccp import MCCP
+from .mccp import MCCP, Mccp, mccp_write, mccp_flush, mccp_memory
 from .mssp import MSSP
 from .mxp import MXP
-from .telnet_oob import MSDP, MSDP_VAL, MSDP_VAR
+from .telnet_oob import (TelnetOOB, MSDP, MSDP_VAL, MSDP_VAR, MSDP_TABLE_OPEN,
+                         MSDP_TABLE_CLOSE, GMCP)
 
 
 class TestIRC(TestCase):
@@ -90,6 +97,310 @@ class TestIRC(TestCase):
         self.assertEqual(irc.parse_irc_to_ansi(irc.parse_ansi_to_irc(s)), s)
 
 
+class TestAMP(TestCase):
+
+    def _roundtrip(self, value):
+        "Send value through a Compressed argument and back"
+        strings = {}
+        amp.Compressed().toBox("data", strings, {"data": value}, None)
+        objects = {}
+        amp.Compressed().fromBox("data", strings, objects, None)
+        return strings, objects["data"]
+
+    def test_pack_data(self):
+        data = (1, {"text": [["look"], {}]})
+        packed = amp.pack_data(data)
+        self.assertEqual(packed[:1], amp.MARSHALLED)
+        self.assertEqual(amp.unpack_data(packed), data)
+        # unmarshallable data falls back to pickle
+        data = (1, {"text": [["look"], {"options": OrderedDict(raw=True)}]})
+        packed = amp.pack_data(data)
+        self.assertNotEqual(packed[:1], amp.MARSHALLED)
+        self.assertEqual(amp.unpack_data(packed), data)
+        self.assertTrue(isinstance(amp.unpack_data(packed)[1]["text"][1]["options"], OrderedDict))
+        # legacy pickles are still understood
+        self.assertEqual(amp.unpack_data(amp.dumps(data)), data)
+
+    def test_pack_data_subclasses(self):
+        from future.types import newstr, newint
+        from evennia.utils.ansi import ANSIString
+        data = (1, {"text": [[ANSIString("|rlook|n")],
+                             {"name": newstr(u"look"), "count": newint(2)}]})
+        packed = amp.pack_data(data)
+        self.assertNotEqual(packed[:1], amp.MARSHALLED)
+        unpacked = amp.unpack_data(packed)
+        self.assertEqual(unpacked, data)
+        self.assertEqual(unpacked[1]["text"][0][0].raw(), data[1]["text"][0][0].raw())
+        self.assertEqual(type(unpacked[1]["text"][1]["name"]), newstr)
+        self.assertEqual(type(unpacked[1]["text"][1]["count"]), newint)
+        # dict keys are checked too
+        self.assertNotEqual(amp.pack_data({newstr(u"key"): 1})[:1], amp.MARSHALLED)
+
+    def test_compression(self):
+        small = amp.pack_data((1, {"text": [["look"], {}]}))
+        strings, value = self._roundtrip(small)
+        self.assertEqual(value, small)
+        self.assertEqual(strings["data"][:1], amp.ZLIB_NONE)
+
+        large = amp.pack_data((1, {"text": [["spam " * 1000], {}]}))
+        strings, value = self._roundtrip(large)
+        self.assertEqual(value, large)
+        self.assertEqual(strings["data"][:1], amp.ZLIB_FAST)
+        self.assertTrue(len(strings["data"]) < len(large))
+
+        # data larger than fits in one AMP value
+        huge = "".join(chr(i % 256) for i in range(amp.AMP_MAXLEN * 2))
+        strings, value = self._roundtrip(huge)
+        self.assertEqual(value, huge)
+        self.assertEqual(len(strings), 3)
+        self.assertTrue(all(len(chunk) <= amp.AMP_MAXLEN for chunk in strings.values()))
+
+    def test_socket_file(self):
+        with override_settings(AMP_TRANSPORT="unix", AMP_SOCKET_FILE="/tmp/amp.sock"):
+            self.assertEqual(amp.get_amp_socket_file(), "/tmp/amp.sock")
+        with override_settings(AMP_TRANSPORT="unix", AMP_SOCKET_FILE="/tmp/%s.sock" % ("a" * 200)):
+            # too long for a unix socket path
+            self.assertEqual(amp.get_amp_socket_file(), None)
+        with override_settings(AMP_TRANSPORT="tcp"):
+            self.assertEqual(amp.get_amp_socket_file(), None)
+
+    def test_legacy_compression(self):
+        objects = {}
+        amp.Compressed().fromBox("data", {"data": zlib.compress("look", 9)}, objects, None)
+        self.assertEqual(objects["data"], "look")
+
+
+class TestSessionSync(TestCase):
+    """
+    Test streaming the session sync to the Server in chunks.
+    """
+    def setUp(self):
+        self.handler = PortalSessionHandler()
+        self.handler.portal = Mock()
+        for sessid in range(1, 6):
+            self.handler[sessid] = Mock(sessid=sessid, protocol_flags={"ENCODING": "utf-8"},
+                                        command_counter_reset=0, command_counter=0)
+            self.handler[sessid].get_sync_data.return_value = {"sessid": sessid}
+        self.amp_protocol = self.handler.portal.amp_protocol
+
+    @patch("evennia.server.portal.portalsessionhandler._SYNC_CHUNK_SIZE", 2)
+    @patch("evennia.server.portal.portalsessionhandler.reactor")
+    def test_chunks(self, mock_reactor):
+        send_admin = self.amp_protocol.send_AdminPortal2Server
+        send_msg = self.amp_protocol.send_MsgPortal2Server
+        self.handler.server_sessions_sync("reload", stop_time=10)
+        self.assertEqual(send_admin.call_count, 1)
+        kwargs = send_admin.call_args[1]
+        self.assertEqual(kwargs["operation"], amp.PSYNC)
+        self.assertEqual(sorted(kwargs["sessiondata"]), [1, 2])
+        self.assertEqual((kwargs["server_restart_mode"], kwargs["stop_time"],
+                          kwargs["sync_last"]), ("reload", 10, False))
+        # input from synced sessions is relayed, the rest is held back
+        self.handler.data_in(self.handler[1], text="look")
+        self.handler.data_in(self.handler[4], text="north")
+        self.handler.data_in(self.handler[5], text="south")
+        self.assertEqual(send_msg.call_count, 1)
+        # a session disconnecting while waiting is never synced
+        self.handler.disconnect(self.handler[5])
+        # next chunk
+        callback, args = mock_reactor.callLater.call_args[0][1], mock_reactor.callLater.call_args[0][2:]
+        callback(*args)
+        kwargs = send_admin.call_args[1]
+        self.assertEqual(kwargs["operation"], amp.PSYNCCHUNK)
+        self.assertEqual(sorted(kwargs["sessiondata"]), [3, 4])
+        self.assertEqual(send_msg.call_count, 2)
+        self.assertEqual(send_msg.call_args, ((self.handler[4],), {"text": [["north"], {"options": {}}]}))
+        # last chunk, session 5 is gone
+        callback, args = mock_reactor.callLater.call_args[0][1], mock_reactor.callLater.call_args[0][2:]
+        callback(*args)
+        kwargs = send_admin.call_args[1]
+        self.assertEqual((kwargs["sessiondata"], kwargs["sync_last"]), ({}, True))
+        self.assertEqual(send_msg.call_count, 2)
+        self.assertFalse(self.handler.sync_pending)
+
+    @patch("evennia.server.portal.portalsessionhandler._SYNC_CHUNK_SIZE", 0)
+    def test_no_chunks(self):
+        self.handler.server_sessions_sync("shutdown")
+        kwargs = self.amp_protocol.send_AdminPortal2Server.call_args[1]
+        self.assertEqual(sorted(kwargs["sessiondata"]), [1, 2, 3, 4, 5])
+        self.assertTrue(kwargs["sync_last"])
+
+
+@patch("evennia.server.portal.mccp.reactor")
+class TestMCCP(TestCase):
+    """
+    Test the MCCP compression and output coalescing.
+    """
+    def setUp(self):
+        self.protocol = Mock(protocol_flags={})
+        del self.protocol.zlib
+        self.mccp = Mccp(self.protocol)
+        self.write = self.protocol.transport.write
+
+    def test_uncompressed(self, mock_reactor):
+        mccp_write(self.protocol, "Hello")
+        self.write.assert_called_once_with("Hello")
+        self.assertFalse(mock_reactor.callLater.called)
+
+    def test_coalesce(self, mock_reactor):
+        self.mccp.do_mccp(None)
+        self.assertTrue(self.protocol.protocol_flags["MCCP"])
+        mccp_write(self.protocol, "Hello ")
+        mccp_write(self.protocol, "World\r\n")
+        self.assertFalse(self.write.called)
+        self.assertEqual(mock_reactor.callLater.call_count, 1)
+        mccp_flush(self.protocol)
+        self.assertEqual(self.write.call_count, 1)
+        decompress = zlib.decompressobj()
+        self.assertEqual(decompress.decompress(self.write.call_args[0][0]), "Hello World\r\n")
+        # turning MCCP off sends what's left compressed
+        mccp_write(self.protocol, "Bye")
+        self.mccp.no_mccp(None)
+        self.assertEqual(decompress.decompress(self.write.call_args[0][0]), "Bye")
+        mccp_write(self.protocol, "Plain")
+        self.write.assert_called_with("Plain")
+
+    @patch("evennia.server.portal.mccp.zlib.compressobj")
+    def test_settings(self, mock_compressobj, mock_reactor):
+        self.protocol.protocol_flags["MCCP_LEVEL"] = 1
+        self.mccp.do_mccp(None)
+        mock_compressobj.assert_called_once_with(1, zlib.DEFLATED, 12, 5)
+        self.assertEqual(mccp_memory(12, 5), (16 + 16 + 6) * 1024)
+
+
+@patch("evennia.server.portal.telnet_oob.reactor")
+class TestTelnetOOB(TestCase):
+    """
+    Test batching monitor updates to OOB clients.
+    """
+    def setUp(self):
+        self.protocol = Mock(protocol_flags={}, negotiationMap={})
+        self.oob = TelnetOOB(self.protocol)
+        self.write = self.protocol._write
+
+    def _gmcp_sent(self):
+        "Decode the GMCP commands sent"
+        sent = []
+        for call in self.write.call_args_list:
+            data = call[0][0]
+            self.assertEqual((data[:3], data[-2:]), (IAC + SB + GMCP, IAC + SE))
+            cmdname, structure = data[3:-2].split(" ", 1)
+            sent.append((cmdname, json.loads(structure)))
+        self.write.reset_mock()
+        return sent
+
+    def test_encode(self, mock_reactor):
+        self.assertEqual(self.oob.encode_gmcp("monitor", name="hp", value=10),
+                         'Char.Monitor.Update {"name": "hp", "value": 10}')
+        self.assertEqual(self.oob.encode_gmcp("monitor_batch", hp=10),
+                         'Char.Monitor.Batch {"hp": 10}')
+        self.assertEqual(self.oob.encode_msdp("monitor_batch", hp=10),
+                         MSDP_VAR + "monitor_batch" + MSDP_VAL + MSDP_TABLE_OPEN +
+                         MSDP_VAR + "hp" + MSDP_VAL + "10" + MSDP_TABLE_CLOSE)
+
+    @patch("evennia.server.portal.telnet_oob._OOB_BATCH_INTERVAL", 0.1)
+    def test_batch(self, mock_reactor):
+        self.oob.do_gmcp(None)
+        mock_reactor.seconds.return_value = 100.0
+        mock_reactor.callLater.return_value.active.return_value = True
+        self.oob.data_out("monitor", name="hp", value=10, options={})
+        self.oob.data_out("monitor", name="hp", value=8, options={})
+        self.oob.data_out("monitor", name="mp", value=5, options={})
+        # other commands are sent right away
+        self.oob.data_out("get_value", name="hp", value=8)
+        self.assertEqual(self._gmcp_sent(), [("Char.Value.Get", {"name": "hp", "value": 8})])
+        mock_reactor.callLater.assert_called_once_with(0, self.oob.flush_batch)
+        self.oob.flush_batch()
+        self.assertEqual(self._gmcp_sent(), [("Char.Monitor.Batch", {"hp": 8, "mp": 5})])
+        # the next batch is delayed to cap the rate, and unchanged values are dropped
+        mock_reactor.seconds.return_value = 100.04
+        self.oob.data_out("monitor", name="hp", value=8)
+        self.oob.data_out("monitor", name="mv", value=3)
+        self.assertAlmostEqual(mock_reactor.callLater.call_args[0][0], 0.06)
+        mock_reactor.seconds.return_value = 100.1
+        self.oob.flush_batch()
+        self.assertEqual(self._gmcp_sent(), [("Char.Monitor.Batch", {"mv": 3})])
+        self.oob.data_out("monitor", name="hp", value=8)
+        self.oob.flush_batch()
+        self.assertFalse(self.write.called)
+
+    @patch("evennia.server.portal.telnet_oob._OOB_BATCH_INTERVAL", 0.1)
+    def test_batch_msdp(self, mock_reactor):
+        self.oob.do_msdp(None)
+        mock_reactor.seconds.return_value = 100.0
+        self.oob.data_out("monitor", name="hp", value=10)
+        self.oob.data_out("monitor", name="hp", value=8)
+        self.oob.flush_batch()
+        self.write.assert_called_once_with(
+            IAC + SB + MSDP + MSDP_VAR + "monitor_batch" + MSDP_VAL + MSDP_TABLE_OPEN +
+            MSDP_VAR + "hp" + MSDP_VAL + "8" + MSDP_TABLE_CLOSE + IAC + SE)
+
+    def test_no_batch(self, mock_reactor):
+        self.oob.do_gmcp(None)
+        self.oob.data_out("monitor", name="hp", value=10)
+        self.assertEqual(self._gmcp_sent(), [("Char.Monitor.Update", {"name": "hp", "value": 10})])
+        self.assertFalse(mock_reactor.callLater.called)
+
+    @patch("evennia.server.portal.telnet_oob._OOB_BATCH_INTERVAL", 0.1)
+    def test_remonitor(self, mock_reactor):
+        self.oob.do_gmcp(None)
+        mock_reactor.seconds.return_value = 100.0
+        self.oob.data_out("monitor", name="hp", value=10)
+        self.oob.data_out("monitor", name="mp", value=5)
+        self.oob.flush_batch()
+        self._gmcp_sent()
+        # the client monitors hp anew, so it gets the unchanged value again
+        self.oob.decode_gmcp('Core.Monitor {"name": "hp"}')
+        self.protocol.data_in.assert_called_once_with(monitor=[[], {"name": "hp"}])
+        self.oob.data_out("monitor", name="hp", value=10)
+        self.oob.data_out("monitor", name="mp", value=5)
+        self.oob.flush_batch()
+        self.assertEqual(self._gmcp_sent(), [("Char.Monitor.Batch", {"hp": 10})])
+        # same when it stops monitoring (and later starts again)
+        self.oob.decode_gmcp('Core.Unmonitor {"name": "mp"}')
+        self.oob.data_out("monitor", name="mp", value=5)
+        self.oob.flush_batch()
+        self.assertEqual(self._gmcp_sent(), [("Char.Monitor.Batch", {"mp": 5})])
+
+
+@patch("evennia.server.portal.webclient_ajax.reactor")
+class TestAjaxWebClient(TestCase):
+    """
+    Test returning buffered messages to the AJAX webclient.
+    """
+    def setUp(self):
+        self.client = AjaxWebClient()
+        self.request = Mock(args={"csessid": ["csess"], "mode": ["receive"]})
+
+    def test_buffered(self, mock_reactor):
+        self.client.lineSend("csess", ["text", ["One"], {}])
+        self.client.lineSend("csess", ["text", ["Two"], {}])
+        data = self.client.render_POST(self.request)
+        self.assertEqual(json.loads(data), [["text", ["One"], {}], ["text", ["Two"], {}]])
+        self.assertFalse(mock_reactor.callLater.called)
+
+    @patch("evennia.server.portal.webclient_ajax._MAX_ENTRIES", 2)
+    def test_max_entries(self, mock_reactor):
+        for num in range(3):
+            self.client.lineSend("csess", ["text", [num], {}])
+        self.assertEqual(len(json.loads(self.client.render_POST(self.request))), 2)
+        self.assertEqual(json.loads(self.client.render_POST(self.request)), [["text", [2], {}]])
+
+    def test_waiting_request(self, mock_reactor):
+        from twisted.web import server
+        self.assertEqual(self.client.render_POST(self.request), server.NOT_DONE_YET)
+        self.client.lineSend("csess", ["text", ["One"], {}])
+        self.client.lineSend("csess", ["text", ["Two"], {}])
+        # the request is answered once, at the end of the reactor iteration
+        self.assertEqual(mock_reactor.callLater.call_count, 1)
+        self.assertFalse(self.request.write.called)
+        self.client._send_buffered("csess")
+        self.assertEqual(json.loads(self.request.write.call_args[0][0]),
+                         [["text", ["One"], {}], ["text", ["Two"], {}]])
+        self.request.finish.assert_called_once_with()
+        self.assertFalse(self.client.requests)
+
+
 class TestTelnet(TwistedTestCase):
     def setUp(self):
         super(TestTelnet, self).setUp()
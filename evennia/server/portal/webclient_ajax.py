@@ -19,8 +19,10 @@ http://localhost:4001/webclient.)
 import json
 import re
 import time
+from collections import deque
 
 from twisted.web import server, resource
+from twisted.internet import reactor
 from twisted.internet.task import LoopingCall
 from django.utils.functional import Promise
 from django.utils.encoding import force_unicode
@@ -34,6 +36,7 @@ _CLIENT_SESSIONS = utils.mod_import(settings.SESSION_ENGINE).SessionStore
 _RE_SCREENREADER_REGEX = re.compile(r"%s" % settings.SCREENREADER_REGEX_STRIP, re.DOTALL + re.MULTILINE)
 _SERVERNAME = settings.SERVERNAME
 _KEEPALIVE = 30  # how often to check keepalive
+_MAX_ENTRIES = 100  # max number of buffered messages to return per request
 
 # defining a simple json encoder for returning
 # django data to the client. Might need to
@@ -68,6 +71,7 @@ class AjaxWebClient(resource.Resource):
     def __init__(self):
         self.requests = {}
         self.databuffer = {}
+        self.send_tasks = {}
 
         self.last_alive = {}
         self.keep_alive = None
@@ -113,27 +117,56 @@ class AjaxWebClient(resource.Resource):
         """
         pass
 
+    def _get_buffered(self, csessid):
+        """
+        Get buffered data to return to the client.
+
+        Args:
+            csessid (int): Session id.
+
+        Returns:
+            data (str): A JSON array of up to `_MAX_ENTRIES` send structures,
+                oldest first.
+
+        """
+        dataentries = self.databuffer.get(csessid)
+        nentries = min(len(dataentries), _MAX_ENTRIES) if dataentries else 0
+        return "[%s]" % ",".join(dataentries.popleft() for _ in range(nentries))
+
+    def _send_buffered(self, csessid):
+        """
+        Answer a waiting request with the buffered data.
+
+        Args:
+            csessid (int): Session id.
+
+        """
+        self.send_tasks.pop(csessid, None)
+        request = self.requests.pop(csessid, None)
+        if request:
+            request.write(self._get_buffered(csessid))
+            request.finish()
+
     def lineSend(self, csessid, data):
         """
-        This adds the data to the buffer and/or sends it to the client
+        This adds the data to the buffer and sends it to the client
         as soon as possible.
 
         Args:
             csessid (int): Session id.
             data (list): A send structure [cmdname, [args], {kwargs}].
 
+        Notes:
+            If a request is waiting, it's answered at the end of this reactor
+            iteration, so everything sent until then goes out together.
+
         """
-        request = self.requests.get(csessid)
-        if request:
-            # we have a request waiting. Return immediately.
-            request.write(jsonify(data))
-            request.finish()
-            del self.requests[csessid]
-        else:
-            # no waiting request. Store data in buffer
-            dataentries = self.databuffer.get(csessid, [])
-            dataentries.append(jsonify(data))
-            self.databuffer[csessid] = dataentries
+        dataentries = self.databuffer.get(csessid)
+        if dataentries is None:
+            dataentries = self.databuffer[csessid] = deque()
+        dataentries.append(jsonify(data))
+        if csessid in self.requests and csessid not in self.send_tasks:
+            self.send_tasks[csessid] = reactor.callLater(0, self._send_buffered, csessid)
 
     def client_disconnect(self, csessid):
         """
@@ -143,6 +176,8 @@ class AjaxWebClient(resource.Resource):
             csessid (int): Session id.
 
         """
+        if csessid in self.send_tasks:
+            self.send_tasks.pop(csessid).cancel()
         if csessid in self.requests:
             self.requests[csessid].finish()
             del self.requests[csessid]
@@ -218,7 +253,9 @@ class AjaxWebClient(resource.Resource):
         This is called by render_POST when the client is telling us
         that it is ready to receive data as soon as it is available.
         This is the basis of a long-polling (comet) mechanism: the
-        server will wait to reply until data is available.
+        server will wait to reply until data is available. The reply
+        is a JSON array with all data waiting for the client (up to
+        a maximum number of entries).
 
         Args:
             request (Request): Incoming request.
@@ -227,9 +264,8 @@ class AjaxWebClient(resource.Resource):
         csessid = request.args.get('csessid')[0]
         self.last_alive[csessid] = (time.time(), False)
 
-        dataentries = self.databuffer.get(csessid, [])
-        if dataentries:
-            return dataentries.pop(0)
+        if self.databuffer.get(csessid):
+            return self._get_buffered(csessid)
         request.notifyFinish().addErrback(self._responseFailed, csessid, request)
         if csessid in self.requests:
             self.requests[csessid].finish()  # Clear any stale request.
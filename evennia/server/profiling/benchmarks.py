@@ -0,0 +1,455 @@
+"""
+Micro-benchmarks for timing central parts of the server.
+
+These are meant to be run from inside `evennia shell` against a
+(non-production!) game database, for example:
+
+    from evennia.server.profiling import benchmarks
+    benchmarks.bench_spawn(1000)
+
+Every benchmark prints its result and also returns it as a dict, so
+the numbers can be compared between runs.
+
+"""
+from __future__ import print_function
+import time
+
+
+def _timeit(func, *args, **kwargs):
+    """
+    Time one call to a function.
+
+    Returns:
+        result (tuple): A tuple `(seconds, return_value)`.
+
+    """
+    t0 = time.time()
+    ret = func(*args, **kwargs)
+    return time.time() - t0, ret
+
+
+def _report(name, nitems, timings):
+    """
+    Print the result of a benchmark.
+
+    Args:
+        name (str): Name of benchmark.
+        nitems (int): Number of items handled per timing.
+        timings (dict): Mapping of `{label: seconds}`.
+
+    Returns:
+        timings (dict): The given timings.
+
+    """
+    print("** benchmark %s (N=%i)" % (name, nitems))
+    for label, seconds in sorted(timings.items(), key=lambda tup: tup[1]):
+        print("   %-25s %8.4fs (%.4fms/item)" % (label, seconds, 1000.0 * seconds / max(1, nitems)))
+    return timings
+
+
+def bench_spawn(nobjs=100, prototype=None):
+    """
+    Time spawning many copies of the same prototype.
+
+    Args:
+        nobjs (int, optional): Number of objects to spawn per run.
+        prototype (dict, optional): The prototype to spawn. If not given, a
+            prototype with a few attributes and tags will be used.
+
+    Returns:
+        timings (dict): The time in seconds for each run.
+
+    Notes:
+        The spawned objects are deleted after each run.
+
+    """
+    from evennia.objects.models import ObjectDB
+    from evennia.prototypes import spawner
+
+    prototype = prototype or {
+        "prototype_key": "benchmark_spawn",
+        "typeclass": "evennia.objects.objects.DefaultObject",
+        "key": "benchmark object",
+        "aliases": ["bench"],
+        "tags": [("benchmark", "benchmark", None)],
+        "attrs": [("weight", 10, None, "")],
+        "desc": "An object spawned by the benchmark.",
+        "value": "$add(1, 2)"}
+    prototypes = [dict(prototype) for _ in range(nobjs)]
+
+    def _uncached():
+        # compile the prototype anew for every object, as without a plan cache
+        for prot in prototypes:
+            spawner._SPAWN_PLAN_CACHE.clear()
+            spawner.get_spawn_plan(prot, {}).get_objparams()
+
+    def _cached():
+        for prot in prototypes:
+            spawner.get_spawn_plan(prot, {}).get_objparams()
+
+    timings = {}
+    timings["objparams (uncached)"], _ = _timeit(_uncached)
+    timings["objparams (cached)"], _ = _timeit(_cached)
+    for label, kwargs in (("spawn", {}), ("spawn (bulk)", {"bulk": True})):
+        timings[label], objs = _timeit(spawner.spawn, *prototypes, **kwargs)
+        ObjectDB.objects.bulk_delete(objs, hooks=False)
+    return _report("spawn", nobjs, timings)
+
+
+def bench_amp(nmsgs=10000):
+    """
+    Time the AMP round-trip of Portal<->Server messages (packing,
+    compression, unpacking), for small and large payloads. The network
+    itself is not included.
+
+    Args:
+        nmsgs (int, optional): Number of messages to send per run.
+
+    Returns:
+        timings (dict): The time in seconds for each run.
+
+    """
+    import zlib
+    from evennia.server.portal import amp
+
+    small = (1, {"text": [["look"], {"options": {}}]})
+    large = (1, {"text": [["You are in a large room. " * 200], {"options": {"raw": False}}]})
+
+    def _legacy_roundtrip(data):
+        # pickle + max zlib compression, as done before adaptive compression
+        for _ in range(nmsgs):
+            amp.loads(zlib.decompress(zlib.compress(amp.dumps(data), 9)))
+
+    def _roundtrip(data):
+        argument = amp.Compressed()
+        for _ in range(nmsgs):
+            strings, objects = {}, {}
+            argument.toBox("packed_data", strings, {"packed_data": amp.pack_data(data)}, None)
+            argument.fromBox("packed_data", strings, objects, None)
+            amp.unpack_data(objects["packed_data"])
+
+    timings = {}
+    for label, data in (("small", small), ("large", large)):
+        timings["%s (legacy)" % label], _ = _timeit(_legacy_roundtrip, data)
+        timings[label], _ = _timeit(_roundtrip, data)
+    return _report("amp", nmsgs, timings)
+
+
+def bench_senddata(nmsgs=10000):
+    """
+    Time the cleaning of outgoing data done by the sessionhandler
+    before it's sent to the Portal.
+
+    Args:
+        nmsgs (int, optional): Number of messages to clean per run.
+
+    Returns:
+        timings (dict): The time in seconds for each run.
+
+    """
+    from mock import Mock
+    from evennia.server.sessionhandler import ServerSessionHandler
+
+    handler = ServerSessionHandler()
+    sessions = [Mock(protocol_flags={"ENCODING": "utf-8"}) for _ in range(10)]
+    text = "|gA goblin|n attacks you with a rusty dagger! " * 4
+
+    def _clean(kwargs, unique=False):
+        for num in range(nmsgs):
+            msg = dict(kwargs)
+            if unique:
+                msg["text"] = "%s %i" % (msg["text"], num)
+            handler.clean_senddata(sessions[num % 10], msg)
+
+    timings = {}
+    timings["text (unique)"], _ = _timeit(_clean, {"text": text}, unique=True)
+    timings["text (broadcast)"], _ = _timeit(_clean, {"text": text})
+    timings["text+kwargs"], _ = _timeit(_clean, {"text": (text, {"type": "say"}), "prompt": ">"})
+    return _report("senddata", nmsgs, timings)
+
+
+def bench_ansi(nmsgs=10000):
+    """
+    Time the parsing of color markup in a room description, with the
+    single-pass tokenizer and with the older multi-pass regexes. The
+    parse cache is not used.
+
+    Args:
+        nmsgs (int, optional): Number of times to parse the text per run.
+
+    Returns:
+        timings (dict): The time in seconds for each run.
+
+    """
+    from evennia.utils.ansi import ANSI_PARSER as parser
+
+    text = ("|cThe Old Tavern|n\n"
+            "A smoky, low-ceilinged room. The |yfire|n crackles in the |500hearth|n, "
+            "casting |=mlong shadows|n over the |gworn tables|n and the |[x|wdartboard|n.\n"
+            "|wExits:|n |lcnorth|ltnorth|le, |lcsouth|ltsouth|le\n"
+            "|wYou see:|n |ba barkeep|n, |Ra rusty sword|n and |[=b|=w50 gold coins|n.")
+
+    def _multipass(xterm256, strip):
+        for _ in range(nmsgs):
+            parsed = parser.strip_mxp(parser.sub_markup_multipass(text, xterm256))
+            if strip:
+                parser.strip_raw_codes(parsed)
+
+    def _single_pass(xterm256, strip):
+        for _ in range(nmsgs):
+            parsed = parser.sub_markup(text, xterm256, strip)
+            if "|lc" in parsed:
+                parser.strip_mxp(parsed)
+
+    timings = {}
+    for label, xterm256, strip in (("16-color", False, False), ("xterm256", True, False),
+                                   ("stripped", False, True)):
+        timings["%s (multipass)" % label], _ = _timeit(_multipass, xterm256, strip)
+        timings[label], _ = _timeit(_single_pass, xterm256, strip)
+    return _report("ansi", nmsgs, timings)
+
+
+def bench_evtable(nrows=100):
+    """
+    Time rendering an EvTable of colored text, and measure the memory
+    used by the index maps of the ANSIStrings still alive afterwards.
+
+    Args:
+        nrows (int, optional): Number of rows in the table.
+
+    Returns:
+        timings (dict): The time in seconds for each run.
+
+    """
+    import gc
+    import sys
+    from evennia.utils import evtable
+    from evennia.utils.ansi import ANSIString
+
+    columns = [["|gItem %i|n" % num for num in range(nrows)],
+               ["|y%i|n gold" % (num * 7) for num in range(nrows)],
+               ["|wA |rvery|w long description of item %i, wrapping around|n" % num
+                for num in range(nrows)]]
+
+    def _render():
+        table = evtable.EvTable("|wName|n", "|wCost|n", "|wDescription|n",
+                                table=[list(column) for column in columns],
+                                width=78, border="cells")
+        return table, unicode(table)
+
+    timings = {}
+    timings["render"], (table, _) = _timeit(_render)
+    timings["render again"], _ = _timeit(unicode, table)
+
+    gc.collect()
+    nstrings, nmaps, nbytes, nbytes_lists = 0, 0, 0, 0
+    for obj in gc.get_objects():
+        if isinstance(obj, ANSIString):
+            nstrings += 1
+            if obj._indexes is not None:
+                nmaps += 1
+                nbytes += sum(sys.getsizeof(indexes) for indexes in obj._indexes)
+            # what eagerly built lists of ints would have used (a list
+            # also holds an int object per index above 256)
+            for indexes in obj._get_indexes():
+                nbytes_lists += (sys.getsizeof(list(indexes)) +
+                                 sys.getsizeof(0) * sum(1 for index in indexes if index > 256))
+    print("   %i ANSIStrings alive, %i with index maps using %i bytes "
+          "(%i bytes as eager lists)" % (nstrings, nmaps, nbytes, nbytes_lists))
+    return _report("evtable", nrows, timings)
+
+
+def bench_html(nmsgs=10000):
+    """
+    Time the conversion of a room description to html for the
+    webclient, with the single-pass ANSI conversion, with the older
+    regex passes and through the parse cache of `parse_html`.
+
+    Args:
+        nmsgs (int, optional): Number of times to convert the text per run.
+
+    Returns:
+        timings (dict): The time in seconds for each run.
+
+    """
+    from evennia.utils import ansi, text2html
+
+    parser = text2html.HTML_PARSER
+    text = ansi.parse_ansi(
+        "|cThe Old Tavern|n\n"
+        "A smoky, low-ceilinged room. The |yfire|n crackles in the |500hearth|n, "
+        "casting |=mlong shadows|n over the |gworn tables|n and the |[x|wdartboard|n.\n"
+        "|wExits:|n |lcnorth|ltnorth|le, |lcsouth|ltsouth|le\n"
+        "|wYou see:|n |ba barkeep|n, |Ra rusty sword|n and |[=b|=w50 gold coins|n.",
+        xterm256=True, mxp=True)
+
+    def _convert(convert_ansi):
+        for _ in range(nmsgs):
+            result = parser.re_string.sub(parser.sub_text, text)
+            result = parser.re_mxplink.sub(parser.sub_mxp_links, result)
+            result = convert_ansi(result)
+            result = parser.remove_bells(result)
+            result = parser.convert_linebreaks(result)
+            result = parser.remove_backspaces(result)
+            parser.convert_urls(result)
+
+    def _cached():
+        for _ in range(nmsgs):
+            text2html.parse_html(text)
+
+    timings = {}
+    timings["html (multipass)"], _ = _timeit(_convert, parser.convert_ansi_multipass)
+    timings["html"], _ = _timeit(_convert, parser.convert_ansi)
+    timings["html (cached)"], _ = _timeit(_cached)
+    return _report("html", nmsgs, timings)
+
+
+def bench_inlinefunc(nmsgs=10000):
+    """
+    Time parsing inlinefuncs in a text sent to many sessions, with and
+    without the cache of compiled templates.
+
+    Args:
+        nmsgs (int, optional): Number of times to parse the text per run.
+
+    Returns:
+        timings (dict): The time in seconds for each run.
+
+    """
+    from evennia.utils import inlinefuncs
+
+    text = ("$pad(|wThe Old Tavern|n, 60, c, -)\n"
+            "Prices: $pad(ale, 20, l, .)$pad(2 coins, 10, r, .) "
+            "$pad(stew, 20, l, .)$pad(5 coins, 10, r, .)\n"
+            "$crop(A note nailed to the wall is too faded to read in full, 30)")
+    plain = "A smoky, low-ceilinged room. The fire crackles in the hearth."
+
+    def _parse(string, uncached=False):
+        for _ in range(nmsgs):
+            if uncached:
+                inlinefuncs._PARSING_CACHE.clear()
+            inlinefuncs.parse_inlinefunc(string, session=None)
+
+    timings = {}
+    timings["funcs (uncached)"], _ = _timeit(_parse, text, uncached=True)
+    timings["funcs"], _ = _timeit(_parse, text)
+    timings["no funcs"], _ = _timeit(_parse, plain)
+    return _report("inlinefunc", nmsgs, timings)
+
+
+def bench_attributes(nattrs=1000):
+    """
+    Time writing many Attributes to an object, and saving the object
+    itself, while another object is being monitored. The last timing
+    leaves out the database write, leaving the post-save hooks.
+
+    Args:
+        nattrs (int, optional): Number of Attributes to write per run.
+
+    Returns:
+        timings (dict): The time in seconds for each run.
+
+    Notes:
+        The objects are deleted afterwards.
+
+    """
+    from mock import patch
+    from evennia.utils import create
+    from evennia.scripts.monitorhandler import MONITOR_HANDLER
+
+    def _callback(**kwargs):
+        pass
+
+    obj = create.create_object("evennia.objects.objects.DefaultObject", key="benchmark")
+    watched = create.create_object("evennia.objects.objects.DefaultObject", key="watched")
+    MONITOR_HANDLER.add(watched, "db_key", _callback, idstring="benchmark")
+
+    def _write(value):
+        for num in range(nattrs):
+            obj.attributes.add("attr%i" % num, value)
+
+    def _save():
+        for _ in range(nattrs):
+            obj.save()
+
+    def _save_nodb():
+        # only what is done after the database write
+        with patch("django.db.models.Model.save"):
+            _save()
+
+    timings = {}
+    try:
+        timings["attributes (create)"], _ = _timeit(_write, 1)
+        timings["attributes (update)"], _ = _timeit(_write, 2)
+        timings["object save"], _ = _timeit(_save)
+        timings["object save (no db)"], _ = _timeit(_save_nodb)
+    finally:
+        MONITOR_HANDLER.remove(watched, "db_key", idstring="benchmark")
+        obj.delete()
+        watched.delete()
+    return _report("attributes", nattrs, timings)
+
+
+def bench_script_timers(ntasks=10000, seconds=300):
+    """
+    Time the timers of many Scripts over some game time, with a
+    reactor timer per Script and on the shared timer wheel. Half of the
+    timers are paused and restarted midway. Time is simulated on a
+    separate reactor, stepped every 0.1s, so nothing is waited for and
+    the Scripts' own work is left out.
+
+    Args:
+        ntasks (int, optional): Number of Script timers.
+        seconds (int, optional): Game time to simulate, in seconds.
+
+    Returns:
+        timings (dict): The time in seconds for each run.
+
+    """
+    import random
+    from twisted.internet.selectreactor import SelectReactor
+    from evennia.scripts.scripts import ExtendedLoopingCall
+    from evennia.scripts.timerwheel import TimerWheel, WheelTask
+
+    def _callback():
+        pass
+
+    def _looping_call(clock):
+        task = ExtendedLoopingCall(_callback)
+        task.clock = clock
+        return task
+
+    def _wheel_task(clock, wheels={}):
+        if clock not in wheels:
+            wheels[clock] = TimerWheel(0.1, clock)
+        task = WheelTask(_callback)
+        task.wheel, task.clock = wheels[clock], clock
+        return task
+
+    def _run(new_task):
+        clock = SelectReactor()
+        now = [0.0]
+        clock.seconds = lambda: now[0]
+        rand = random.Random(0)
+        tasks = [new_task(clock) for _ in range(ntasks)]
+        for task in tasks:
+            task.start(rand.randint(5, 60), now=False)
+        for step in range(seconds * 10):
+            now[0] = step / 10.0
+            clock.runUntilCurrent()
+            if step == seconds * 5:
+                for task in tasks[::2]:
+                    # pause and unpause, as a Script does
+                    delay, callcount = task.next_call_time(), task.callcount
+                    task.stop()
+                    task.start(task.interval, now=False, start_delay=delay, count_start=callcount)
+        ncalls = sum(task.callcount for task in tasks)
+        for task in tasks:
+            task.stop()
+        return ncalls
+
+    timings = {}
+    timings["reactor timer per script"], ncalls = _timeit(_run, _looping_call)
+    timings["timer wheel"], ncalls_wheel = _timeit(_run, _wheel_task)
+    print("   %i timer calls (%i on the timer wheel)" % (ncalls, ncalls_wheel))
+    return _report("script_timers", ntasks, timings)
@@ -137,8 +137,7 @@ def _server_maintenance():
     # handle idle timeouts
     if _IDLE_TIMEOUT > 0:
         reason = _("idle timeout exceeded")
-        for session in (sess for sess in SESSIONS.values()
-                        if (now - sess.cmd_last) > _IDLE_TIMEOUT):
+        for session in SESSIONS.get_idle_sessions(_IDLE_TIMEOUT):
             if not session.account or not \
                     session.account.access(session.account, "noidletimeout", default=False):
                 SESSIONS.disconnect(session, reason=reason)
@@ -427,24 +426,21 @@ class Evennia(object):
         if SERVER_STARTSTOP_MODULE:
             SERVER_STARTSTOP_MODULE.at_server_reload_start()
 
-    def at_post_portal_sync(self, mode):
+    def at_pre_portal_sync(self, mode):
         """
-        This is called just after the portal has finished syncing back data to the server
-        after reconnecting.
+        This is called when the portal starts syncing back data to the server
+        after reconnecting, before any session is synced. Since the sessions
+        may be synced in several chunks, each going live as soon as it is
+        done, everything not depending on the sessions is restored here.
 
         Args:
             mode (str): One of reload, reset or shutdown.
 
         """
-
-        from evennia.scripts.monitorhandler import MONITOR_HANDLER
-        MONITOR_HANDLER.restore(mode == 'reload')
-
         from evennia.scripts.tickerhandler import TICKER_HANDLER
         TICKER_HANDLER.restore(mode == 'reload')
 
-        # after sync is complete we force-validate all scripts
-        # (this also starts any that didn't yet start)
+        # force-validate all scripts (this also starts any that didn't yet start)
         ScriptDB.objects.validate(init_mode=mode)
 
         # start the task handler
@@ -452,6 +448,19 @@ class Evennia(object):
         TASK_HANDLER.load()
         TASK_HANDLER.create_delays()
 
+    def at_post_portal_sync(self, mode):
+        """
+        This is called just after the portal has finished syncing back data to the server
+        after reconnecting.
+
+        Args:
+            mode (str): One of reload, reset or shutdown.
+
+        """
+        # monitors may refer to the synced sessions
+        from evennia.scripts.monitorhandler import MONITOR_HANDLER
+        MONITOR_HANDLER.restore(mode == 'reload')
+
         # delete the temporary setting
         ServerConfig.objects.conf("server_restart_mode", delete=True)
 
@@ -523,16 +532,21 @@ if AMP_ENABLED:
     # the portal and the mud server. Only reason to ever deactivate
     # it would be during testing and debugging.
 
-    ifacestr = ""
-    if AMP_INTERFACE != '127.0.0.1':
-        ifacestr = "-%s" % AMP_INTERFACE
-
-    INFO_DICT["amp"] = 'amp %s: %s' % (ifacestr, AMP_PORT)
-
     from evennia.server import amp_client
+    from evennia.server.portal.amp import get_amp_socket_file
 
     factory = amp_client.AMPClientFactory(EVENNIA)
-    amp_service = internet.TCPClient(AMP_HOST, AMP_PORT, factory)
+    amp_socket_file = get_amp_socket_file()
+    if amp_socket_file:
+        INFO_DICT["amp"] = 'amp: %s' % amp_socket_file
+        amp_service = internet.UNIXClient(amp_socket_file, factory)
+    else:
+        ifacestr = ""
+        if AMP_INTERFACE != '127.0.0.1':
+            ifacestr = "-%s" % AMP_INTERFACE
+
+        INFO_DICT["amp"] = 'amp %s: %s' % (ifacestr, AMP_PORT)
+        amp_service = internet.TCPClient(AMP_HOST, AMP_PORT, factory)
     amp_service.setName('ServerAMPClient')
     EVENNIA.services.addService(amp_service)
 
@@ -427,9 +427,10 @@ class ServerSession(Session):
             change operating paramaters for commands at run-time.
 
         """
-        # inject instruction into input stream
+        # inject instruction into input stream (bypassing the
+        # sessionhandler's queue for input from the Portal)
         kwargs["text"] = ((raw_string,), {})
-        self.sessionhandler.data_in(session or self, **kwargs)
+        (session or self).data_in(**kwargs)
 
     def __eq__(self, other):
         """Handle session comparisons"""
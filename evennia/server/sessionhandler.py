@@ -12,13 +12,17 @@ There are two similar but separate stores of sessions:
          handle network communication but holds no game info.
 
 """
+import re
 import time
+import heapq
+from collections import defaultdict, deque
 from builtins import object
 from future.utils import listvalues
 
 from django.conf import settings
+from twisted.internet import reactor
 from evennia.commands.cmdhandler import CMD_LOGINSTART
-from evennia.utils.logger import log_trace
+from evennia.utils.logger import log_trace, log_info
 from evennia.utils.utils import (variable_from_module, is_iter,
                                  to_str, to_unicode,
                                  make_iter, delay,
@@ -31,6 +35,14 @@ except ImportError:
     import pickle
 
 _INLINEFUNC_ENABLED = settings.INLINEFUNC_ENABLED
+_COMMAND_OUTPUT_BUFFERING = settings.COMMAND_OUTPUT_BUFFERING
+
+# outgoing strings already encoded this reactor iteration, {(string, encoding): str}
+_ENCODED_CACHE = {}
+_ENCODED_CACHE_MAXSIZE = 2000
+_BASE_STRING_TYPES = (str, unicode)
+# a text ending with an (unescaped) color reset
+_RE_ENDS_COLOR = re.compile(r"(?:^|[^|])(?:\|\|)*\|n$")
 
 # delayed imports
 _AccountDB = None
@@ -64,6 +76,7 @@ PSHUTD = chr(16)       # portal (+server) shutdown
 SSHUTD = chr(17)       # server shutdown
 PSTATUS = chr(18)      # ping server or portal status
 SRESET = chr(19)       # server shutdown in reset mode
+PSYNCCHUNK = chr(20)   # portal session sync, continued
 
 # i18n
 from django.utils.translation import ugettext as _
@@ -74,6 +87,9 @@ _IDLE_TIMEOUT = settings.IDLE_TIMEOUT
 _DELAY_CMD_LOGINSTART = settings.DELAY_CMD_LOGINSTART
 _MAX_SERVER_COMMANDS_PER_SECOND = 100.0
 _MAX_SESSION_COMMANDS_PER_SECOND = 5.0
+_INPUT_QUEUE_MAXSIZE = settings.INPUT_QUEUE_MAXSIZE
+_INPUT_QUEUE_TICK_BUDGET = settings.INPUT_QUEUE_TICK_BUDGET
+_ERROR_INPUT_OVERFLOW = settings.COMMAND_RATE_WARNING
 _MODEL_MAP = None
 
 # input handlers
@@ -106,6 +122,113 @@ def delayed_import():
     assert(_ScriptDB)
 
 
+def _encode_senddata(string, session):
+    """
+    Encode a string to the encoding used by a session, as a plain
+    bytestring. The result is cached for the rest of the current
+    reactor iteration, so that the same message going out to many
+    sessions (like a channel broadcast) is only encoded once.
+
+    Args:
+        string (str or unicode): The string to encode.
+        session (Session): The session to send to.
+
+    Returns:
+        encoded (str): The encoded string.
+
+    """
+    encoding = session.protocol_flags["ENCODING"]
+    cacheable = type(string) in _BASE_STRING_TYPES
+    if cacheable:
+        try:
+            return _ENCODED_CACHE[(string, encoding)]
+        except KeyError:
+            pass
+    try:
+        encoded = string and to_str(to_unicode(string), encoding=encoding)
+    except LookupError:
+        # wrong encoding set on the session. Set it to a safe one
+        encoding = session.protocol_flags["ENCODING"] = "utf-8"
+        encoded = to_str(to_unicode(string), encoding=encoding)
+    # At this point the object is certainly the right encoding, but may still be a unicode object--
+    # to_str does not actually force objects to become bytestrings.
+    # If the unicode object is a subclass of unicode, such as ANSIString, this can cause a problem,
+    # as special behavior for that class will still be in play. Since we're now transferring raw data,
+    # we must now force this to be a proper bytestring.
+    encoded = str(encoded)
+    if cacheable:
+        if not _ENCODED_CACHE:
+            # first entry this reactor iteration; empty the cache at the next one
+            reactor.callLater(0, _ENCODED_CACHE.clear)
+        elif len(_ENCODED_CACHE) >= _ENCODED_CACHE_MAXSIZE:
+            _ENCODED_CACHE.clear()
+        _ENCODED_CACHE[(string, encoding)] = encoded
+    return encoded
+
+
+def _merge_output(outputs):
+    """
+    Merge the output buffered for a session while a command ran, to send
+    as few messages as possible.
+
+    Args:
+        outputs (list): Cleaned outputs, each a dict `{cmdname: [[args], {kwargs}]}`,
+            in the order they were sent.
+
+    Returns:
+        merged (list): The outputs to send, in order. Consecutive texts sent
+            with the same options are joined into one text, consecutive
+            outputs without text are bundled together as long as no command
+            repeats, and only the last prompt is kept, sent after everything
+            else.
+
+    Notes:
+        A text is only joined to the one before it if that one has no
+        color markup or ends with `|n` - otherwise its color would bleed
+        into the next text. Outputs with text are never bundled with other
+        outputs, since the commands in a bundle are not sent in any
+        particular order.
+
+    """
+    merged = []
+    bundle = {}
+    prompt = None
+    # the text sent last, if the last output was only a text
+    last_text = None
+    for output in outputs:
+        output = dict(output)
+        if "prompt" in output:
+            prompt = {"prompt": output.pop("prompt")}
+            if not output:
+                continue
+        if last_text is not None and len(output) == 1 and "text" in output:
+            text_args, text_kwargs = bundle["text"]
+            args, kwargs = output["text"]
+            if (len(args) == 1 and text_kwargs == kwargs and
+                    (kwargs.get("options", {}).get("raw", False) or
+                     "|" not in last_text and "\x1b" not in last_text or
+                     _RE_ENDS_COLOR.search(last_text))):
+                last_text = args[0]
+                text_args[0] += "\n" + last_text
+                continue
+        if bundle and ("text" in bundle or "text" in output or
+                       any(cmdname in bundle for cmdname in output)):
+            merged.append(bundle)
+            bundle = {}
+        for cmdname, (args, kwargs) in output.items():
+            bundle[cmdname] = [list(args), kwargs]
+        last_text = None
+        if len(output) == 1 and "text" in output:
+            args = output["text"][0]
+            if len(args) == 1:
+                last_text = args[0]
+    if bundle:
+        merged.append(bundle)
+    if prompt:
+        merged.append(prompt)
+    return merged
+
+
 #-----------------------------------------------------------
 # SessionHandler base class
 #------------------------------------------------------------
@@ -189,8 +312,26 @@ class SessionHandler(dict):
 
         """
         options = kwargs.pop("options", None) or {}
-        raw = options.get("raw", False)
         strip_inlinefunc = options.get("strip_inlinefunc", False)
+        # only parse inlinefuncs on the outgoing path (sessionhandler->)
+        inlinefuncs = (_INLINEFUNC_ENABLED and not options.get("raw", False) and
+                       isinstance(self, ServerSessionHandler))
+
+        def _clean_string(data):
+            "Helper function to encode a string and apply inlinefuncs"
+            data = _encode_senddata(data, session)
+            if inlinefuncs and "$" in data:
+                data = str(parse_inlinefunc(data, strip=strip_inlinefunc, session=session))
+            return data
+
+        if len(kwargs) == 1 and "text" in kwargs:
+            # fast path for the most common case, text=str or text=(str, {})
+            text = kwargs["text"]
+            if type(text) in (tuple, list) and len(text) == 2 and type(text[1]) is dict \
+                    and not text[1]:
+                text = text[0]
+            if text and type(text) in _BASE_STRING_TYPES:
+                return {"text": [[_clean_string(text)], {"options": options}]}
 
         def _validate(data):
             "Helper function to convert data to AMP-safe (picketable) values"
@@ -203,21 +344,7 @@ class SessionHandler(dict):
                 return [_validate(part) for part in data]
             elif isinstance(data, basestring):
                 # make sure strings are in a valid encoding
-                try:
-                    data = data and to_str(to_unicode(data), encoding=session.protocol_flags["ENCODING"])
-                except LookupError:
-                    # wrong encoding set on the session. Set it to a safe one
-                    session.protocol_flags["ENCODING"] = "utf-8"
-                    data = to_str(to_unicode(data), encoding=session.protocol_flags["ENCODING"])
-                if _INLINEFUNC_ENABLED and not raw and isinstance(self, ServerSessionHandler):
-                    # only parse inlinefuncs on the outgoing path (sessionhandler->)
-                    data = parse_inlinefunc(data, strip=strip_inlinefunc, session=session)
-                # At this point the object is certainly the right encoding, but may still be a unicode object--
-                # to_str does not actually force objects to become bytestrings.
-                # If the unicode object is a subclass of unicode, such as ANSIString, this can cause a problem,
-                # as special behavior for that class will still be in play. Since we're now transferring raw data,
-                # we must now force this to be a proper bytestring.
-                return str(data)
+                return _clean_string(data)
             elif hasattr(data, "id") and hasattr(data, "db_date_created") \
                     and hasattr(data, '__dbclass__'):
                 # convert database-object to their string representation.
@@ -280,6 +407,94 @@ class ServerSessionHandler(SessionHandler):
         super(ServerSessionHandler, self).__init__(*args, **kwargs)
         self.server = None  # set at server initialization
         self.server_data = {"servername": _SERVERNAME}
+        # output collected while commands run, {sessid: [nesting, [output, ...]]}
+        self.output_buffers = {}
+        # lookup indexes, each on the form {key: {sessid: session}}
+        self._account_index = defaultdict(dict)
+        self._puppet_index = defaultdict(dict)
+        self._csessid_index = defaultdict(dict)
+        # the keys each session is indexed under, {sessid: (uid, puid, csessid)}
+        self._index_keys = {}
+        # min-heap of (cmd_last, sessid) for finding idle sessions. Entries
+        # may be outdated, they are updated when they reach the top.
+        self._idle_heap = []
+        self._idle_sessids = set()
+        # queued input, {sessid: deque([(time, kwargs), ...])}, and the order
+        # to handle the sessions with queued input in
+        self.input_queues = {}
+        self.input_order = deque()
+        self.input_task = None
+        # how long the latest handled input waited in the queue, {sessid: seconds}
+        self.input_waits = {}
+        # timings of the latest portal sync
+        self.sync_stats = {}
+        self._await_first_command = False
+
+    def __setitem__(self, key, value):
+        "Index sessions as they are added"
+        super(ServerSessionHandler, self).__setitem__(key, value)
+        if key is not None:
+            self._index_session(key, value)
+            if key not in self._idle_sessids:
+                self._idle_sessids.add(key)
+                heapq.heappush(self._idle_heap, (value.cmd_last, key))
+
+    def __delitem__(self, key):
+        "Remove sessions from index"
+        super(ServerSessionHandler, self).__delitem__(key)
+        self._unindex_session(key)
+
+    def _unindex_session(self, sessid):
+        """
+        Remove a session from the lookup indexes.
+
+        Args:
+            sessid (int): The id of the session to remove.
+
+        """
+        keys = self._index_keys.pop(sessid, None)
+        if keys:
+            for index, key in zip((self._account_index, self._puppet_index,
+                                   self._csessid_index), keys):
+                if key is not None:
+                    sessions = index.get(key)
+                    if sessions:
+                        sessions.pop(sessid, None)
+                        if not sessions:
+                            del index[key]
+
+    def update_session_index(self, session):
+        """
+        Update the lookup indexes for a session. This must be called
+        whenever the session's account, puppet or csessid changes.
+
+        Args:
+            session (Session): The session to (re-)index.
+
+        """
+        sessid = session.sessid
+        if dict.get(self, sessid) is session:
+            # only index sessions actually stored in the handler
+            self._index_session(sessid, session)
+
+    def _index_session(self, sessid, session):
+        """
+        Add a session to the lookup indexes.
+
+        Args:
+            sessid (int): The id the session is stored under.
+            session (Session): The session to index.
+
+        """
+        self._unindex_session(sessid)
+        keys = (session.uid if session.logged_in and session.uid else None,
+                session.puid or None,
+                session.csessid or None)
+        for index, key in zip((self._account_index, self._puppet_index,
+                               self._csessid_index), keys):
+            if key is not None:
+                index[key][sessid] = session
+        self._index_keys[sessid] = keys
 
     def _run_cmd_login(self, session):
         """
@@ -288,7 +503,7 @@ class ServerSessionHandler(SessionHandler):
 
         """
         if not session.logged_in:
-            self.data_in(session, text=[[CMD_LOGINSTART], {}])
+            session.data_in(text=[[CMD_LOGINSTART], {}])
 
     def portal_connect(self, portalsessiondata):
         """
@@ -324,6 +539,7 @@ class ServerSessionHandler(SessionHandler):
             else:
                 sess.logged_in = False
                 sess.uid = None
+                self.update_session_index(sess)
 
         # show the first login command, may delay slightly to allow
         # the handshakes to finish.
@@ -349,26 +565,42 @@ class ServerSessionHandler(SessionHandler):
             # ones which should only be changed from portal (like
             # protocol_flags etc)
             session.load_sync_data(portalsessiondata)
+            self.update_session_index(session)
 
-    def portal_sessions_sync(self, portalsessionsdata):
+    def portal_sessions_sync(self, portalsessionsdata, first=True, last=True, stop_time=None):
         """
         Syncing all session ids of the portal with the ones of the
         server. This is instantiated by the portal when reconnecting.
+        The Portal may send the sessions in several chunks, each session
+        is made active as soon as its chunk has been processed. The
+        server's `at_pre_portal_sync` hook is called before the first
+        chunk and `at_post_portal_sync` after the last one.
 
         Args:
             portalsessionsdata (dict): A dictionary
               `{sessid: {property:value},...}` defining each session and
               the properties in it which should be synced.
+            first (bool, optional): If this is the first chunk of the sync.
+            last (bool, optional): If this is the last chunk of the sync.
+            stop_time (float, optional): When the Server was stopped. Only
+                given with the first chunk.
 
         """
         delayed_import()
         global _ServerSession, _AccountDB, _ServerConfig, _ScriptDB
 
-        for sess in self.values():
-            # we delete the old session to make sure to catch eventual
-            # lingering references.
-            del sess
-
+        now = time.time()
+        if first:
+            for sess in self.values():
+                # we delete the old session to make sure to catch eventual
+                # lingering references.
+                del sess
+            self.sync_stats = {"stop_time": stop_time, "start": now, "end": None,
+                               "chunks": 0, "sessions": 0, "first_command": None}
+            # restore what the sessions may use before any of them goes live
+            self.server.at_pre_portal_sync('reload')
+
+        message = _(" ... Server restarted.")
         for sessid, sessdict in portalsessionsdata.items():
             sess = _ServerSession()
             sess.sessionhandler = self
@@ -377,13 +609,27 @@ class ServerSessionHandler(SessionHandler):
                 sess.account = _AccountDB.objects.get_account_from_uid(sess.uid)
             self[sessid] = sess
             sess.at_sync()
-
-        mode = 'reload'
-
-        # tell the server hook we synced
-        self.server.at_post_portal_sync(mode)
-        # announce the reconnection
-        self.announce_all(_(" ... Server restarted."))
+            self.update_session_index(sess)
+            # announce the reconnection
+            self.data_out(sess, text=message)
+        self.sync_stats["chunks"] = self.sync_stats.get("chunks", 0) + 1
+        self.sync_stats["sessions"] = self.sync_stats.get("sessions", 0) + len(portalsessionsdata)
+
+        if last:
+            mode = 'reload'
+
+            # tell the server hook we synced
+            self.server.at_post_portal_sync(mode)
+
+            stats = self.sync_stats
+            stats["end"] = time.time()
+            self._await_first_command = True
+            string = "Synced %i sessions from Portal in %i chunk(s) (%.3fs" % (
+                stats.get("sessions", 0), stats.get("chunks", 0),
+                stats["end"] - stats.get("start", now))
+            if stats.get("stop_time"):
+                string += ", %.3fs after Server stop" % (stats["end"] - stats["stop_time"])
+            log_info(string + ").")
 
     def portal_disconnect(self, session):
         """
@@ -506,6 +752,7 @@ class ServerSessionHandler(SessionHandler):
         string = string.format(account=account, address=session.address, nsessions=nsess)
         session.log(string)
         session.logged_in = True
+        self.update_session_index(session)
         # sync the portal to the session
         if not testmode:
             self.server.amp_protocol.send_AdminServer2Portal(session,
@@ -543,6 +790,13 @@ class ServerSessionHandler(SessionHandler):
         sessid = session.sessid
         if sessid in self and not hasattr(self, "_disconnect_all"):
             del self[sessid]
+        if sync_portal:
+            # make sure any waiting output reaches the session before it's closed
+            self.flush_output(session, force=True)
+        else:
+            self.output_buffers.pop(sessid, None)
+        self.input_queues.pop(sessid, None)
+        self.input_waits.pop(sessid, None)
         if sync_portal:
             # inform portal that session should be closed.
             self.server.amp_protocol.send_AdminServer2Portal(session,
@@ -616,7 +870,7 @@ class ServerSessionHandler(SessionHandler):
         # we can't compare sessions directly since this will compare addresses and
         # mean connecting from the same host would not catch duplicates
         sid = id(curr_session)
-        doublet_sessions = [sess for sess in self.values()
+        doublet_sessions = [sess for sess in self._account_index.get(uid, {}).values()
                             if sess.logged_in and
                             sess.uid == uid and
                             id(sess) != sid]
@@ -630,12 +884,45 @@ class ServerSessionHandler(SessionHandler):
         see if any are dead or idle.
 
         """
-        tcurr = time.time()
+        if _IDLE_TIMEOUT <= 0:
+            return
         reason = _("Idle timeout exceeded, disconnecting.")
-        for session in (session for session in self.values()
-                        if session.logged_in and _IDLE_TIMEOUT > 0 and
-                        (tcurr - session.cmd_last) > _IDLE_TIMEOUT):
-            self.disconnect(session, reason=reason)
+        for session in self.get_idle_sessions(_IDLE_TIMEOUT):
+            if session.logged_in:
+                self.disconnect(session, reason=reason)
+
+    def get_idle_sessions(self, idle_timeout):
+        """
+        Get all sessions that have not entered a command for a while.
+
+        Args:
+            idle_timeout (int): The idle time, in seconds.
+
+        Returns:
+            sessions (list): The sessions idle for longer than `idle_timeout`,
+                the longest idle first.
+
+        Notes:
+            This only looks at the sessions that may have become idle, not at all
+            sessions.
+
+        """
+        tlimit = time.time() - idle_timeout
+        heap = self._idle_heap
+        idle, active = [], []
+        while heap and heap[0][0] < tlimit:
+            cmd_last, sessid = heapq.heappop(heap)
+            session = dict.get(self, sessid)
+            if not session:
+                # gone since it was added
+                self._idle_sessids.discard(sessid)
+                continue
+            if session.cmd_last < tlimit:
+                idle.append(session)
+            active.append((session.cmd_last, sessid))
+        for entry in active:
+            heapq.heappush(heap, entry)
+        return idle
 
     def account_count(self):
         """
@@ -647,7 +934,7 @@ class ServerSessionHandler(SessionHandler):
             naccount (int): Number of connected accounts
 
         """
-        return len(set(session.uid for session in self.values() if session.logged_in))
+        return len(self._account_index)
 
     def all_connected_accounts(self):
         """
@@ -658,7 +945,8 @@ class ServerSessionHandler(SessionHandler):
                 amount of Sessions due to multi-playing).
 
         """
-        return list(set(session.account for session in self.values() if session.logged_in and session.account))
+        return list(set(session.account for sessions in self._account_index.values()
+                        for session in sessions.values() if session.logged_in and session.account))
 
     def session_from_sessid(self, sessid):
         """
@@ -704,8 +992,10 @@ class ServerSessionHandler(SessionHandler):
             sessions (list): All Sessions associated with this account.
 
         """
-        uid = account.uid
-        return [session for session in self.values() if session.logged_in and session.uid == uid]
+        sessions = self._account_index.get(account.uid)
+        if not sessions:
+            return []
+        return [session for _, session in sorted(sessions.items()) if session.logged_in]
 
     def sessions_from_puppet(self, puppet):
         """
@@ -719,7 +1009,8 @@ class ServerSessionHandler(SessionHandler):
                 more than one Session (MULTISESSION_MODE > 1).
 
         """
-        sessions = puppet.sessid.get()
+        sessions = self._puppet_index.get(puppet.id)
+        sessions = [session for _, session in sorted(sessions.items())] if sessions else []
         return sessions[0] if len(sessions) == 1 else sessions
     sessions_from_character = sessions_from_puppet
 
@@ -732,8 +1023,8 @@ class ServerSessionHandler(SessionHandler):
             csessid (str): The session hash
 
         """
-        return [session for session in self.values()
-                if session.csessid and session.csessid == csessid]
+        sessions = self._csessid_index.get(csessid)
+        return [session for _, session in sorted(sessions.items())] if sessions else []
 
     def announce_all(self, message):
         """
@@ -761,10 +1052,57 @@ class ServerSessionHandler(SessionHandler):
         # clean output for sending
         kwargs = self.clean_senddata(session, kwargs)
 
+        output_buffer = self.output_buffers.get(session.sessid)
+        if output_buffer:
+            # a command is running; collect output until it's done
+            output_buffer[1].append(kwargs)
+            return
+
         # send across AMP
         self.server.amp_protocol.send_MsgServer2Portal(session,
                                                        **kwargs)
 
+    def buffer_output(self, session):
+        """
+        Start collecting output to a session instead of sending it
+        right away. This is called by the cmdhandler when a command
+        starts, so that all the output from the command can be sent
+        as few, merged, messages once it's done. Calls may be nested.
+
+        Args:
+            session (Session): The session to buffer output for.
+
+        """
+        if not _COMMAND_OUTPUT_BUFFERING:
+            return
+        output_buffer = self.output_buffers.get(session.sessid)
+        if output_buffer:
+            output_buffer[0] += 1
+        else:
+            self.output_buffers[session.sessid] = [1, []]
+
+    def flush_output(self, session, force=False):
+        """
+        Stop collecting output to a session, sending all the collected
+        output. This must be called once for every call to `buffer_output`
+        before anything is sent.
+
+        Args:
+            session (Session): The session to send buffered output to.
+            force (bool, optional): Send the output now, no matter how
+                many calls to `buffer_output` are still active.
+
+        """
+        output_buffer = self.output_buffers.get(session.sessid)
+        if not output_buffer:
+            return
+        output_buffer[0] -= 1
+        if output_buffer[0] > 0 and not force:
+            return
+        del self.output_buffers[session.sessid]
+        for kwargs in _merge_output(output_buffer[1]):
+            self.server.amp_protocol.send_MsgServer2Portal(session, **kwargs)
+
     def get_inputfuncs(self):
         """
         Get all registered inputfuncs (access function)
@@ -782,9 +1120,82 @@ class ServerSessionHandler(SessionHandler):
         this class' `sessionhandler.call_inputfunc` with the
         (possibly processed) data.
 
+        Notes:
+            This is called with input arriving from the Portal, which is
+            queued per session (see `process_input`). Input injected on
+            the Server should go to `session.data_in` directly instead.
+
         """
         if session:
-            session.data_in(**kwargs)
+            if _INPUT_QUEUE_MAXSIZE <= 0:
+                session.data_in(**kwargs)
+                return
+            sessid = session.sessid
+            queue = self.input_queues.get(sessid)
+            if queue is None:
+                queue = self.input_queues[sessid] = deque()
+            elif len(queue) >= _INPUT_QUEUE_MAXSIZE:
+                self.data_out(session, text=_ERROR_INPUT_OVERFLOW)
+                return
+            if not queue:
+                self.input_order.append(sessid)
+            queue.append((time.time(), kwargs))
+            if not self.input_task:
+                self.input_task = reactor.callLater(0, self.process_input)
+
+    def process_input(self):
+        """
+        Handle queued input. The sessions take turns to have one input
+        handled each, until all queues are empty or the time budget for
+        this reactor iteration is spent. Remaining input is handled in
+        the next iteration.
+
+        """
+        self.input_task = None
+        tstart = time.time()
+        now = tstart
+        order = self.input_order
+        while order:
+            sessid = order.popleft()
+            queue = self.input_queues.get(sessid)
+            session = self.get(sessid)
+            if not queue or not session:
+                self.input_queues.pop(sessid, None)
+                continue
+            tqueued, kwargs = queue.popleft()
+            if queue:
+                # back in line for the next turn
+                order.append(sessid)
+            self.input_waits[sessid] = now - tqueued
+            try:
+                session.data_in(**kwargs)
+            except Exception:
+                log_trace()
+            now = time.time()
+            if now - tstart >= _INPUT_QUEUE_TICK_BUDGET:
+                break
+        if order and not self.input_task:
+            self.input_task = reactor.callLater(0, self.process_input)
+
+    def input_queue_stats(self):
+        """
+        Get the state of the input queues, for monitoring.
+
+        Returns:
+            stats (dict): `{sessid: (depth, wait, last_wait)}`, where
+                `depth` is the number of queued inputs, `wait` is how long
+                the oldest of them has waited so far and `last_wait` is how
+                long the latest handled input waited, all in seconds.
+
+        """
+        now = time.time()
+        stats = {}
+        for sessid in self:
+            queue = self.input_queues.get(sessid)
+            stats[sessid] = (len(queue) if queue else 0,
+                             now - queue[0][0] if queue else 0.0,
+                             self.input_waits.get(sessid, 0.0))
+        return stats
 
     def call_inputfuncs(self, session, **kwargs):
         """
@@ -818,6 +1229,14 @@ class ServerSessionHandler(SessionHandler):
                     if input_debug:
                         session.msg(err)
                     log_trace()
+            if self._await_first_command:
+                # measure the time until the first command after a portal sync
+                self._await_first_command = False
+                stats = self.sync_stats
+                stats["first_command"] = time.time()
+                since = stats["stop_time"] or stats["start"]
+                log_info("First command handled %.3fs after Server %s." % (
+                    stats["first_command"] - since, "stop" if stats["stop_time"] else "sync"))
 
 
 SESSION_HANDLER = ServerSessionHandler()
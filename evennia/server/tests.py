@@ -30,6 +30,12 @@ from evennia.utils.test_resources import EvenniaTest
 from django.test.runner import DiscoverRunner
 
 from evennia.server.throttle import Throttle
+from evennia.server.portal import amp
+from evennia.server.amp_client import AMPServerClientProtocol
+from evennia.server.portal.amp_server import AMPServerProtocol
+
+from mock import Mock, patch
+from evennia.utils.ansi import ANSIString
 
 from .deprecations import check_errors
 
@@ -144,3 +150,388 @@ class ThrottleTest(EvenniaTest):
 
         # There should only be (cache_size * num_ips) total in the Throttle cache
         self.assertEqual(sum([len(cache[x]) for x in cache.keys()]), throttle.cache_size * len(ips))
+
+
+class TestAMPBatching(TestCase):
+    """
+    Test batching of Server->Portal messages.
+    """
+    def setUp(self):
+        self.client = AMPServerClientProtocol()
+        self.client.callRemote = Mock()
+        self.addCleanup(self.client.connectionLost, None)
+        self.client.factory = Mock(broadcasts=[])
+        self.portal = AMPServerProtocol()
+        self.portal.factory = Mock()
+
+    def _send_to_portal(self, index=0):
+        "Deliver a sent batch to the portal side"
+        command, kwargs = self.client.callRemote.call_args_list[index][0][0], \
+            self.client.callRemote.call_args_list[index][1]
+        self.assertEqual(command, amp.MsgServer2PortalBatch)
+        self.portal.portal_receive_server2portal_batch(kwargs["packed_data"])
+
+    def test_batch(self):
+        session1, session2 = Mock(sessid=1), Mock(sessid=2)
+        self.client.send_MsgServer2Portal(session1, text=[["one"], {}])
+        self.client.send_MsgServer2Portal(session2, text=[["two"], {}])
+        self.client.send_MsgServer2Portal(session1, text=[["three"], {}])
+        self.assertFalse(self.client.callRemote.called)
+        self.assertTrue(self.client.send_flush_task.active())
+        self.client.flush_MsgServer2Portal()
+        self.assertEqual(self.client.callRemote.call_count, 1)
+        self.assertEqual(self.client.send_flush_task, None)
+
+        sessions = self.portal.factory.portal.sessions
+        sessions.get.side_effect = lambda sessid, default: {1: session1, 2: session2}[sessid]
+        self._send_to_portal()
+        self.assertEqual(sessions.data_out.call_args_list,
+                         [((session1,), {"text": [["one"], {}]}),
+                          ((session2,), {"text": [["two"], {}]}),
+                          ((session1,), {"text": [["three"], {}]})])
+
+    def test_admin_flushes(self):
+        session = Mock(sessid=1)
+        self.client.send_MsgServer2Portal(session, text=[["goodbye"], {}])
+        self.client.send_AdminServer2Portal(session, operation=amp.SDISCONN)
+        self.assertEqual(self.client.callRemote.call_count, 2)
+        self.assertEqual(self.client.callRemote.call_args_list[0][0][0], amp.MsgServer2PortalBatch)
+        self.assertEqual(self.client.callRemote.call_args_list[1][0][0], amp.AdminServer2Portal)
+
+    def test_batch_size(self):
+        session = Mock(sessid=1)
+        for num in range(amp.settings.AMP_BATCH_SIZE * 2):
+            self.client.send_MsgServer2Portal(session, text=[[str(num)], {}])
+        self.assertEqual(self.client.callRemote.call_count, 2)
+        self.assertFalse(self.client.send_buffer)
+
+
+class TestCleanSenddata(TestCase):
+    """
+    Test cleaning of outgoing data.
+    """
+    def setUp(self):
+        from evennia.server.sessionhandler import ServerSessionHandler
+        self.handler = ServerSessionHandler()
+        self.session = Mock(protocol_flags={"ENCODING": "utf-8"})
+
+    def test_text(self):
+        clean = self.handler.clean_senddata
+        expected = {"text": [["Hello"], {"options": {}}]}
+        self.assertEqual(clean(self.session, {"text": "Hello"}), expected)
+        self.assertEqual(clean(self.session, {"text": ("Hello", {})}), expected)
+        self.assertEqual(clean(self.session, {"text": u"Hello"}), expected)
+        self.assertEqual(clean(self.session, {"text": ANSIString("Hello")}), expected)
+        self.assertTrue(type(clean(self.session, {"text": u"Hello"})["text"][0][0]) is str)
+        self.assertEqual(clean(self.session, {"text": ("Hello", {"type": "look"}),
+                                              "options": {"raw": True}}),
+                         {"text": [["Hello"], {"type": "look", "options": {"raw": True}}]})
+        self.assertEqual(clean(self.session, {"text": "", "prompt": ">"}),
+                         {"prompt": [[">"], {"options": {}}]})
+
+    def test_encoding(self):
+        self.session.protocol_flags["ENCODING"] = "latin-1"
+        self.assertEqual(self.handler.clean_senddata(self.session, {"text": u"\xe5"}),
+                         {"text": [["\xe5"], {"options": {}}]})
+        self.session.protocol_flags["ENCODING"] = "utf-8"
+        self.assertEqual(self.handler.clean_senddata(self.session, {"text": u"\xe5"}),
+                         {"text": [["\xc3\xa5"], {"options": {}}]})
+        self.session.protocol_flags["ENCODING"] = "not-an-encoding"
+        self.assertEqual(self.handler.clean_senddata(self.session, {"text": u"\xe5"}),
+                         {"text": [["\xc3\xa5"], {"options": {}}]})
+        self.assertEqual(self.session.protocol_flags["ENCODING"], "utf-8")
+
+    def test_inlinefuncs(self):
+        from evennia.server import sessionhandler
+        with patch.object(sessionhandler, "_INLINEFUNC_ENABLED", True):
+            self.assertEqual(
+                self.handler.clean_senddata(self.session, {"text": "$pad(Hi, 6)!"}),
+                {"text": [["  Hi  !"], {"options": {}}]})
+            self.assertEqual(
+                self.handler.clean_senddata(self.session, {"text": "$pad(Hi, 6)!",
+                                                           "options": {"raw": True}}),
+                {"text": [["$pad(Hi, 6)!"], {"options": {"raw": True}}]})
+
+
+class TestOutputBuffering(TestCase):
+    """
+    Test collecting output while a command runs.
+    """
+    def setUp(self):
+        from evennia.server.sessionhandler import ServerSessionHandler
+        self.handler = ServerSessionHandler()
+        self.handler.server = Mock()
+        self.session = Mock(sessid=1, protocol_flags={"ENCODING": "utf-8"})
+        self.send = self.handler.server.amp_protocol.send_MsgServer2Portal
+
+    def test_buffer_output(self):
+        self.handler.buffer_output(self.session)
+        self.handler.data_out(self.session, prompt=">")
+        self.handler.data_out(self.session, text="|rOne|n")
+        self.handler.data_out(self.session, text=("Two", {}))
+        self.handler.data_out(self.session, text="|gTwo and a half")
+        self.handler.data_out(self.session, text="Two and three quarters")
+        self.handler.data_out(self.session, text=("Three", {"type": "look"}))
+        self.handler.data_out(self.session, text="Four", hp=10)
+        self.handler.data_out(self.session, hp=9, prompt="HP 9>")
+        # nested command
+        self.handler.buffer_output(self.session)
+        self.handler.flush_output(self.session)
+        self.assertFalse(self.send.called)
+        self.handler.flush_output(self.session)
+        self.assertEqual(
+            self.send.call_args_list,
+            [((self.session,), {"text": [["|rOne|n\nTwo\n|gTwo and a half"], {"options": {}}]}),
+             ((self.session,), {"text": [["Two and three quarters"], {"options": {}}]}),
+             ((self.session,), {"text": [["Three"], {"type": "look", "options": {}}]}),
+             ((self.session,), {"text": [["Four"], {"options": {}}],
+                                "hp": [[10], {"options": {}}]}),
+             ((self.session,), {"hp": [[9], {"options": {}}]}),
+             ((self.session,), {"prompt": [["HP 9>"], {"options": {}}]})])
+        # not buffering anymore
+        self.handler.data_out(self.session, text="Five")
+        self.assertEqual(self.send.call_count, 7)
+
+    def test_interleaved(self):
+        self.handler.buffer_output(self.session)
+        self.handler.data_out(self.session, text="One")
+        self.handler.data_out(self.session, clearscreen=[])
+        self.handler.data_out(self.session, hp=10)
+        self.handler.data_out(self.session, text="Two")
+        self.handler.data_out(self.session, text="Three")
+        self.handler.flush_output(self.session)
+        # the text after the other commands is not moved before them
+        self.assertEqual(
+            self.send.call_args_list,
+            [((self.session,), {"text": [["One"], {"options": {}}]}),
+             ((self.session,), {"clearscreen": [[], {"options": {}}],
+                                "hp": [[10], {"options": {}}]}),
+             ((self.session,), {"text": [["Two\nThree"], {"options": {}}]})])
+
+    def test_disconnect(self):
+        self.handler[1] = self.session
+        self.session.account = None
+        self.handler.buffer_output(self.session)
+        self.handler.data_out(self.session, text="Goodbye")
+        self.handler.disconnect(self.session)
+        self.send.assert_called_once_with(self.session, text=[["Goodbye"], {"options": {}}])
+        self.assertFalse(self.handler.output_buffers)
+
+
+class TestSessionIndex(TestCase):
+    """
+    Test the indexed session lookups.
+    """
+    def setUp(self):
+        from evennia.server.sessionhandler import ServerSessionHandler
+        self.handler = ServerSessionHandler()
+        self.account = Mock(uid=1)
+        self.puppet = Mock(id=5)
+        self.sessions = []
+        for sessid in range(1, 4):
+            session = Mock(sessid=sessid, logged_in=False, uid=None, puid=None,
+                           csessid="csess%i" % sessid, cmd_last=0)
+            self.handler[sessid] = session
+            self.sessions.append(session)
+
+    def _login(self, session):
+        session.logged_in = True
+        session.uid = self.account.uid
+        self.handler.update_session_index(session)
+
+    def test_account(self):
+        sess1, sess2, sess3 = self.sessions
+        self.assertEqual(self.handler.sessions_from_account(self.account), [])
+        self._login(sess2)
+        self._login(sess1)
+        self.assertEqual(self.handler.sessions_from_account(self.account), [sess1, sess2])
+        self.assertEqual(self.handler.account_count(), 1)
+        # at_disconnect sets logged_in before the session is removed
+        sess2.logged_in = False
+        self.assertEqual(self.handler.sessions_from_account(self.account), [sess1])
+        del self.handler[2]
+        del self.handler[1]
+        self.assertEqual(self.handler.sessions_from_account(self.account), [])
+        self.assertEqual(self.handler.account_count(), 0)
+
+    def test_puppet(self):
+        sess1, sess2, sess3 = self.sessions
+        self.assertEqual(self.handler.sessions_from_puppet(self.puppet), [])
+        sess3.puid = self.puppet.id
+        self.handler.update_session_index(sess3)
+        self.assertEqual(self.handler.sessions_from_puppet(self.puppet), sess3)
+        sess1.puid = self.puppet.id
+        self.handler.update_session_index(sess1)
+        self.assertEqual(self.handler.sessions_from_puppet(self.puppet), [sess1, sess3])
+        sess3.puid = None
+        self.handler.update_session_index(sess3)
+        self.assertEqual(self.handler.sessions_from_puppet(self.puppet), sess1)
+
+    def test_csessid(self):
+        sess1, sess2, sess3 = self.sessions
+        self.assertEqual(self.handler.sessions_from_csessid("csess2"), [sess2])
+        # replacing a session re-indexes it
+        new_sess = Mock(sessid=2, logged_in=False, uid=None, puid=None,
+                        csessid="csess1", cmd_last=0)
+        self.handler[2] = new_sess
+        self.assertEqual(self.handler.sessions_from_csessid("csess2"), [])
+        self.assertEqual(self.handler.sessions_from_csessid("csess1"), [sess1, new_sess])
+        # sessions not in the handler are not indexed
+        self.handler.update_session_index(Mock(sessid=10, csessid="csess1"))
+        self.assertEqual(len(self.handler.sessions_from_csessid("csess1")), 2)
+
+    def test_connect_missing_account(self):
+        from evennia.server.serversession import ServerSession
+        session = ServerSession()
+        session.init_session("telnet", ("localhost", "testmode"), self.handler)
+        session.sessid = 4
+        session.logged_in = True
+        session.uid = 9999
+        with patch("evennia.server.sessionhandler.delay") as mock_delay:
+            self.handler.portal_connect(session.get_sync_data())
+        session = self.handler[4]
+        self.assertFalse(session.logged_in)
+        self.assertEqual(self.handler.sessions_from_account(Mock(uid=9999)), [])
+        self.assertEqual(self.handler.account_count(), 0)
+        self.assertEqual(mock_delay.call_count, 1)
+
+    def test_idle_sessions(self):
+        import time
+        sess1, sess2, sess3 = self.sessions
+        now = time.time()
+        sess1.cmd_last = now
+        sess3.cmd_last = now - 100
+        del self.handler[2]
+        self.assertEqual(self.handler.get_idle_sessions(50), [sess3])
+        self.assertEqual(self.handler.get_idle_sessions(50), [sess3])
+        self.assertEqual(self.handler.get_idle_sessions(200), [])
+        sess3.cmd_last = now
+        self.assertEqual(self.handler.get_idle_sessions(50), [])
+        self.assertEqual(len(self.handler._idle_heap), 2)
+
+
+def _sync_monitor_callback(**kwargs):
+    pass
+
+
+class TestPortalSessionsSync(TestCase):
+    """
+    Test syncing the sessions from the Portal in chunks.
+    """
+    def setUp(self):
+        from evennia.server.sessionhandler import ServerSessionHandler
+        from evennia.server.serversession import ServerSession
+        self.handler = ServerSessionHandler()
+        self.handler.server = Mock()
+        self.sessdata = {}
+        for sessid in range(1, 4):
+            session = ServerSession()
+            session.init_session("telnet", ("localhost", "testmode"), self.handler)
+            session.sessid = sessid
+            self.sessdata[sessid] = session.get_sync_data()
+        self.send = self.handler.server.amp_protocol.send_MsgServer2Portal
+
+    def test_chunks(self):
+        self.handler.portal_sessions_sync({1: self.sessdata[1], 2: self.sessdata[2]},
+                                          last=False, stop_time=10)
+        # the first sessions are active before the sync has finished
+        self.assertEqual(sorted(self.handler), [1, 2])
+        self.assertEqual(self.send.call_count, 2)
+        self.handler.server.at_pre_portal_sync.assert_called_once_with("reload")
+        self.assertFalse(self.handler.server.at_post_portal_sync.called)
+        self.handler.portal_sessions_sync({3: self.sessdata[3]}, first=False, last=True)
+        self.assertEqual(sorted(self.handler), [1, 2, 3])
+        self.handler.server.at_post_portal_sync.assert_called_once_with("reload")
+        stats = self.handler.sync_stats
+        self.assertEqual((stats["chunks"], stats["sessions"], stats["stop_time"]), (2, 3, 10))
+        self.assertIsNone(stats["first_command"])
+        # the first command is timed
+        self.handler.call_inputfuncs(self.handler[1])
+        self.assertTrue(stats["first_command"] >= stats["end"])
+
+    def test_monitor_during_sync(self):
+        from evennia.scripts.monitorhandler import MONITOR_HANDLER
+        from evennia.utils.create import create_object
+        obj = create_object("evennia.objects.objects.DefaultObject", key="Monitored", nohome=True)
+        self.addCleanup(obj.delete)
+        # a monitor saved over the reload
+        MONITOR_HANDLER.add(obj, "db_key", _sync_monitor_callback, idstring="saved")
+        MONITOR_HANDLER.save()
+        MONITOR_HANDLER.remove(obj, "db_key", idstring="saved")
+        self.handler.server.at_post_portal_sync.side_effect = \
+            lambda mode: MONITOR_HANDLER.restore(mode == "reload")
+        self.handler.portal_sessions_sync({1: self.sessdata[1]}, last=False)
+        # a command from a synced session adds a monitor before the sync is done
+        MONITOR_HANDLER.add(obj, "db_key", _sync_monitor_callback, idstring="live")
+        self.handler.portal_sessions_sync({2: self.sessdata[2]}, first=False, last=True)
+        self.assertEqual(sorted(MONITOR_HANDLER.monitors[obj]["db_key"]), ["live", "saved"])
+        MONITOR_HANDLER.remove(obj, "db_key", idstring="live")
+        MONITOR_HANDLER.remove(obj, "db_key", idstring="saved")
+
+
+@patch("evennia.server.sessionhandler.reactor")
+class TestInputQueue(TestCase):
+    """
+    Test the per-session input queues.
+    """
+    def setUp(self):
+        from evennia.server.sessionhandler import ServerSessionHandler
+        self.handler = ServerSessionHandler()
+        self.handler.server = Mock()
+        self.handled = []
+        self.sess1 = Mock(sessid=1, cmd_last=0, protocol_flags={"ENCODING": "utf-8"})
+        self.sess2 = Mock(sessid=2, cmd_last=0, protocol_flags={"ENCODING": "utf-8"})
+        for session in (self.sess1, self.sess2):
+            self.handler[session.sessid] = session
+            session.data_in.side_effect = \
+                lambda session=session, **kwargs: self.handled.append((session.sessid, kwargs["text"]))
+
+    def test_round_robin(self, mock_reactor):
+        for text in ("a", "b", "c"):
+            self.handler.data_in(self.sess1, text=text)
+        self.handler.data_in(self.sess2, text="x")
+        self.assertEqual(mock_reactor.callLater.call_count, 1)
+        self.assertEqual(self.handler.input_queue_stats()[1][0], 3)
+        self.handler.process_input()
+        self.assertEqual(self.handled, [(1, "a"), (2, "x"), (1, "b"), (1, "c")])
+        self.assertEqual(self.handler.input_queue_stats()[1][:2], (0, 0.0))
+
+    @patch("evennia.server.sessionhandler._INPUT_QUEUE_TICK_BUDGET", 0)
+    def test_budget(self, mock_reactor):
+        self.handler.data_in(self.sess1, text="a")
+        self.handler.data_in(self.sess1, text="b")
+        self.handler.process_input()
+        self.assertEqual(self.handled, [(1, "a")])
+        self.assertEqual(mock_reactor.callLater.call_count, 2)
+        self.handler.process_input()
+        self.assertEqual(self.handled, [(1, "a"), (1, "b")])
+
+    @patch("evennia.server.sessionhandler._INPUT_QUEUE_MAXSIZE", 2)
+    def test_overflow(self, mock_reactor):
+        for text in ("a", "b", "c"):
+            self.handler.data_in(self.sess1, text=text)
+        self.handler.server.amp_protocol.send_MsgServer2Portal.assert_called_once()
+        # input from disconnected sessions is dropped
+        self.handler.data_in(self.sess2, text="x")
+        del self.handler[2]
+        self.handler.process_input()
+        self.assertEqual(self.handled, [(1, "a"), (1, "b")])
+
+    @patch("evennia.server.sessionhandler._INPUT_QUEUE_MAXSIZE", 0)
+    def test_no_queue(self, mock_reactor):
+        self.handler.data_in(self.sess1, text="a")
+        self.assertEqual(self.handled, [(1, "a")])
+        self.assertFalse(mock_reactor.callLater.called)
+
+    def test_execute_cmd(self, mock_reactor):
+        from evennia.server.serversession import ServerSession
+        session = ServerSession()
+        session.init_session("telnet", ("localhost", "testmode"), self.handler)
+        session.sessid = 3
+        self.handler[3] = session
+        with patch.object(self.handler, "call_inputfuncs") as mock_call_inputfuncs:
+            session.execute_cmd("look")
+            # injected commands are not queued
+            mock_call_inputfuncs.assert_called_once_with(session, text=(("look",), {}))
+        self.assertFalse(mock_reactor.callLater.called)
+        self.assertEqual(self.handler.input_queue_stats()[3][0], 0)
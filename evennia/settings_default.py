@@ -45,6 +45,21 @@ SSL_INTERFACES = ['0.0.0.0']
 # server-side (see INPUT_FUNC_MODULES). TELNET_ENABLED is required for this
 # to work.
 TELNET_OOB_ENABLED = False
+# If > 0, updates of OOB-monitored values (like a health bar) are collected
+# and sent together to telnet clients, at most once every this many seconds,
+# as a `monitor_batch` command (GMCP Char.Monitor.Batch) instead of one
+# `monitor` command (GMCP Char.Monitor.Update) per update. Only turn this
+# on if your clients handle the batched command.
+TELNET_OOB_BATCH_INTERVAL = 0
+# MCCP compression of telnet output. Each session using MCCP needs about
+# 2**(MCCP_WBITS + 2) + 2**(MCCP_MEMLEVEL + 9) bytes of memory in the Portal.
+# The zlib defaults (15 and 8) use 256KB per session, the values below
+# 32KB, at the cost of a little less compression. MCCP_LEVEL (1-9) sets
+# how hard to compress. A session can use another level by setting its
+# MCCP_LEVEL protocol flag before MCCP is negotiated.
+MCCP_WBITS = 12
+MCCP_MEMLEVEL = 5
+MCCP_LEVEL = 6
 # Activate SSH protocol communication (SecureShell)
 SSH_ENABLED = False
 # Ports to use for SSH
@@ -98,6 +113,13 @@ WEBSOCKET_CLIENT_INTERFACE = '0.0.0.0'
 # the client will itself figure out this url based on the server's hostname.
 # e.g. ws://external.example.com or wss://external.example.com:443
 WEBSOCKET_CLIENT_URL = None
+# Compress websocket messages for browsers supporting it (permessage-deflate).
+# Each such connection needs about 2**(WBITS + 2) + 2**(MEMLEVEL + 9) bytes
+# for compressing and 2**WBITS for decompressing; the defaults below use about
+# 40KB. Use 15 and 8 to compress the most, using about 300KB.
+WEBSOCKET_CLIENT_DEFLATE = True
+WEBSOCKET_CLIENT_DEFLATE_WBITS = 12
+WEBSOCKET_CLIENT_DEFLATE_MEMLEVEL = 5
 # This determine's whether Evennia's custom admin page is used, or if the
 # standard Django admin is used.
 EVENNIA_ADMIN = True
@@ -109,6 +131,29 @@ EVENNIA_ADMIN = True
 AMP_HOST = 'localhost'
 AMP_PORT = 4006
 AMP_INTERFACE = '127.0.0.1'
+# How the Portal and Server talks AMP with each other. Either 'tcp' (using the AMP_HOST,
+# AMP_PORT and AMP_INTERFACE above) or 'unix', which uses a Unix domain socket. This is
+# faster but only works when both run on the same machine. If 'unix' is not supported by
+# the platform (or the path to the socket file is too long), TCP is used instead.
+AMP_TRANSPORT = 'unix' if sys.platform.startswith('linux') else 'tcp'
+# The socket file to use with the 'unix' transport. If None, it will be
+# mygame/server/amp.sock.
+AMP_SOCKET_FILE = None
+# AMP messages shorter than this (in bytes) are sent uncompressed, since compressing
+# small messages costs more than it saves. Larger messages are compressed with zlib
+# at AMP_COMPRESSION_LEVEL (1-9, where 1 is fastest and 9 compresses the most).
+AMP_COMPRESSION_THRESHOLD = 1024
+AMP_COMPRESSION_LEVEL = 1
+# Messages from the Server to the Portal are collected and sent in batches. A batch
+# is sent at the latest AMP_BATCH_LATENCY seconds after its first message (0 means at
+# the end of the current reactor iteration), or as soon as it has AMP_BATCH_SIZE
+# messages. Setting AMP_BATCH_SIZE to 1 sends every message on its own.
+AMP_BATCH_SIZE = 100
+AMP_BATCH_LATENCY = 0
+# When the Server (re)connects, the Portal sends it the data for this many sessions
+# at a time. Each session becomes active as soon as its chunk is processed; input
+# from sessions not yet synced waits in the Portal. 0 sends all sessions at once.
+AMP_SESSION_SYNC_CHUNK_SIZE = 100
 
 
 # Path to the lib directory containing the bulk of the codebase's code.
@@ -202,6 +247,13 @@ SCREENREADER_REGEX_STRIP = r"\+-+|\+$|\+~|--+|~~+|==+"
 # be necessary (use @server to see how many objects are in the idmapper
 # cache at any time). Setting this to None disables the cache cap.
 IDMAPPER_CACHE_MAXSIZE = 200      # (MB)
+# Every timed Script normally has a reactor timer of its own. If this is
+# set (in seconds), all Script timers are instead run by one shared timer
+# that fires the Scripts due within the same SCRIPT_TIMER_RESOLUTION
+# seconds together. This is cheaper with many thousands of timed Scripts;
+# each Script may fire up to this many seconds late. As with the default
+# timers, a repeat returning a Deferred delays the next one until it fires.
+SCRIPT_TIMER_RESOLUTION = None
 # This determines how many connections per second the Portal should
 # accept, as a DoS countermeasure. If the rate exceeds this number, incoming
 # connections will be queued to this rate, so none will be lost.
@@ -222,6 +274,15 @@ COMMAND_RATE_WARNING = "You entered commands too fast. Wait a moment and try aga
 MAX_CHAR_LIMIT = 6000
 # The warning to echo back to users if they enter a very large string
 MAX_CHAR_LIMIT_WARNING = "You entered a string that was too long. Please break it up into multiple parts."
+# Input reaching the Server is queued per session and the sessions take turns
+# having their input handled, so one session sending a lot of commands can't
+# hold up the others. At most INPUT_QUEUE_TICK_BUDGET seconds are spent handling
+# queued input before giving other tasks a chance to run. A session with more
+# than INPUT_QUEUE_MAXSIZE inputs queued will have further input dropped with
+# the COMMAND_RATE_WARNING. Set INPUT_QUEUE_MAXSIZE to 0 to handle all input
+# directly when it arrives.
+INPUT_QUEUE_MAXSIZE = 100
+INPUT_QUEUE_TICK_BUDGET = 0.05
 # If this is true, errors and tracebacks from the engine will be
 # echoed as text in-game as well as to the log. This can speed up
 # debugging. OBS: Showing full tracebacks to regular users could be a
@@ -433,6 +494,11 @@ COMMAND_DEFAULT_MSG_ALL_SESSIONS = False
 COMMAND_DEFAULT_HELP_CATEGORY = "general"
 # The default lockstring of a command.
 COMMAND_DEFAULT_LOCKS = ""
+# While a command runs, all output to the Session that issued it is
+# collected and sent as one merged message when the command finishes,
+# rather than sending every msg() call separately. Commands that yield
+# or return a Deferred have their output sent as soon as func() returns.
+COMMAND_OUTPUT_BUFFERING = True
 # The Channel Handler will create a command to represent each channel,
 # creating it with the key of the channel, its aliases, locks etc. The
 # default class logs channel messages to a file and allows for /history.
@@ -16,6 +16,8 @@ the ansi mapping.
 from builtins import object, range
 
 import re
+from array import array
+from bisect import bisect_left
 from collections import OrderedDict
 
 from django.conf import settings
@@ -71,11 +73,72 @@ ANSI_SPACE = " "
 # Escapes
 ANSI_ESCAPES = ("{{", "\\\\", "\|\|")
 
+# parsed strings, least recently used first
 _PARSE_CACHE = OrderedDict()
 _PARSE_CACHE_SIZE = 10000
+_PARSE_CACHE_STATS = {"hits": 0, "misses": 0}
 
 _COLOR_NO_DEFAULT = settings.COLOR_NO_DEFAULT
 
+# the xterm256 markup (fg, bg, gfg, gbg) the single-pass tokenizer understands
+_XTERM256_DEFAULT_MARKUP = ([r'\|([0-5])([0-5])([0-5])'], [r'\|\[([0-5])([0-5])([0-5])'],
+                            [r'\|=([a-z])'], [r'\|\[=([a-z])'])
+# single-pass tokenizers and their replacement tables, per parser class
+_TOKENIZERS = {}
+_TOKEN_TABLES = {}
+
+
+def get_cached_parse(key):
+    """
+    Get a result from the parse cache, marking it as recently used.
+
+    Args:
+        key (tuple): The cache key. This starts with the string that was
+            parsed, followed by anything else affecting the result.
+
+    Returns:
+        parsed (str or None): The cached result, or `None` if there was
+            none.
+
+    """
+    try:
+        parsed = _PARSE_CACHE.pop(key)
+    except KeyError:
+        _PARSE_CACHE_STATS["misses"] += 1
+        return None
+    _PARSE_CACHE[key] = parsed
+    _PARSE_CACHE_STATS["hits"] += 1
+    return parsed
+
+
+def cache_parse(key, parsed):
+    """
+    Store a result in the parse cache, evicting the least recently
+    used result if the cache is full.
+
+    Args:
+        key (tuple): The cache key, as given to `get_cached_parse`.
+        parsed (str): The parsed string.
+
+    """
+    _PARSE_CACHE[key] = parsed
+    if len(_PARSE_CACHE) > _PARSE_CACHE_SIZE:
+        _PARSE_CACHE.popitem(last=False)
+
+
+def parse_cache_stats():
+    """
+    Get statistics of the parse cache shared by ANSI and html parsing.
+
+    Returns:
+        stats (dict): The number of cached results (`size`), the max
+            number of results (`maxsize`) as well as the number of
+            cache `hits` and `misses` since the server started.
+
+    """
+    return {"size": len(_PARSE_CACHE), "maxsize": _PARSE_CACHE_SIZE,
+            "hits": _PARSE_CACHE_STATS["hits"], "misses": _PARSE_CACHE_STATS["misses"]}
+
 
 class ANSIParser(object):
     """
@@ -208,6 +271,20 @@ class ANSIParser(object):
     # instance of each
     ansi_escapes = re.compile(r"(%s)" % "|".join(ANSI_ESCAPES), re.DOTALL)
 
+    @property
+    def tokenizer(self):
+        """
+        The regex used by `sub_markup`, or `None` if the markup of this
+        parser can't be parsed in one pass. It's built on first use and
+        shared by all parsers of the same class.
+
+        """
+        try:
+            return _TOKENIZERS[type(self)]
+        except KeyError:
+            tokenizer = _TOKENIZERS[type(self)] = self._build_tokenizer()
+            return tokenizer
+
     def sub_ansi(self, ansimatch):
         """
         Replacer used by `re.sub` to replace ANSI
@@ -383,37 +460,21 @@ class ANSIParser(object):
         """
         return self.mxp_sub.sub(r'\2', string)
 
-    def parse_ansi(self, string, strip_ansi=False, xterm256=False, mxp=False):
+    def sub_markup_multipass(self, string, xterm256=False):
         """
-        Parses a string, subbing color codes according to the stored
-        mapping.
+        Replace all markup in a string with ANSI sequences, one kind of
+        markup at a time. This is used when `sub_markup` can't handle
+        the markup of this parser in one pass.
 
         Args:
             string (str): The string to parse.
-            strip_ansi (boolean, optional): Strip all found ansi markup.
             xterm256 (boolean, optional): If actually using xterm256 or if
                 these values should be converted to 16-color ANSI.
-            mxp (boolean, optional): Parse MXP commands in string.
 
         Returns:
-            string (str): The parsed string.
+            string (str): The parsed string. MXP markup is not handled.
 
         """
-        if hasattr(string, '_raw_string'):
-            if strip_ansi:
-                return string.clean()
-            else:
-                return string.raw()
-
-        if not string:
-            return ''
-
-        # check cached parsings
-        global _PARSE_CACHE
-        cachekey = "%s-%s-%s-%s" % (string, strip_ansi, xterm256, mxp)
-        if cachekey in _PARSE_CACHE:
-            return _PARSE_CACHE[cachekey]
-
         # pre-convert bright colors to xterm256 color tags
         string = self.brightbg_sub.sub(self.sub_brightbg, string)
 
@@ -441,21 +502,139 @@ class ANSIParser(object):
             pstring = self.xterm256_gbg_sub.sub(do_xterm256_gbg, pstring)
             pstring = self.ansi_sub.sub(self.sub_ansi, pstring)
             parsed_string.append("%s%s" % (pstring, sep[0].strip()))
-        parsed_string = "".join(parsed_string)
+        return "".join(parsed_string)
+
+    def sub_markup(self, string, xterm256=False, strip=False):
+        """
+        Replace all markup in a string with ANSI sequences in a single
+        pass, using the tokenizer of this parser.
+
+        Args:
+            string (str): The string to parse.
+            xterm256 (boolean, optional): If actually using xterm256 or if
+                these values should be converted to 16-color ANSI.
+            strip (boolean, optional): Remove the markup instead.
+
+        Returns:
+            string (str): The parsed string. MXP markup is not handled.
+
+        """
+        parts = self.tokenizer.split(string)
+        if len(parts) == 1:
+            return string
+        table = _TOKEN_TABLES.get((type(self), xterm256, strip))
+        if table is None:
+            table = self._build_token_table(xterm256, strip)
+        parts[1::2] = [table[token] for token in parts[1::2]]
+        return "".join(parts)
+
+    def _build_tokenizer(self):
+        """
+        Build the regex used by `sub_markup`. It matches every escape
+        and piece of markup in one go, the way the multi-pass regexes
+        would have found them.
+
+        Returns:
+            tokenizer (regex or None): The tokenizer, or `None` if the
+                markup can't be parsed in one pass, such as when custom
+                xterm256 markup is used.
+
+        """
+        if (self.xterm256_fg, self.xterm256_bg,
+                self.xterm256_gfg, self.xterm256_gbg) != _XTERM256_DEFAULT_MARKUP:
+            return None
+        brightbg_tags = [tup[0] for tup in self.ansi_xterm256_bright_bg_map]
+        ansi_tags = [tup[0] for tup in self.ansi_map]
+        for tag in brightbg_tags + ansi_tags:
+            # tags must not overlap each other or the escapes
+            if (len(tag) < 2 or tag[0] != "|" or
+                    any(char in tag[1:] for char in "|\\{")):
+                return None
+        # after the initial |, in the order the multi-pass regexes use
+        tags = [r"\|", r"[0-5]{3}", r"\[[0-5]{3}", r"=[a-z]", r"\[=[a-z]"]
+        tags.extend(r"(?<!\|\|)%s" % re.escape(tag[1:]) for tag in brightbg_tags)
+        tags.extend(re.escape(tag[1:]) for tag in ansi_tags)
+        return re.compile(r"(\\|{{|\|(?:%s))" % "|".join(tags), re.DOTALL)
+
+    def _build_token_table(self, xterm256=False, strip=False):
+        """
+        Map every token `sub_markup` can find to its replacement, as
+        given by `sub_markup_multipass`.
+
+        Args:
+            xterm256 (boolean, optional): Use xterm256 colors.
+            strip (boolean, optional): Map the markup to the empty string.
+
+        Returns:
+            table (dict): The mapping `{token: replacement}`.
+
+        """
+        tokens = ["\\", "{{", "||"]
+        tokens.extend(tup[0] for tup in self.ansi_xterm256_bright_bg_map)
+        tokens.extend(tup[0] for tup in self.ansi_map)
+        for prefix in ("|", "|["):
+            tokens.extend("%s%i%i%i" % (prefix, red, green, blue)
+                          for red in range(6) for green in range(6) for blue in range(6))
+            tokens.extend("%s=%s" % (prefix, chr(letter)) for letter in range(97, 123))
+        table = dict((token, self.sub_markup_multipass(token, xterm256)) for token in tokens)
+        if strip:
+            table = dict((token, self.strip_raw_codes(value)) for token, value in table.items())
+        _TOKEN_TABLES[(type(self), xterm256, strip)] = table
+        return table
+
+    def parse_ansi(self, string, strip_ansi=False, xterm256=False, mxp=False):
+        """
+        Parses a string, subbing color codes according to the stored
+        mapping.
+
+        Args:
+            string (str): The string to parse.
+            strip_ansi (boolean, optional): Strip all found ansi markup.
+            xterm256 (boolean, optional): If actually using xterm256 or if
+                these values should be converted to 16-color ANSI.
+            mxp (boolean, optional): Parse MXP commands in string.
+
+        Returns:
+            string (str): The parsed string.
+
+        """
+        if hasattr(string, '_raw_string'):
+            if strip_ansi:
+                return string.clean()
+            else:
+                return string.raw()
 
-        if not mxp:
-            parsed_string = self.strip_mxp(parsed_string)
+        if not string:
+            return ''
 
-        if strip_ansi:
-            # remove all ansi codes (including those manually
-            # inserted in string)
-            return self.strip_raw_codes(parsed_string)
+        # check cached parsings
+        cachekey = (string, strip_ansi, xterm256, mxp, self)
+        parsed_string = get_cached_parse(cachekey)
+        if parsed_string is not None:
+            return parsed_string
+
+        strip = False
+        if self.tokenizer:
+            in_string = utils.to_str(string)
+            # without raw ansi codes in the string, the markup can be
+            # stripped directly. Any MXP is stripped from the full result.
+            strip = strip_ansi and ANSI_ESCAPE not in in_string
+            parsed_string = self.sub_markup(in_string, xterm256, strip)
+            if strip and not mxp and "|l" in parsed_string:
+                strip = False
+                parsed_string = self.sub_markup(in_string, xterm256)
+        else:
+            parsed_string = self.sub_markup_multipass(string, xterm256)
 
-        # cache and crop old cache
-        _PARSE_CACHE[cachekey] = parsed_string
-        if len(_PARSE_CACHE) > _PARSE_CACHE_SIZE:
-            _PARSE_CACHE.popitem(last=False)
+        if not strip:
+            if not mxp and "|lc" in parsed_string:
+                parsed_string = self.strip_mxp(parsed_string)
+            if strip_ansi:
+                # remove all ansi codes (including those manually
+                # inserted in string)
+                parsed_string = self.strip_raw_codes(parsed_string)
 
+        cache_parse(cachekey, parsed_string)
         return parsed_string
 
 
@@ -528,6 +707,14 @@ def raw(string):
     return string.replace('{', '{{').replace('|', '||')
 
 
+def _index_array(indexes):
+    """
+    Store a sequence of string indexes compactly.
+
+    """
+    return indexes if isinstance(indexes, array) else array('I', indexes)
+
+
 def _spacing_preflight(func):
     """
     This wrapper function is used to do some preflight checks on
@@ -596,14 +783,9 @@ def _transform(func_name):
 
     def wrapped(self, *args, **kwargs):
         replacement_string = _query_super(func_name)(self, *args, **kwargs)
-        to_string = []
-        char_counter = 0
-        for index in range(0, len(self._raw_string)):
-            if index in self._code_indexes:
-                to_string.append(self._raw_string[index])
-            elif index in self._char_indexes:
-                to_string.append(replacement_string[char_counter])
-                char_counter += 1
+        to_string = list(self._raw_string)
+        for char_counter, index in enumerate(self._char_indexes):
+            to_string[index] = replacement_string[char_counter]
         return ANSIString(
             ''.join(to_string), decoded=True,
             code_indexes=self._code_indexes, char_indexes=self._char_indexes,
@@ -681,13 +863,16 @@ class ANSIString(with_metaclass(ANSIMeta, unicode)):
         code_indexes = kwargs.pop('code_indexes', None)
         char_indexes = kwargs.pop('char_indexes', None)
         clean_string = kwargs.pop('clean_string', None)
-        # All True, or All False, not just one.
-        checks = [x is None for x in [code_indexes, char_indexes, clean_string]]
-        if not len(set(checks)) == 1:
-            raise ValueError("You must specify code_indexes, char_indexes, "
-                             "and clean_string together, or not at all.")
-        if not all(checks):
+        # the indexes go together, and only with a clean string
+        if (code_indexes is None) != (char_indexes is None) or (
+                code_indexes is not None and clean_string is None):
+            raise ValueError("You must specify code_indexes and char_indexes "
+                             "together, and only along with clean_string.")
+        if clean_string is not None:
             decoded = True
+        indexes = None
+        if code_indexes is not None:
+            indexes = (_index_array(code_indexes), _index_array(char_indexes))
         if not decoded:
             # Completely new ANSI String
             clean_string = to_unicode(parser.parse_ansi(string, strip_ansi=True, mxp=True))
@@ -698,8 +883,7 @@ class ANSIString(with_metaclass(ANSIMeta, unicode)):
         elif hasattr(string, '_clean_string'):
             # It's already an ANSIString
             clean_string = string._clean_string
-            code_indexes = string._code_indexes
-            char_indexes = string._char_indexes
+            indexes = string._indexes
             string = string._raw_string
         else:
             # It's a string that has been pre-ansi decoded.
@@ -708,11 +892,13 @@ class ANSIString(with_metaclass(ANSIMeta, unicode)):
         if not isinstance(string, unicode):
             string = string.decode('utf-8')
 
-        ansi_string = super(ANSIString, cls).__new__(ANSIString, to_str(clean_string), "utf-8")
+        if isinstance(clean_string, unicode):
+            ansi_string = super(ANSIString, cls).__new__(ANSIString, clean_string)
+        else:
+            ansi_string = super(ANSIString, cls).__new__(ANSIString, clean_string, "utf-8")
         ansi_string._raw_string = string
         ansi_string._clean_string = clean_string
-        ansi_string._code_indexes = code_indexes
-        ansi_string._char_indexes = char_indexes
+        ansi_string._indexes = indexes
         return ansi_string
 
     def __str__(self):
@@ -758,15 +944,37 @@ class ANSIString(with_metaclass(ANSIMeta, unicode)):
         The third thing to set is the _clean_string. This is a unicode object
         that is devoid of all ANSI Escapes.
 
-        Finally, _code_indexes and _char_indexes are defined. These are lookup
+        Finally, there are _code_indexes and _char_indexes. These are lookup
         tables for which characters in the raw string are related to ANSI
-        escapes, and which are for the readable text.
+        escapes, and which are for the readable text. They are only built
+        when first needed, such as when slicing, and are shared with
+        strings derived from this one where possible.
 
         """
         self.parser = kwargs.pop('parser', ANSI_PARSER)
         super(ANSIString, self).__init__()
-        if self._code_indexes is None:
-            self._code_indexes, self._char_indexes = self._get_indexes()
+
+    @property
+    def _code_indexes(self):
+        """
+        The indexes of the raw string taken up by ANSI escapes, as an
+        `array` of ints.
+
+        """
+        if self._indexes is None:
+            self._indexes = self._get_indexes()
+        return self._indexes[0]
+
+    @property
+    def _char_indexes(self):
+        """
+        The indexes of the raw string holding readable text, as an
+        `array` of ints.
+
+        """
+        if self._indexes is None:
+            self._indexes = self._get_indexes()
+        return self._indexes[1]
 
     @staticmethod
     def _shifter(iterable, offset):
@@ -775,7 +983,7 @@ class ANSIString(with_metaclass(ANSIMeta, unicode)):
         by a number.
 
         """
-        return [i + offset for i in iterable]
+        return array('I', [i + offset for i in iterable])
 
     @classmethod
     def _adder(cls, first, second):
@@ -786,12 +994,13 @@ class ANSIString(with_metaclass(ANSIMeta, unicode)):
 
         raw_string = first._raw_string + second._raw_string
         clean_string = first._clean_string + second._clean_string
-        code_indexes = first._code_indexes[:]
-        char_indexes = first._char_indexes[:]
-        code_indexes.extend(
-            cls._shifter(second._code_indexes, len(first._raw_string)))
-        char_indexes.extend(
-            cls._shifter(second._char_indexes, len(first._raw_string)))
+        if first._indexes is None or second._indexes is None:
+            # leave the indexes to be found if they are needed
+            return ANSIString(raw_string, clean_string=clean_string)
+        code_indexes = first._code_indexes + cls._shifter(
+            second._code_indexes, len(first._raw_string))
+        char_indexes = first._char_indexes + cls._shifter(
+            second._char_indexes, len(first._raw_string))
         return ANSIString(raw_string, code_indexes=code_indexes,
                           char_indexes=char_indexes,
                           clean_string=clean_string)
@@ -844,7 +1053,8 @@ class ANSIString(with_metaclass(ANSIMeta, unicode)):
         replayed.
 
         """
-        slice_indexes = self._char_indexes[slc]
+        char_indexes = self._char_indexes
+        slice_indexes = char_indexes[slc]
         # If it's the end of the string, we need to append final color codes.
         if not slice_indexes:
             return ANSIString('')
@@ -852,21 +1062,22 @@ class ANSIString(with_metaclass(ANSIMeta, unicode)):
             string = self[slc.start]._raw_string
         except IndexError:
             return ANSIString('')
+        raw_string = self._raw_string
         last_mark = slice_indexes[0]
-        # Check between the slice intervals for escape sequences.
-        i = None
-        for i in slice_indexes[1:]:
-            for index in range(last_mark, i):
-                if index in self._code_indexes:
-                    string += self._raw_string[index]
-            last_mark = i
-            try:
-                string += self._raw_string[i]
-            except IndexError:
-                # raw_string not long enough
-                pass
-        if i is not None:
-            append_tail = self._get_interleving(self._char_indexes.index(i) + 1)
+        if slc.step in (None, 1):
+            # Everything between the first and last character is kept.
+            string += raw_string[last_mark + 1:slice_indexes[-1] + 1]
+            last_mark = slice_indexes[-1]
+        else:
+            # Check between the slice intervals for escape sequences.
+            code_indexes = self._code_indexes
+            for i in slice_indexes[1:]:
+                codes = code_indexes[bisect_left(code_indexes, last_mark):
+                                     bisect_left(code_indexes, i)]
+                string += "".join(raw_string[index] for index in codes) + raw_string[i]
+                last_mark = i
+        if len(slice_indexes) > 1:
+            append_tail = self._get_interleving(bisect_left(char_indexes, last_mark) + 1)
         else:
             append_tail = ''
         return ANSIString(string + append_tail, decoded=True)
@@ -882,24 +1093,23 @@ class ANSIString(with_metaclass(ANSIMeta, unicode)):
         if isinstance(item, slice):
             # Slices must be handled specially.
             return self._slice(item)
+        char_indexes = self._char_indexes
         try:
-            self._char_indexes[item]
+            index = char_indexes[item]
         except IndexError:
             raise IndexError("ANSIString Index out of range")
         # Get character codes after the index as well.
-        if self._char_indexes[-1] == self._char_indexes[item]:
+        if char_indexes[-1] == index:
             append_tail = self._get_interleving(item + 1)
         else:
             append_tail = ''
-        item = self._char_indexes[item]
 
-        clean = self._raw_string[item]
-        result = ''
+        raw_string = self._raw_string
+        code_indexes = self._code_indexes
+        clean = raw_string[index]
         # Get the character they're after, and replay all escape sequences
         # previous to it.
-        for index in range(0, item + 1):
-            if index in self._code_indexes:
-                result += self._raw_string[index]
+        result = "".join(raw_string[i] for i in code_indexes[:bisect_left(code_indexes, index)])
         return ANSIString(result + clean + append_tail, decoded=True)
 
     def clean(self):
@@ -974,14 +1184,16 @@ class ANSIString(with_metaclass(ANSIMeta, unicode)):
 
         """
 
-        code_indexes = []
-        for match in self.parser.ansi_regex.finditer(self._raw_string):
-            code_indexes.extend(range(match.start(), match.end()))
-        if not code_indexes:
-            # Plain string, no ANSI codes.
-            return code_indexes, list(range(0, len(self._raw_string)))
+        raw_string = self._raw_string
+        code_indexes, char_indexes = array('I'), array('I')
+        last = 0
+        for match in self.parser.ansi_regex.finditer(raw_string):
+            start, end = match.span()
+            char_indexes.extend(xrange(last, start))
+            code_indexes.extend(xrange(start, end))
+            last = end
         # all indexes not occupied by ansi codes are normal characters
-        char_indexes = [i for i in range(len(self._raw_string)) if i not in code_indexes]
+        char_indexes.extend(xrange(last, len(raw_string)))
         return code_indexes, char_indexes
 
     def _get_interleving(self, index):
@@ -990,20 +1202,17 @@ class ANSIString(with_metaclass(ANSIMeta, unicode)):
         character.
 
         """
+        char_indexes = self._char_indexes
         try:
-            index = self._char_indexes[index - 1]
+            start = char_indexes[index - 1] + 1
         except IndexError:
             return ''
-        s = ''
-        while True:
-            index += 1
-            if index in self._char_indexes:
-                break
-            elif index in self._code_indexes:
-                s += self._raw_string[index]
-            else:
-                break
-        return s
+        # everything up to the next character is escape codes
+        if index <= 0:
+            index += len(char_indexes)
+        if index < len(char_indexes):
+            return self._raw_string[start:char_indexes[index]]
+        return self._raw_string[start:]
 
     def __mul__(self, other):
         """
@@ -1014,9 +1223,11 @@ class ANSIString(with_metaclass(ANSIMeta, unicode)):
             return NotImplemented
         raw_string = self._raw_string * other
         clean_string = self._clean_string * other
+        if self._indexes is None:
+            return ANSIString(raw_string, clean_string=clean_string)
         code_indexes = self._code_indexes[:]
         char_indexes = self._char_indexes[:]
-        for i in range(1, other + 1):
+        for i in range(1, other):
             code_indexes.extend(
                 self._shifter(self._code_indexes, i * len(self._raw_string)))
             char_indexes.extend(
@@ -1271,9 +1482,7 @@ class ANSIString(with_metaclass(ANSIMeta, unicode)):
         """
         if not isinstance(char, ANSIString):
             line = char * amount
-            return ANSIString(
-                char * amount, code_indexes=[], char_indexes=list(range(0, len(line))),
-                clean_string=char)
+            return ANSIString(line, clean_string=line)
         try:
             start = char._code_indexes[0]
         except IndexError:
@@ -1282,10 +1491,10 @@ class ANSIString(with_metaclass(ANSIMeta, unicode)):
         prefix = char._raw_string[start:end]
         postfix = char._raw_string[end + 1:]
         line = char._clean_string * amount
-        code_indexes = [i for i in range(0, len(prefix))]
         length = len(prefix) + len(line)
-        code_indexes.extend([i for i in range(length, length + len(postfix))])
-        char_indexes = self._shifter(range(0, len(line)), len(prefix))
+        code_indexes = array('I', xrange(len(prefix)))
+        code_indexes.extend(xrange(length, length + len(postfix)))
+        char_indexes = array('I', xrange(len(prefix), length))
         raw_string = prefix + line + postfix
         return ANSIString(
             raw_string, clean_string=line, char_indexes=char_indexes,
@@ -14,6 +14,7 @@ import os
 import threading
 import gc
 import time
+from collections import OrderedDict
 from weakref import WeakValueDictionary
 from twisted.internet.reactor import callFromThread
 from django.core.exceptions import ObjectDoesNotExist, FieldError
@@ -86,6 +87,19 @@ class SharedMemoryModelBase(ModelBase):
             # we store __instance_cache__ only on the dbmodel base
             dbmodel.__instance_cache__ = {}
         super(SharedMemoryModelBase, cls)._prepare()
+        # find the at_<fieldname>_postsave hooks once, so save() doesn't
+        # have to look for them every time
+        postsave_hooks = OrderedDict()
+        postsave_attnames = {}
+        for field in cls._meta.fields:
+            hookname = "at_%s_postsave" % field.name
+            if callable(getattr(cls, hookname, None)):
+                postsave_hooks[field.name] = hookname
+            if field.attname != field.name:
+                # update_fields may also name a field by its attname
+                postsave_attnames[field.attname] = field.name
+        cls._postsave_hooks = postsave_hooks
+        cls._postsave_attnames = postsave_attnames
 
     def __new__(cls, name, bases, attrs):
         """
@@ -372,9 +386,9 @@ class SharedMemoryModel(with_metaclass(SharedMemoryModelBase, Model)):
 
         Notes:
             Arguments as per Django documentation.
-            Calls `self.at_<fieldname>_postsave(new)`
-            (this is a wrapper set by oobhandler:
-            self._oob_at_<fieldname>_postsave())
+            Calls `self.at_<fieldname>_postsave(new)` for the saved
+            fields that have such a hook. The hooks are looked up when
+            the class is created.
 
         """
         global _MONITOR_HANDLER
@@ -399,22 +413,24 @@ class SharedMemoryModel(with_metaclass(SharedMemoryModelBase, Model)):
 
         # update field-update hooks and eventual OOB watchers
         new = False
+        postsave_hooks = self._postsave_hooks
+        # look up the monitors of this object once rather than per field
+        monitored = _MONITOR_HANDLER.monitors and self in _MONITOR_HANDLER.monitors
         if "update_fields" in kwargs and kwargs["update_fields"]:
-            # get field objects from their names
-            update_fields = (self._meta.get_field(fieldname)
-                             for fieldname in kwargs.get("update_fields"))
+            postsave_attnames = self._postsave_attnames
+            update_fields = (postsave_attnames.get(fieldname, fieldname)
+                             for fieldname in kwargs["update_fields"])
         else:
-            # meta.fields are already field objects; get them all
             new = True
-            update_fields = self._meta.fields
-        for field in update_fields:
-            fieldname = field.name
+            # without monitors, only the fields with hooks need a visit
+            update_fields = ((field.name for field in self._meta.fields)
+                             if monitored else postsave_hooks)
+        for fieldname in update_fields:
             # trigger eventual monitors
-            _MONITOR_HANDLER.at_update(self, fieldname)
-            # if a hook is defined it must be named exactly on this form
-            hookname = "at_%s_postsave" % fieldname
-            if hasattr(self, hookname) and callable(_GA(self, hookname)):
-                _GA(self, hookname)(new)
+            if monitored:
+                _MONITOR_HANDLER.at_update(self, fieldname)
+            if fieldname in postsave_hooks:
+                _GA(self, postsave_hooks[fieldname])(new)
 
 #            # if a trackerhandler is set on this object, update it with the
 #            # fieldname and the new value
@@ -2,9 +2,12 @@ from __future__ import absolute_import
 from builtins import range
 
 from django.test import TestCase
+from mock import patch
 
 from .models import SharedMemoryModel
 from django.db import models
+from evennia.objects.models import ObjectDB
+from evennia.utils.test_resources import EvenniaTest
 
 
 class Category(SharedMemoryModel):
@@ -75,3 +78,22 @@ class SharedMemorysTest(TestCase):
         pk = article.pk
         article.delete()
         self.assertEquals(pk not in Article.__instance_cache__, True)
+
+
+class PostsaveHooksTest(EvenniaTest):
+
+    def testHookLookup(self):
+        self.assertEqual(list(ObjectDB._postsave_hooks), ["db_location"])
+        self.assertEqual(type(self.obj1)._postsave_hooks, ObjectDB._postsave_hooks)
+        self.assertEqual(ObjectDB._postsave_attnames["db_location_id"], "db_location")
+        self.assertEqual(list(Article._postsave_hooks), [])
+
+    def testHookCalls(self):
+        with patch.object(ObjectDB, "at_db_location_postsave") as hook:
+            self.obj1.key = "New name"
+            self.assertFalse(hook.called)
+            self.obj1.location = self.room2
+            hook.assert_called_once_with(False)
+            self.obj1.save(update_fields=["db_location_id"])
+            self.obj1.save()
+            self.assertEqual(hook.call_args_list[1:], [((False,),), ((True,),)])
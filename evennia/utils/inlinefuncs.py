@@ -62,6 +62,7 @@ Error handling:
 
 import re
 import fnmatch
+from collections import OrderedDict
 from django.conf import settings
 
 from evennia.utils import utils, logger
@@ -224,8 +225,10 @@ _RE_TOKEN = re.compile(r"""
             \$(?!\w+\()|\'|\"|\\|[^),$\'\"\\\(]+)""",
                        re.UNICODE | re.IGNORECASE | re.VERBOSE | re.DOTALL)
 
-# Cache for function lookups.
-_PARSING_CACHE = utils.LimitedSizeOrderedDict(size_limit=1000)
+# LRU cache of compiled templates for the default inlinefuncs, keyed
+# on `(string, strip)`.
+_PARSING_CACHE = OrderedDict()
+_PARSING_CACHE_SIZE = 1000
 
 
 class ParseStack(list):
@@ -279,43 +282,90 @@ class InlinefuncError(RuntimeError):
     pass
 
 
-def parse_inlinefunc(string, strip=False, available_funcs=None, stacktrace=False, **kwargs):
+def _compile_parts(items):
     """
-    Parse the incoming string.
+    Convert items of a parsed stack to a template part.
 
     Args:
-        string (str): The incoming string to parse.
+        items (list): Strings and `(func, arglist)` tuples.
+
+    Returns:
+        part (str or tuple): A string if there are no function calls
+            among the items, otherwise a tuple of strings and compiled
+            `(func, args)` calls.
+
+    """
+    parts = []
+    for item in items:
+        if isinstance(item, tuple):
+            func, arglist = item
+            args = [[]]
+            for arg in arglist:
+                if arg is None:
+                    # an argument-separating comma - start a new arg
+                    args.append([])
+                else:
+                    args[-1].append(arg)
+            parts.append((func, tuple(_compile_parts(arg) for arg in args)))
+        else:
+            item = utils.to_str(item, force_string=True)
+            if parts and isinstance(parts[-1], basestring):
+                parts[-1] += item
+            elif item:
+                parts.append(item)
+    if not parts:
+        return ""
+    if len(parts) == 1 and isinstance(parts[0], basestring):
+        return parts[0]
+    return tuple(parts)
+
+
+def compile_inlinefunc(string, strip=False, available_funcs=None, stacktrace=False):
+    """
+    Parse a string into a template that can be run with `run_inlinefunc`.
+    Compiling with the default inlinefuncs is cached, so a string
+    sent to many sessions is only parsed once.
+
+    Args:
+        string (str): The string to compile.
         strip (bool, optional): Whether to strip function calls rather than
             execute them.
         available_funcs (dict, optional): Define an alternative source of functions to parse for.
             If unset, use the functions found through `settings.INLINEFUNC_MODULES`.
-        stacktrace (bool, optional): If set, print the stacktrace to log.
-    Kwargs:
-        session (Session): This is sent to this function by Evennia when triggering
-            it. It is passed to the inlinefunc.
-        kwargs (any): All other kwargs are also passed on to the inlinefunc.
+        stacktrace (bool, optional): If set, print the stacktrace to log. This
+            also bypasses the cache.
 
+    Returns:
+        template (str, tuple or None): `None` if the string should be left
+            as it is (it has no complete inlinefuncs), otherwise the
+            string with the function calls compiled in.
 
     """
-    global _PARSING_CACHE
     usecache = False
     if not available_funcs:
         available_funcs = _INLINE_FUNCS
-        usecache = True
+        usecache = not stacktrace
     else:
         # make sure the default keys are available, but also allow overriding
         tmp = _DEFAULT_FUNCS.copy()
         tmp.update(available_funcs)
         available_funcs = tmp
 
-    if usecache and string in _PARSING_CACHE:
-        # stack is already cached
-        stack = _PARSING_CACHE[string]
-    elif not _RE_STARTTOKEN.search(string):
+    if usecache:
+        key = (string, strip)
+        try:
+            # mark as recently used
+            template = _PARSING_CACHE.pop(key)
+        except KeyError:
+            pass
+        else:
+            _PARSING_CACHE[key] = template
+            return template
+
+    if not _RE_STARTTOKEN.search(string):
         # if there are no unescaped start tokens at all, return immediately.
-        return string
+        template = None
     else:
-        # no cached stack; build a new stack and continue
         stack = ParseStack()
 
         # process string on stack
@@ -393,42 +443,86 @@ def parse_inlinefunc(string, strip=False, available_funcs=None, stacktrace=False
 
         if ncallable > 0:
             # this means not all inlinefuncs were complete
-            return string
-
-        if _STACK_MAXSIZE > 0 and _STACK_MAXSIZE < nvalid:
+            template = None
+        elif _STACK_MAXSIZE > 0 and _STACK_MAXSIZE < nvalid:
             # if stack is larger than limit, throw away parsing
-            return string + available_funcs["stackfull"](*args, **kwargs)
-        elif usecache:
-            # cache the stack - we do this also if we don't check the cache above
-            _PARSING_CACHE[string] = stack
-
-    # run the stack recursively
-    def _run_stack(item, depth=0):
-        retval = item
-        if isinstance(item, tuple):
-            if strip:
-                return ""
-            else:
-                func, arglist = item
-                args = [""]
-                for arg in arglist:
-                    if arg is None:
-                        # an argument-separating comma - start a new arg
-                        args.append("")
-                    else:
-                        # all other args should merge into one string
-                        args[-1] += _run_stack(arg, depth=depth + 1)
-                # execute the inlinefunc at this point or strip it.
-                kwargs["inlinefunc_stack_depth"] = depth
-                retval = "" if strip else func(*args, **kwargs)
-        return utils.to_str(retval, force_string=True)
-    retval = "".join(_run_stack(item) for item in stack)
+            template = _compile_parts([string, (available_funcs["stackfull"], [])])
+        else:
+            template = _compile_parts(stack)
+
+        if stacktrace:
+            out = "STACK: \n{} => {}\n".format(stack, template)
+            print(out)
+            logger.log_info(out)
+
+    if usecache:
+        _PARSING_CACHE[key] = template
+        if len(_PARSING_CACHE) > _PARSING_CACHE_SIZE:
+            _PARSING_CACHE.popitem(last=False)
+    return template
+
+
+def run_inlinefunc(template, depth=0, **kwargs):
+    """
+    Execute the function calls of a compiled template.
+
+    Args:
+        template (str or tuple): A template from `compile_inlinefunc`.
+        depth (int, optional): The nesting depth of the template.
+    Kwargs:
+        session (Session): This is sent to this function by Evennia when triggering
+            it. It is passed to the inlinefunc.
+        kwargs (any): All other kwargs are also passed on to the inlinefunc.
+
+    Returns:
+        result (str): The string with all function calls replaced by their
+            results.
+
+    """
+    if isinstance(template, basestring):
+        return template
+    result = []
+    for part in template:
+        if isinstance(part, basestring):
+            result.append(part)
+        else:
+            func, args = part
+            args = [run_inlinefunc(arg, depth=depth + 1, **kwargs) for arg in args]
+            kwargs["inlinefunc_stack_depth"] = depth
+            result.append(utils.to_str(func(*args, **kwargs), force_string=True))
+    return "".join(result)
+
+
+def parse_inlinefunc(string, strip=False, available_funcs=None, stacktrace=False, **kwargs):
+    """
+    Parse the incoming string.
+
+    Args:
+        string (str): The incoming string to parse.
+        strip (bool, optional): Whether to strip function calls rather than
+            execute them.
+        available_funcs (dict, optional): Define an alternative source of functions to parse for.
+            If unset, use the functions found through `settings.INLINEFUNC_MODULES`.
+        stacktrace (bool, optional): If set, print the stacktrace to log.
+    Kwargs:
+        session (Session): This is sent to this function by Evennia when triggering
+            it. It is passed to the inlinefunc.
+        kwargs (any): All other kwargs are also passed on to the inlinefunc.
+
+
+    """
+    if "$" not in string:
+        # no inlinefuncs possible
+        return string
+    template = compile_inlinefunc(string, strip=strip, available_funcs=available_funcs,
+                                  stacktrace=stacktrace)
+    if template is None:
+        return string
+    retval = run_inlinefunc(template, **kwargs)
     if stacktrace:
-        out = "STACK: \n{} => {}\n".format(stack, retval)
+        out = "RESULT: {}\n".format(retval)
         print(out)
         logger.log_info(out)
-
-    # execute the stack
     return retval
 
 #
@@ -3,9 +3,12 @@ Unit tests for all sorts of inline text-tag parsing, like ANSI, html conversion,
 
 """
 import re
+import random
+from mock import patch
 from django.test import TestCase
+from evennia.utils import ansi
 from evennia.utils.ansi import ANSIString
-from evennia.utils.text2html import TextToHTMLparser
+from evennia.utils.text2html import TextToHTMLparser, HTML_PARSER, parse_html
 from evennia.utils import inlinefuncs
 
 
@@ -22,8 +25,8 @@ class ANSIStringTestCase(TestCase):
         """
         Verifies the indexes in an ANSIString match what they should.
         """
-        self.assertEqual(ansi._char_indexes, char)
-        self.assertEqual(ansi._code_indexes, code)
+        self.assertEqual(list(ansi._char_indexes), char)
+        self.assertEqual(list(ansi._code_indexes), code)
 
     def test_instance(self):
         """
@@ -157,6 +160,110 @@ class ANSIStringTestCase(TestCase):
         self.assertEqual(a.rstrip(), ANSIString("   |r   Test of stuff |b with spaces|n"))
         self.assertEqual(b.strip(), b)
 
+    def test_lazy_indexes(self):
+        """
+        Test that the index tables are only built when needed, and are
+        shared with derived strings.
+        """
+        a = ANSIString("|rTest|n")
+        padded = a.ljust(8)
+        self.assertIsNone(a._indexes)
+        self.assertIsNone(padded._indexes)
+        self.checker(padded, u'\x1b[1m\x1b[31mTest\x1b[0m    ', u'Test    ')
+        self.assertEqual(len(padded), 8)
+        self.checker(padded[1:6], u'\x1b[1m\x1b[31mest\x1b[0m  ', u'est  ')
+        self.table_check(padded, [9, 10, 11, 12, 17, 18, 19, 20],
+                         [0, 1, 2, 3, 4, 5, 6, 7, 8, 13, 14, 15, 16])
+        upper = padded.upper()
+        self.assertIs(upper._char_indexes, padded._char_indexes)
+        self.checker(upper, u'\x1b[1m\x1b[31mTEST\x1b[0m    ', u'TEST    ')
+        self.table_check(a * 2, [9, 10, 11, 12, 26, 27, 28, 29],
+                         [0, 1, 2, 3, 4, 5, 6, 7, 8, 13, 14, 15, 16, 17, 18, 19, 20,
+                          21, 22, 23, 24, 25, 30, 31, 32, 33])
+
+
+class TestANSIParser(TestCase):
+    """
+    Test that the single-pass tokenizer gives the same result as
+    parsing the markup one kind at a time.
+    """
+    # markup, escapes and their edge cases, also next to each other
+    corpus = [
+        "|rRed|n and |!Gdark green|n on |[Bblue|n", "|123|[234xterm|=a|[=z|n",
+        "|[rbright|[x||[r|||[r\\|[r{{|[r", "||r {{r \\r |||r {{{r \\\\|r",
+        "|600 |[6 |[= |=A |! |[ | |", "|/|-|_|*|^|u|h|H",
+        "|lclook|ltLook|le and |lc|rred|lt|gthe |||lt|n|le",
+        "raw \033[1mcodes\033[0m and \033[|n1m", u"unicode |r\xe5\xe4\xf6|n"]
+    alphabet = list("|||||[[=!\\{{0123456rgbymcwxRGBYMCWXaznhH/-_*^ulcte;m ") + [
+        "\033[", "\033[0m", "|lc", "|lt", "|le"]
+
+    def setUp(self):
+        self.parser = ansi.ANSIParser()
+
+    def _multipass(self, string, strip_ansi, xterm256, mxp):
+        parsed = self.parser.sub_markup_multipass(string, xterm256)
+        if not mxp:
+            parsed = self.parser.strip_mxp(parsed)
+        if strip_ansi:
+            parsed = self.parser.strip_raw_codes(parsed)
+        return parsed
+
+    def _check(self, string):
+        for strip_ansi in (False, True):
+            for xterm256 in (False, True):
+                for mxp in (False, True):
+                    ansi._PARSE_CACHE.clear()
+                    self.assertEqual(
+                        self.parser.parse_ansi(string, strip_ansi=strip_ansi,
+                                               xterm256=xterm256, mxp=mxp),
+                        self._multipass(string, strip_ansi, xterm256, mxp),
+                        "%r (strip_ansi=%s, xterm256=%s, mxp=%s)" % (string, strip_ansi, xterm256, mxp))
+
+    def test_tokenizer(self):
+        self.assertIsNotNone(self.parser.tokenizer)
+        for string in self.corpus:
+            self._check(string)
+
+    def test_fuzz(self):
+        rand = random.Random(1024)
+        for _ in range(2000):
+            self._check("".join(rand.choice(self.alphabet) for _ in range(rand.randint(1, 25))))
+
+    def test_custom_xterm256(self):
+        class CurlyParser(ansi.ANSIParser):
+            xterm256_fg = [r'\{([0-5])([0-5])([0-5])']
+            xterm256_fg_sub = re.compile(xterm256_fg[0])
+        parser = CurlyParser()
+        self.assertIsNone(parser.tokenizer)
+        self.assertEqual(parser.parse_ansi("{500red|n", xterm256=True), "\033[38;5;196mred\033[0m")
+
+
+    @patch("evennia.utils.ansi._PARSE_CACHE_SIZE", 2)
+    def test_parse_cache(self):
+        ansi._PARSE_CACHE.clear()
+        stats = ansi.parse_cache_stats()
+        parser = self.parser
+        self.assertEqual(parser.parse_ansi("|rred", strip_ansi=True), "red")
+        parser.parse_ansi("|rred")
+        self.assertEqual(ansi._PARSE_CACHE.keys(), [("|rred", True, False, False, parser),
+                                                    ("|rred", False, False, False, parser)])
+        # a hit makes the result the most recently used
+        self.assertEqual(parser.parse_ansi("|rred", strip_ansi=True), "red")
+        parser.parse_ansi("|ggreen")
+        self.assertEqual(ansi._PARSE_CACHE.keys(), [("|rred", True, False, False, parser),
+                                                    ("|ggreen", False, False, False, parser)])
+        new_stats = ansi.parse_cache_stats()
+        self.assertEqual(new_stats["hits"] - stats["hits"], 1)
+        self.assertEqual(new_stats["misses"] - stats["misses"], 3)
+        self.assertEqual((new_stats["size"], new_stats["maxsize"]), (2, 2))
+
+    def test_parse_html_cache(self):
+        ansi._PARSE_CACHE.clear()
+        html = parse_html("|rred")
+        self.assertEqual(ansi.get_cached_parse(("|rred", False, HTML_PARSER)), html)
+        # an ANSIString equals its clean string, so it's not cached
+        self.assertEqual(parse_html("red"), "red")
+        self.assertEqual(parse_html(ANSIString("|rred")), html)
 
 class TestTextToHTMLparser(TestCase):
     def setUp(self):
@@ -240,6 +347,26 @@ class TestTextToHTMLparser(TestCase):
                          '</span><a href="http://example.com/" target="_blank">'
                          'http://example.com/</a><span class="red">')
 
+    def test_convert_ansi(self):
+        text = ansi.parse_ansi("|rred |[Bon blue|u under|n |=mgrey|h bold", xterm256=True)
+        self.assertEqual(self.parser.convert_ansi(text),
+                         '<span class="color-009">red <span class="bgcolor-004">on blue'
+                         '<span class="underline"> under</span></span> <span class="color-243">'
+                         'grey<strong> bold</span></strong></span>')
+
+    def test_convert_ansi_fuzz(self):
+        # the single pass must give the same html as the regexes
+        rand = random.Random(512)
+        alphabet = ["|r", "|R", "|!r", "|[R", "|[r", "|123", "|[234", "|=c", "|[=d", "|n", "|h",
+                    "|H", "|u", "|^", "|*", "|/", " ", "a", "<", "|lclook|ltLook|le", "\033[39m"]
+        for _ in range(1000):
+            text = ansi.parse_ansi("".join(rand.choice(alphabet) for _ in range(rand.randint(1, 14))),
+                                   xterm256=True, mxp=True)
+            text = re.sub(self.parser.re_string, self.parser.sub_text, text)
+            text = re.sub(self.parser.re_mxplink, self.parser.sub_mxp_links, text)
+            self.assertEqual(self.parser.convert_ansi(text),
+                             self.parser.convert_ansi_multipass(text), repr(text))
+
 
 class TestInlineFuncs(TestCase):
     """Test the nested inlinefunc module"""
@@ -274,4 +401,45 @@ class TestInlineFuncs(TestCase):
             'this should be $pad("""escaped,""" and """instead,""" cropped $crop(with a long,5) text., 80)'),
             "this should be                    escaped, and instead, cropped with  text.                    ")
 
+    def test_compiled(self):
+        string = "You see $pad($crop(a long name, 6), 10) here, $name()."
+        calls = []
+
+        def _name(*args, **kwargs):
+            calls.append(kwargs["inlinefunc_stack_depth"])
+            return kwargs["session"]
+
+        funcs = {"pad": inlinefuncs.pad, "crop": inlinefuncs.crop, "name": _name}
+        template = inlinefuncs.compile_inlinefunc(string, available_funcs=funcs)
+        self.assertEqual(template[0], "You see ")
+        self.assertEqual(template[2], " here, ")
+        # the template can be run with different kwargs
+        self.assertEqual(inlinefuncs.run_inlinefunc(template, session="Anna"),
+                         "You see   a[...]   here, Anna.")
+        self.assertEqual(inlinefuncs.run_inlinefunc(template, session="Bob"),
+                         "You see   a[...]   here, Bob.")
+        self.assertEqual(calls, [0, 0])
+        self.assertEqual(inlinefuncs.compile_inlinefunc(string, strip=True, available_funcs=funcs),
+                         "You see  here, .")
+        self.assertIsNone(inlinefuncs.compile_inlinefunc("$pad(unfinished", available_funcs=funcs))
+
+    def test_cache(self):
+        string = "this is a test with $pad(centered, 20) text in it."
+        with patch.object(inlinefuncs, "_PARSING_CACHE_SIZE", 2):
+            inlinefuncs._PARSING_CACHE.clear()
+            self.assertEqual(inlinefuncs.parse_inlinefunc(string, strip=True),
+                             "this is a test with  text in it.")
+            # stripped and executed templates are cached separately
+            self.assertEqual(inlinefuncs.parse_inlinefunc(string),
+                             "this is a test with       centered       text in it.")
+            self.assertEqual(inlinefuncs.parse_inlinefunc(string, strip=True),
+                             "this is a test with  text in it.")
+            inlinefuncs.parse_inlinefunc("$pad(a, 3)")
+            self.assertEqual(list(inlinefuncs._PARSING_CACHE),
+                             [(string, True), ("$pad(a, 3)", False)])
+            # no $ means the cache is never consulted
+            inlinefuncs.parse_inlinefunc("no funcs here")
+            self.assertEqual(len(inlinefuncs._PARSING_CACHE), 2)
+        inlinefuncs._PARSING_CACHE.clear()
+
 
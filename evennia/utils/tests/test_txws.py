@@ -0,0 +1,178 @@
+"""
+Tests for the txws websocket layer, driven by handshakes recorded from
+browsers.
+
+"""
+import zlib
+from mock import patch
+from twisted.internet.protocol import Protocol, Factory
+from twisted.test import proto_helpers
+from django.test import TestCase
+
+from evennia.utils import txws
+
+# recorded browser handshakes (a few uninteresting headers removed)
+_CHROME_HANDSHAKE = (
+    "GET /?a0b1c2 HTTP/1.1\r\n"
+    "Host: localhost:4002\r\n"
+    "Connection: Upgrade\r\n"
+    "Pragma: no-cache\r\n"
+    "Cache-Control: no-cache\r\n"
+    "Upgrade: websocket\r\n"
+    "Origin: http://localhost:4001\r\n"
+    "Sec-WebSocket-Version: 13\r\n"
+    "User-Agent: Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 "
+    "(KHTML, like Gecko) Chrome/69.0.3497.100 Safari/537.36\r\n"
+    "Accept-Encoding: gzip, deflate, br\r\n"
+    "Accept-Language: en-US,en;q=0.9\r\n"
+    "Sec-WebSocket-Key: dGhlIHNhbXBsZSBub25jZQ==\r\n"
+    "Sec-WebSocket-Extensions: permessage-deflate; client_max_window_bits\r\n\r\n")
+
+_FIREFOX_HANDSHAKE = (
+    "GET /?a0b1c2 HTTP/1.1\r\n"
+    "Host: localhost:4002\r\n"
+    "User-Agent: Mozilla/5.0 (X11; Ubuntu; Linux x86_64; rv:62.0) Gecko/20100101 Firefox/62.0\r\n"
+    "Accept: */*\r\n"
+    "Accept-Language: en-US,en;q=0.5\r\n"
+    "Accept-Encoding: gzip, deflate\r\n"
+    "Sec-WebSocket-Version: 13\r\n"
+    "Origin: http://localhost:4001\r\n"
+    "Sec-WebSocket-Extensions: permessage-deflate\r\n"
+    "Sec-WebSocket-Key: dGhlIHNhbXBsZSBub25jZQ==\r\n"
+    "Connection: keep-alive, Upgrade\r\n"
+    "Pragma: no-cache\r\n"
+    "Cache-Control: no-cache\r\n"
+    "Upgrade: websocket\r\n\r\n")
+
+_OLD_SAFARI_HANDSHAKE = (
+    "GET /?a0b1c2 HTTP/1.1\r\n"
+    "Host: localhost:4002\r\n"
+    "Upgrade: websocket\r\n"
+    "Connection: Upgrade\r\n"
+    "Origin: http://localhost:4001\r\n"
+    "Sec-WebSocket-Version: 13\r\n"
+    "Sec-WebSocket-Key: dGhlIHNhbXBsZSBub25jZQ==\r\n"
+    "Sec-WebSocket-Extensions: x-webkit-deflate-frame\r\n\r\n")
+
+_MASK = "\x37\xfa\x21\x3d"
+
+
+def _client_frame(payload, header="\xc1"):
+    "Make a masked client frame"
+    return header + chr(0x80 | len(payload)) + _MASK + txws.mask(payload, _MASK)
+
+
+class _Receiver(Protocol):
+    "Collects the data passed through the websocket layer"
+    def connectionMade(self):
+        self.received = []
+        self.transport.validationMade = lambda: None
+
+    def dataReceived(self, data):
+        self.received.append(data)
+
+
+class TestWebSocketDeflate(TestCase):
+    """
+    Test permessage-deflate (RFC 7692) negotiation and framing.
+    """
+    def _connect(self, handshake, **kwargs):
+        factory = Factory()
+        factory.protocol = _Receiver
+        self.proto = txws.WebSocketFactory(factory, **kwargs).buildProtocol(("127.0.0.1", 0))
+        self.transport = proto_helpers.StringTransport()
+        self.proto.makeConnection(self.transport)
+        self.proto.dataReceived(handshake)
+        response = self.transport.value()
+        self.transport.clear()
+        return response
+
+    def test_chrome(self):
+        response = self._connect(_CHROME_HANDSHAKE, deflate=True, deflate_max_wbits=12)
+        self.assertIn("Sec-WebSocket-Accept: s3pPLMBiTxaQ9kYGzzhZRbK+xOo=\r\n\r\n", response)
+        self.assertIn("Sec-WebSocket-Extensions: permessage-deflate; server_max_window_bits=12; "
+                      "client_max_window_bits=12\r\n", response)
+        # the example messages of RFC 7692, sharing context
+        self.proto.dataReceived(_client_frame("\xf2\x48\xcd\xc9\xc9\x07\x00"))
+        self.proto.dataReceived(_client_frame("\xf2\x00\x11\x00\x00"))
+        # a fragmented message and an uncompressed one
+        self.proto.dataReceived(_client_frame("\xf2\x48\xcd", header="\x41") +
+                                _client_frame("\xc9\xc9\x07\x00", header="\x80"))
+        self.proto.dataReceived(_client_frame("Plain", header="\x81"))
+        self.assertEqual(self.proto.wrappedProtocol.received, ["Hello"] * 3 + ["Plain"])
+
+    def test_send(self):
+        self._connect(_FIREFOX_HANDSHAKE, deflate=True, deflate_max_wbits=12)
+        decompressor = zlib.decompressobj(-12)
+        for text in ("Hello World", "Hello World"):
+            self.proto.write(text)
+            frame = self.transport.value()
+            self.transport.clear()
+            # a final text frame with RSV1 set
+            self.assertEqual(frame[0], "\xc1")
+            length = ord(frame[1])
+            self.assertEqual(len(frame), length + 2)
+            self.assertEqual(decompressor.decompress(frame[2:] + txws.DEFLATE_TAIL), text)
+        # the second message reuses the context of the first
+        self.assertTrue(length < len(text))
+
+    def test_no_deflate(self):
+        # offer not understood
+        response = self._connect(_OLD_SAFARI_HANDSHAKE, deflate=True)
+        self.assertNotIn("Sec-WebSocket-Extensions", response)
+        # not enabled
+        response = self._connect(_CHROME_HANDSHAKE)
+        self.assertNotIn("Sec-WebSocket-Extensions", response)
+        self.proto.write("Hello")
+        self.assertEqual(self.transport.value(), "\x81\x05Hello")
+        # compressed frames are refused without the extension
+        self.proto.dataReceived(_client_frame("\xf2\x48\xcd\xc9\xc9\x07\x00"))
+        self.assertEqual(self.proto.wrappedProtocol.received, [])
+        self.assertTrue(self.transport.disconnecting)
+
+    def test_accept(self):
+        accept = txws.PerMessageDeflate.accept
+        deflate = accept("permessage-deflate; server_no_context_takeover; "
+                         "server_max_window_bits=10", max_wbits=12)
+        self.assertEqual((deflate.server_wbits, deflate.client_wbits), (10, 15))
+        self.assertEqual(deflate.response(), "permessage-deflate; server_max_window_bits=10; "
+                                             "server_no_context_takeover")
+        # the first acceptable offer is used
+        deflate = accept("permessage-deflate; server_max_window_bits=8, "
+                         "permessage-deflate; unknown_param, "
+                         "permessage-deflate; client_max_window_bits=\"10\"", max_wbits=12)
+        self.assertEqual((deflate.server_wbits, deflate.client_wbits), (12, 10))
+        self.assertIsNone(accept("permessage-deflate; server_max_window_bits=8"))
+
+    def test_bomb(self):
+        self._connect(_FIREFOX_HANDSHAKE, deflate=True)
+        compressor = zlib.compressobj(9, zlib.DEFLATED, -15)
+        payload = compressor.compress("\x00" * (txws.MAX_INFLATED_SIZE + 1))
+        payload += compressor.flush(zlib.Z_SYNC_FLUSH)[:-4]
+        frame = "\xc1\x7e" + txws.pack(">H", len(payload)) + payload
+        self.proto.dataReceived(frame)
+        self.assertEqual(self.proto.wrappedProtocol.received, [])
+        self.assertTrue(self.transport.disconnecting)
+
+    @patch("evennia.utils.txws.MAX_INFLATED_SIZE", 100)
+    def test_fragment_limit(self):
+        self._connect(_FIREFOX_HANDSHAKE, deflate=True)
+        # fragments are collected up to the limit
+        for _ in range(3):
+            self.proto.dataReceived(_client_frame("a" * 30, header="\x01"))
+        self.assertFalse(self.transport.disconnecting)
+        self.proto.dataReceived(_client_frame("a" * 30, header="\x00"))
+        self.assertEqual(self.proto.wrappedProtocol.received, [])
+        self.assertTrue(self.transport.disconnecting)
+
+    def test_rsv1_not_first_frame(self):
+        # on a continuation frame
+        self._connect(_FIREFOX_HANDSHAKE, deflate=True)
+        self.proto.dataReceived(_client_frame("\xf2\x48\xcd", header="\x41") +
+                                _client_frame("\xc9\xc9\x07\x00", header="\xc0"))
+        self.assertEqual(self.proto.wrappedProtocol.received, [])
+        self.assertTrue(self.transport.disconnecting)
+        # on a control frame
+        self._connect(_FIREFOX_HANDSHAKE, deflate=True)
+        self.proto.dataReceived(_client_frame("", header="\xc9"))
+        self.assertTrue(self.transport.disconnecting)
@@ -13,6 +13,7 @@ from builtins import object
 
 import re
 import cgi
+from collections import OrderedDict
 from .ansi import *
 
 
@@ -97,6 +98,17 @@ class TextToHTMLparser(object):
     re_url = re.compile(r'((?:ftp|www|https?)\W+(?:(?!\.(?:\s|$)|&\w+;)[^"\',;$*^\\(){}<>\[\]\s])+)(\.(?:\s|$)|&\w+;|)')
     re_mxplink = re.compile(r'\|lc(.*?)\|lt(.*?)\|le', re.DOTALL)
 
+    # the ANSI codes sent by the ANSI parser, with any hilite/unhilite
+    # codes leading up to a color. Used for converting in one pass.
+    re_ansi_token = re.compile(r"((?:\033\[1m|\033\[22m)*\033\[[34](?:[0-7]|8;5;[0-9]{1,3})m|"
+                               r"\033\[(?:0|1|22|4|5|7)m)")
+    # formatting codes converted only at their first use, as by the regexes
+    format_tags = OrderedDict(((hilite, ('<strong>', '</strong>')),
+                               (unhilite, ('', '')),
+                               (underline, ('<span class="underline">', '</span>')),
+                               (blink, ('<span class="blink">', '</span>')),
+                               (inverse, ('<span class="inverse">', '</span>'))))
+
     def _sub_fg(self, colormatch):
         code, text = colormatch.groups()
         return r'''<span class="%s">%s</span>''' % (self.fg_colormap.get(code, "err"), text)
@@ -198,6 +210,8 @@ class TextToHTMLparser(object):
             text (str): Processed text.
 
         """
+        if '\010' not in text and '\033[K' not in text:
+            return text
         backspace_or_eol = r'(.\010)|(\033\[K)'
         n = 1
         while n > 0:
@@ -232,6 +246,67 @@ class TextToHTMLparser(object):
         # change pages (and losing our webclient session).
         return self.re_url.sub(r'<a href="\1" target="_blank">\1</a>\2', text)
 
+    def convert_ansi_multipass(self, text):
+        """
+        Convert ANSI colors and formatting to html, one kind at a time.
+
+        Args:
+            text (str): Text to process.
+
+        Returns:
+            text (str): Processed text.
+
+        """
+        result = self.re_color(text)
+        result = self.re_bold(result)
+        result = self.re_underline(result)
+        result = self.re_blinking(result)
+        return self.re_inversing(result)
+
+    def convert_ansi(self, text):
+        """
+        Convert ANSI colors and formatting to html in one pass, giving
+        the same html as `convert_ansi_multipass`. A color lasts until
+        the next color of its kind or a normal code. Formatting lasts
+        to the end of the text and only its first use is converted.
+
+        Args:
+            text (str): Text to process. Line breaks must already have
+                been converted.
+
+        Returns:
+            text (str): Processed text.
+
+        """
+        parts = self.re_ansi_token.split(text)
+        if len(parts) == 1:
+            return text
+        if any('\033' in part for part in parts[::2]):
+            # codes the ANSI parser doesn't send; leave them to the regexes
+            return self.convert_ansi_multipass(text)
+        fg, bg = False, False
+        used_formats = set()
+        for itoken in range(1, len(parts), 2):
+            token = parts[itoken]
+            if token == self.normal:
+                parts[itoken] = '</span>' * (fg + bg)
+                fg, bg = False, False
+            elif token in self.format_tags:
+                if token not in used_formats:
+                    used_formats.add(token)
+                    parts[itoken] = self.format_tags[token][0]
+            elif token[token.rindex('\033') + 2] == '3':
+                parts[itoken] = '%s<span class="%s">' % (
+                    '</span>' if fg else '', self.fg_colormap.get(token, 'err'))
+                fg = True
+            else:
+                parts[itoken] = '%s<span class="%s">' % (
+                    '</span>' if bg else '', self.bg_colormap.get(token, 'err'))
+                bg = True
+        parts.append('</span>' * (fg + bg))
+        parts.extend(tags[1] for code, tags in self.format_tags.items() if code in used_formats)
+        return ''.join(parts)
+
     def sub_mxp_links(self, match):
         """
         Helper method to be passed to re.sub,
@@ -292,11 +367,7 @@ class TextToHTMLparser(object):
         # convert all ansi to html
         result = re.sub(self.re_string, self.sub_text, text)
         result = re.sub(self.re_mxplink, self.sub_mxp_links, result)
-        result = self.re_color(result)
-        result = self.re_bold(result)
-        result = self.re_underline(result)
-        result = self.re_blinking(result)
-        result = self.re_inversing(result)
+        result = self.convert_ansi(result)
         result = self.remove_bells(result)
         result = self.convert_linebreaks(result)
         result = self.remove_backspaces(result)
@@ -316,6 +387,15 @@ HTML_PARSER = TextToHTMLparser()
 
 def parse_html(string, strip_ansi=False, parser=HTML_PARSER):
     """
-    Parses a string, replace ANSI markup with html
+    Parses a string, replace ANSI markup with html. The result is
+    kept in the parse cache shared with ANSI parsing.
     """
-    return parser.parse(string, strip_ansi=strip_ansi)
+    if hasattr(string, '_raw_string'):
+        # an ANSIString equals its clean string, so can't be a cache key
+        return parser.parse(string, strip_ansi=strip_ansi)
+    cachekey = (string, strip_ansi, parser)
+    html = get_cached_parse(cachekey)
+    if html is None:
+        html = parser.parse(string, strip_ansi=strip_ansi)
+        cache_parse(cachekey, html)
+    return html
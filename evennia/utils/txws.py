@@ -26,6 +26,7 @@ from builtins import range
 
 __version__ = "0.7.1"
 
+import zlib
 from base64 import b64encode, b64decode
 from hashlib import md5, sha1
 from string import digits
@@ -86,6 +87,15 @@ decoders = {
     "base64": b64decode,
 }
 
+# RFC 7692 permessage-deflate. Compressed messages end with an empty
+# deflate block, which is stripped before sending and added back when
+# receiving. Messages of MAX_INFLATED_SIZE or more, compressed (summed over
+# their fragments) or inflated, are refused, to keep a client from eating
+# all our memory.
+
+DEFLATE_TAIL = "\x00\x00\xff\xff"
+MAX_INFLATED_SIZE = 1 << 20
+
 # Fake HTTP stuff, and a couple convenience methods for examining fake HTTP
 # headers.
 
@@ -157,6 +167,133 @@ def make_accept(key):
 
     return sha1("%s%s" % (key, guid)).digest().encode("base64").strip()
 
+
+def parse_extensions(header):
+    """
+    Parse a Sec-WebSocket-Extensions header.
+
+    Returns a list of (name, params) tuples, in the order offered. Parameters
+    without a value are set to None.
+    """
+
+    extensions = []
+    for extension in header.split(","):
+        parts = [part.strip() for part in extension.split(";")]
+        if not parts[0]:
+            continue
+        params = {}
+        for param in parts[1:]:
+            key, _, value = param.partition("=")
+            params[key.strip()] = value.strip().strip('"') if value else None
+        extensions.append((parts[0], params))
+    return extensions
+
+
+class PerMessageDeflate(object):
+    """
+    The permessage-deflate extension (RFC 7692) of one connection.
+
+    The window size used in each direction is capped at max_wbits, and the
+    compressor uses memlevel. Together these decide how much memory each
+    connection uses.
+    """
+
+    def __init__(self, server_wbits=15, client_wbits=15, server_no_context_takeover=False,
+                 client_no_context_takeover=False, memlevel=8):
+        self.server_wbits = server_wbits
+        self.client_wbits = client_wbits
+        self.server_no_context_takeover = server_no_context_takeover
+        self.client_no_context_takeover = client_no_context_takeover
+        self.memlevel = memlevel
+        self.compressor = None
+        self.decompressor = None
+
+    @classmethod
+    def accept(cls, header, max_wbits=15, memlevel=8):
+        """
+        Pick the first permessage-deflate offer in a Sec-WebSocket-Extensions
+        header that we can agree to.
+
+        Returns a PerMessageDeflate, or None if no offer was acceptable.
+        """
+
+        # zlib can't make raw deflate streams with a window smaller than 9 bits.
+        max_wbits = min(15, max(9, max_wbits))
+        for name, params in parse_extensions(header):
+            if name != "permessage-deflate":
+                continue
+            try:
+                server_wbits = int(params.pop("server_max_window_bits", None) or 15)
+                client_wbits = params.pop("client_max_window_bits", False)
+                if client_wbits is None:
+                    # the client allows us to pick a size
+                    client_wbits = max_wbits
+                elif client_wbits:
+                    client_wbits = min(max_wbits, int(client_wbits))
+                else:
+                    # the client will use the full window
+                    client_wbits = 15
+            except ValueError:
+                continue
+            server_no_context_takeover = "server_no_context_takeover" in params
+            client_no_context_takeover = "client_no_context_takeover" in params
+            params.pop("server_no_context_takeover", None)
+            params.pop("client_no_context_takeover", None)
+            if params or not 9 <= server_wbits <= 15 or not 8 <= client_wbits <= 15:
+                # unknown parameters or sizes we can't handle
+                continue
+            return cls(server_wbits=min(max_wbits, server_wbits),
+                       client_wbits=client_wbits,
+                       server_no_context_takeover=server_no_context_takeover,
+                       client_no_context_takeover=client_no_context_takeover,
+                       memlevel=memlevel)
+        return None
+
+    def response(self):
+        """
+        The Sec-WebSocket-Extensions value accepting this extension.
+        """
+
+        params = ["permessage-deflate",
+                  "server_max_window_bits=%d" % self.server_wbits]
+        if self.client_wbits < 15:
+            params.append("client_max_window_bits=%d" % self.client_wbits)
+        if self.server_no_context_takeover:
+            params.append("server_no_context_takeover")
+        if self.client_no_context_takeover:
+            params.append("client_no_context_takeover")
+        return "; ".join(params)
+
+    def compress(self, data):
+        """
+        Compress the payload of one message.
+        """
+
+        if not self.compressor:
+            self.compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED,
+                                               -self.server_wbits, self.memlevel)
+        data = self.compressor.compress(data) + self.compressor.flush(zlib.Z_SYNC_FLUSH)
+        if self.server_no_context_takeover:
+            self.compressor = None
+        if data.endswith(DEFLATE_TAIL):
+            data = data[:-4]
+        return data
+
+    def decompress(self, data):
+        """
+        Decompress the payload of one message.
+        """
+
+        if not self.decompressor:
+            # zlib can't inflate with an 8-bit window, but 9 bits work for those too
+            self.decompressor = zlib.decompressobj(-max(9, self.client_wbits))
+        data = self.decompressor.decompress(data + DEFLATE_TAIL, MAX_INFLATED_SIZE)
+        if len(data) >= MAX_INFLATED_SIZE:
+            raise WSException("Compressed message too large")
+        if self.client_no_context_takeover:
+            self.decompressor = None
+        return data
+
 # Frame helpers.
 # Separated out to make unit testing a lot easier.
 # Frames are bonghits in newer WS versions, so helpers are appreciated.
@@ -217,12 +354,12 @@ def mask(buf, key):
     return "".join(buf)
 
 
-def make_hybi07_frame(buf, opcode=0x1):
+def make_hybi07_frame(buf, opcode=0x1, rsv1=False):
     """
     Make a HyBi-07 frame.
 
     This function always creates unmasked frames, and attempts to use the
-    smallest possible lengths.
+    smallest possible lengths. Set rsv1 to mark the frame as compressed.
     """
 
     if len(buf) > 0xffff:
@@ -233,28 +370,36 @@ def make_hybi07_frame(buf, opcode=0x1):
         length = chr(len(buf))
 
     # Always make a normal packet.
-    header = chr(0x80 | opcode)
+    header = chr(0x80 | (0x40 if rsv1 else 0) | opcode)
     frame = "%s%s%s" % (header, length, buf)
     return frame
 
 
-def make_hybi07_frame_dwim(buf):
+def make_hybi07_frame_dwim(buf, deflate=None):
     """
     Make a HyBi-07 frame with binary or text data according to the type of buf.
+
+    If a PerMessageDeflate is given, the frame is compressed with it.
     """
 
     # TODO: eliminate magic numbers.
     if isinstance(buf, str):
-        return make_hybi07_frame(buf, opcode=0x2)
+        opcode = 0x2
     elif isinstance(buf, unicode):
-        return make_hybi07_frame(buf.encode("utf-8"), opcode=0x1)
+        buf, opcode = buf.encode("utf-8"), 0x1
     else:
         raise TypeError("In binary support mode, frame data must be either str or unicode")
+    if deflate:
+        return make_hybi07_frame(deflate.compress(buf), opcode=opcode, rsv1=True)
+    return make_hybi07_frame(buf, opcode=opcode)
 
 
-def parse_hybi07_frames(buf):
+def parse_hybi07_frames(buf, flags=False):
     """
     Parse HyBi-07 frames in a highly compliant manner.
+
+    If flags is set, the RSV1 bit is allowed (it marks compressed messages)
+    and each frame is returned as (opcode, data, fin, rsv1).
     """
 
     start = 0
@@ -268,11 +413,14 @@ def parse_hybi07_frames(buf):
         # Grab the header. This single byte holds some flags nobody cares
         # about, and an opcode which nobody cares about.
         header = ord(buf[start])
-        if header & 0x70:
+        if header & (0x30 if flags else 0x70):
             # At least one of the reserved flags is set. Pork chop sandwiches!
             raise WSException("Reserved flag in HyBi-07 frame (%d)" % header)
             #frames.append(("", CLOSE))
             # return frames, buf
+        if flags and header & 0x40 and (header & 0xf == 0x0 or header & 0x8):
+            # RSV1 only goes on the first frame of a data message
+            raise WSException("RSV1 on continuation or control frame (%d)" % header)
 
         # Get the opcode, and translate it to a local enum which we actually
         # care about.
@@ -337,7 +485,10 @@ def parse_hybi07_frames(buf):
                 # No reason given; use generic data.
                 data = 1000, "No reason given"
 
-        frames.append((opcode, data))
+        if flags:
+            frames.append((opcode, data, bool(header & 0x80), bool(header & 0x40)))
+        else:
+            frames.append((opcode, data))
         start += offset + length
 
     return frames, buf[start:]
@@ -357,10 +508,15 @@ class WebSocketProtocol(ProtocolWrapper):
     state = REQUEST
     flavor = None
     do_binary_frames = False
+    deflate = None
 
     def __init__(self, *args, **kwargs):
         ProtocolWrapper.__init__(self, *args, **kwargs)
         self.pending_frames = []
+        # fragments of an incoming message, when using extensions
+        self.fragments = []
+        self.fragments_size = 0
+        self.fragments_compressed = False
 
     def setBinaryMode(self, mode):
         """
@@ -420,8 +576,26 @@ class WebSocketProtocol(ProtocolWrapper):
         challenge = self.headers["Sec-WebSocket-Key"]
         response = make_accept(challenge)
 
+        self.negotiateExtensions()
+        if self.deflate:
+            self.transport.write("Sec-WebSocket-Extensions: %s\r\n" % self.deflate.response())
         self.transport.write("Sec-WebSocket-Accept: %s\r\n\r\n" % response)
 
+    def negotiateExtensions(self):
+        """
+        Accept permessage-deflate if the client offers it and the factory
+        allows it.
+        """
+
+        if (getattr(self.factory, "deflate", False) and
+                "Sec-WebSocket-Extensions" in self.headers):
+            self.deflate = PerMessageDeflate.accept(
+                self.headers["Sec-WebSocket-Extensions"],
+                max_wbits=self.factory.deflate_max_wbits,
+                memlevel=self.factory.deflate_memlevel)
+            if self.deflate:
+                log.msg("Using permessage-deflate: %s" % self.deflate.response())
+
     def parseFrames(self):
         """
         Find frames in incoming data and pass them to the underlying protocol.
@@ -435,14 +609,40 @@ class WebSocketProtocol(ProtocolWrapper):
             raise WSException("Unknown flavor %r" % self.flavor)
 
         try:
-            frames, self.buf = parser(self.buf)
+            if self.deflate:
+                frames, self.buf = parser(self.buf, flags=True)
+            else:
+                frames, self.buf = parser(self.buf)
         except WSException as wse:
             # Couldn't parse all the frames, something went wrong, let's bail.
             self.close(wse.args[0])
             return
 
         for frame in frames:
-            opcode, data = frame
+            if self.deflate:
+                opcode, data, fin, rsv1 = frame
+                if opcode == NORMAL:
+                    # Put fragmented messages together, then decompress them.
+                    if not self.fragments:
+                        self.fragments_compressed = rsv1
+                    self.fragments.append(data)
+                    self.fragments_size += len(data)
+                    if self.fragments_size >= MAX_INFLATED_SIZE:
+                        self.close("Fragmented message too large")
+                        return
+                    if not fin:
+                        continue
+                    data = "".join(self.fragments)
+                    self.fragments = []
+                    self.fragments_size = 0
+                    if self.fragments_compressed:
+                        try:
+                            data = self.deflate.decompress(data)
+                        except (zlib.error, WSException) as err:
+                            self.close(str(err))
+                            return
+            else:
+                opcode, data = frame
             if opcode == NORMAL:
                 # Business as usual. Decode the frame, if we have a decoder.
                 if self.codec:
@@ -468,8 +668,13 @@ class WebSocketProtocol(ProtocolWrapper):
         if self.flavor == HYBI00:
             maker = make_hybi00_frame
         elif self.flavor in (HYBI07, HYBI10, RFC6455):
+            deflate = self.deflate
             if self.do_binary_frames:
-                maker = make_hybi07_frame_dwim
+                def maker(buf):
+                    return make_hybi07_frame_dwim(buf, deflate)
+            elif deflate:
+                def maker(buf):
+                    return make_hybi07_frame(deflate.compress(buf), rsv1=True)
             else:
                 maker = make_hybi07_frame
         else:
@@ -658,6 +863,17 @@ class WebSocketFactory(WrappingFactory):
     """
     Factory which wraps another factory to provide WebSockets transports for
     all of its protocols.
+
+    If deflate is set, permessage-deflate is used with clients supporting it,
+    with windows of at most deflate_max_wbits bits and a compression memory
+    level of deflate_memlevel.
     """
     noisy = False
     protocol = WebSocketProtocol
+
+    def __init__(self, wrappedFactory, deflate=False, deflate_max_wbits=15,
+                 deflate_memlevel=8):
+        WrappingFactory.__init__(self, wrappedFactory)
+        self.deflate = deflate
+        self.deflate_max_wbits = deflate_max_wbits
+        self.deflate_memlevel = deflate_memlevel
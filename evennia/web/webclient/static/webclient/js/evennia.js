@@ -357,12 +357,16 @@ An "emitter" object must have a function
                     data: {mode: 'receive', 'csessid': csessid},
                     success: function(data) {
                         // log("ajax data received:", data);
-                        if (data[0] === "ajax_keepalive") {
-                            // special ajax keepalive check - return immediately
-                            msg("", "keepalive");
-                        } else {
-                            // not a keepalive
-                            Evennia.emit(data[0], data[1], data[2]);
+                        // data is an array of all messages waiting for us
+                        for (var i = 0; i < data.length; i++) {
+                            var entry = data[i];
+                            if (entry[0] === "ajax_keepalive") {
+                                // special ajax keepalive check - return immediately
+                                msg("", "keepalive");
+                            } else {
+                                // not a keepalive
+                                Evennia.emit(entry[0], entry[1], entry[2]);
+                            }
                         }
                         stop_polling = false;
                         poll(); // immiately start a new request